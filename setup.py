@@ -55,6 +55,21 @@ setup(
             "colorlog",
             "flake8==3.5.0",
         ],
+        'numpy': [
+            "numpy",
+        ],
+        'msgpack': [
+            "msgpack>=1.0",
+        ],
+        'cbor': [
+            "cbor2",
+        ],
+        'orjson': [
+            "orjson",
+        ],
+        'ujson': [
+            "ujson",
+        ],
         'docs': [
             "Sphinx==1.4.5",
             "guzzle_sphinx_theme",
@@ -2,6 +2,8 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from struct import pack, unpack
+
 import eventlet
 
 
@@ -17,3 +19,21 @@ def assert_stops_raising(
             else:
                 return
             eventlet.sleep(interval)
+
+
+def recv_exactly(sock, length):
+    data = b''
+    while len(data) < length:
+        received = sock.recv(length - len(data))
+        assert received
+        data += received
+    return data
+
+
+def recv_message(sock):
+    header, = unpack('!I', recv_exactly(sock, 4))
+    return header >> 24, recv_exactly(sock, header & 0xffffff)
+
+
+def send_message(sock, body, message_type=0):
+    sock.sendall(pack('!I', (message_type << 24) | len(body)) + body)
@@ -3,14 +3,19 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import datetime
+from struct import pack
 from time import sleep
 
+import eventlet
 import pytest
 
+from wampy.errors import ConnectionError, WampyError
 from wampy.peers.clients import Client
 from wampy.roles.callee import callee
 from wampy.testing.helpers import wait_for_session
 
+from test.helpers import recv_exactly, recv_message, send_message
+
 
 class DateService(Client):
 
@@ -178,3 +183,154 @@ def test_respond_to_ping_with_pong(config_path, router):
         exceptionless = False
 
     assert exceptionless
+
+
+def unused_url():
+    server = eventlet.listen(('127.0.0.1', 0))
+    url = 'rs://127.0.0.1:{}'.format(server.getsockname()[1])
+    server.close()
+    return url
+
+
+@pytest.yield_fixture
+def slow_router():
+    """ A RawSocket Router that takes its time over the handshake.
+    """
+    server = eventlet.listen(('127.0.0.1', 0))
+
+    def serve():
+        while True:
+            sock, _ = server.accept()
+            recv_exactly(sock, 4)
+            eventlet.sleep(0.2)
+            sock.sendall(pack('!BBH', 0x7F, (15 << 4) | 1, 0))
+
+    thread = eventlet.spawn(serve)
+    yield 'rs://127.0.0.1:{}'.format(server.getsockname()[1])
+
+    thread.kill()
+    server.close()
+
+
+class WampRouter(object):
+    """ Just enough of a RawSocket Router to welcome a Client, and be
+    killed while it's connected.
+    """
+
+    def __init__(self):
+        self.server = eventlet.listen(('127.0.0.1', 0))
+        self.url = 'rs://127.0.0.1:{}'.format(self.server.getsockname()[1])
+        self.connections = []
+        self.thread = eventlet.spawn(self.serve)
+
+    def serve(self):
+        while True:
+            sock, _ = self.server.accept()
+            self.connections.append(sock)
+            eventlet.spawn(self.welcome, sock)
+
+    def welcome(self, sock):
+        recv_exactly(sock, 4)
+        sock.sendall(pack('!BBH', 0x7F, (15 << 4) | 1, 0))
+        # HELLO
+        recv_message(sock)
+        send_message(sock, b'[2,1234,{}]')
+
+    def kill(self):
+        self.thread.kill()
+        self.server.close()
+        for sock in self.connections:
+            sock.close()
+
+
+@pytest.yield_fixture
+def wamp_routers():
+    routers = [WampRouter(), WampRouter()]
+    yield routers
+
+    for router in routers:
+        router.kill()
+
+
+def test_fail_over_when_the_router_goes(monkeypatch, wamp_routers):
+    monkeypatch.setattr('wampy.peers.clients.RECONNECT_DELAY', 0)
+
+    client = Client(endpoints=[router.url for router in wamp_routers])
+    client.start()
+    first = client.router.url
+    assert client.session.id == 1234
+
+    # no heartbeat, but the Router closing the connection is enough
+    winner, = [r for r in wamp_routers if r.url == first]
+    winner.kill()
+
+    with eventlet.Timeout(1):
+        while client.router.url == first or client._reconnecting:
+            eventlet.sleep(0.01)
+
+    other, = [r for r in wamp_routers if r.url != first]
+    assert client.router.url == other.url
+    assert client.session.id == 1234
+
+    client._stopped = True
+    client.transport.abort()
+
+
+def test_lost_session_is_kept_while_reconnecting(monkeypatch):
+    monkeypatch.setattr('wampy.peers.clients.RECONNECT_DELAY', 0)
+
+    client = Client(url="ws://localhost:8080")
+    lost = client._session = object()
+    sessions = []
+
+    def start():
+        sessions.append(client.session)
+        raise ConnectionError("connection refused")
+
+    client.start = start
+    client.transport.abort = lambda: None
+
+    client._reconnect(lost)
+
+    assert sessions == [lost] * 5
+    assert client.session is lost
+
+
+def test_only_endpoints_reconnect_by_default():
+    assert not Client(url="ws://localhost:8080").reconnect
+    assert Client(url="ws://localhost:8080", reconnect=True).reconnect
+    assert Client(
+        endpoints=["ws://localhost:8080", "ws://localhost:8081"]).reconnect
+
+
+def test_endpoints_exclude_url():
+    with pytest.raises(WampyError):
+        Client(url='rs://localhost:8080', endpoints=['rs://localhost:8081'])
+
+
+def test_fastest_endpoint_is_chosen(wamp_routers, slow_router):
+    fast = wamp_routers[0]
+
+    client = Client(endpoints=[unused_url(), slow_router, fast.url])
+    transport = client._connect_fastest()
+
+    assert client.router.url == fast.url
+    assert client.transport is transport
+    assert list(client.router_latencies) == [fast.url]
+
+    # HELLO, WELCOME
+    transport.send([1, "realm1", {}])
+    assert transport.receive().payload == [2, 1234, {}]
+
+    # the slower is timed too, though not kept
+    eventlet.sleep(0.3)
+    assert slow_router in client.router_latencies
+
+    transport.disconnect()
+
+
+def test_no_endpoint_connects():
+    client = Client(endpoints=[unused_url(), unused_url()])
+
+    with pytest.raises(ConnectionError):
+        client._connect_fastest()
@@ -0,0 +1,245 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import socket
+import zlib
+
+import eventlet
+import pytest
+
+from wampy.errors import WebsocktProtocolError
+from wampy.peers.routers import Router
+from wampy.transports import WebSocket
+from wampy.transports.websocket.compression import PerMessageDeflate
+from wampy.transports.websocket.frames import mask
+from wampy.transports.websocket.reader import FrameReader
+
+from test.test_frames import make_message, make_server_frame
+
+
+def server_compress(data, compressor=None):
+    compressor = compressor or zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush(
+        zlib.Z_SYNC_FLUSH)
+    assert compressed.endswith(b'\x00\x00\xff\xff')
+    return compressed[:-4]
+
+
+def test_offer():
+    assert PerMessageDeflate().offer() == (
+        'permessage-deflate; client_max_window_bits')
+
+    assert PerMessageDeflate(
+        client_no_context_takeover=True, server_no_context_takeover=True,
+        client_max_window_bits=10, server_max_window_bits=12,
+    ).offer() == (
+        'permessage-deflate; client_no_context_takeover; '
+        'server_no_context_takeover; client_max_window_bits=10; '
+        'server_max_window_bits=12'
+    )
+
+
+def test_accept():
+    offer = PerMessageDeflate(threshold=10)
+
+    agreed = offer.accept(
+        'permessage-deflate; server_no_context_takeover; '
+        'client_max_window_bits="12"'
+    )
+
+    assert agreed is not offer
+    assert agreed.server_no_context_takeover is True
+    assert agreed.client_no_context_takeover is False
+    assert agreed.client_max_window_bits == 12
+    assert agreed.threshold == 10
+
+
+@pytest.mark.parametrize("response", [
+    'x-webkit-deflate-frame',
+    'permessage-deflate, permessage-deflate',
+    'permessage-deflate; client_max_window_bits=16',
+    # which zlib can't compress with
+    'permessage-deflate; client_max_window_bits=8',
+    'permessage-deflate; server_no_context_takeover=1',
+    'permessage-deflate; unknown_parameter',
+])
+def test_accept_invalid_response(response):
+    with pytest.raises(WebsocktProtocolError):
+        PerMessageDeflate().accept(response)
+
+
+@pytest.mark.parametrize("response", [
+    'permessage-deflate; server_max_window_bits=11',
+    'permessage-deflate; client_max_window_bits=11',
+])
+def test_window_must_be_no_larger_than_offered(response):
+    compression = PerMessageDeflate(
+        client_max_window_bits=10, server_max_window_bits=10)
+
+    with pytest.raises(WebsocktProtocolError):
+        compression.accept(response)
+
+    agreed = compression.accept(
+        'permessage-deflate; server_max_window_bits=9; '
+        'client_max_window_bits=10'
+    )
+    assert agreed.server_max_window_bits == 9
+    assert agreed.client_max_window_bits == 10
+
+
+def test_client_window_must_be_one_zlib_compresses_with():
+    with pytest.raises(ValueError):
+        PerMessageDeflate(client_max_window_bits=8)
+
+    # though the Router may use one
+    PerMessageDeflate(server_max_window_bits=8)
+
+
+@pytest.mark.parametrize("client_no_context_takeover", [True, False])
+def test_compress_with_and_without_context_takeover(
+    client_no_context_takeover
+):
+    compression = PerMessageDeflate(
+        client_no_context_takeover=client_no_context_takeover)
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    for _ in range(3):
+        message = make_message(1000)
+        compressed = compression.compress(message)
+
+        assert len(compressed) < len(message)
+        if client_no_context_takeover:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        assert decompressor.decompress(
+            compressed + b'\x00\x00\xff\xff') == message
+
+
+def test_decompress_with_context_takeover():
+    compression = PerMessageDeflate()
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    for _ in range(3):
+        message = make_message(1000)
+        compressed = server_compress(message, compressor)
+
+        assert compression.decompress(compressed) == message
+
+
+def test_decompress_beyond_max_length():
+    compressed = server_compress(make_message(100 * 1024))
+
+    with pytest.raises(WebsocktProtocolError):
+        PerMessageDeflate().decompress(compressed, max_length=64 * 1024)
+
+
+def set_rsv1(frame_bytes):
+    return bytearray([frame_bytes[0] | 0x40]) + frame_bytes[1:]
+
+
+def test_reader_decompresses_messages():
+    message = make_message(10 * 1024)
+    compressed = server_compress(message)
+
+    first, second = compressed[:100], compressed[100:]
+    frames = [
+        set_rsv1(make_server_frame(compressed)),
+        set_rsv1(make_server_frame(first, fin=False)),
+        make_server_frame(b'ping', opcode=0x9),
+        make_server_frame(second, opcode=0x0),
+        make_server_frame(make_message(20)),
+    ]
+
+    sender, receiver = socket.socketpair()
+    sender.sendall(b''.join(frames))
+    sender.close()
+
+    reader = FrameReader(receiver, compression=PerMessageDeflate())
+
+    assert reader.read_message().body == message
+    assert reader.read_message().opcode == 0x9
+    fragmented = reader.read_message()
+    assert fragmented.body == message
+    assert fragmented.payload == json.loads(message.decode('utf-8'))
+    assert reader.read_message().body == make_message(20)
+
+    receiver.close()
+
+
+def test_reader_rejects_rsv1_without_compression():
+    sender, receiver = socket.socketpair()
+    sender.sendall(set_rsv1(make_server_frame(server_compress(b'[1]'))))
+    sender.close()
+
+    reader = FrameReader(receiver)
+
+    with pytest.raises(WebsocktProtocolError):
+        reader.read_message()
+
+    receiver.close()
+
+
+class TestCompressedSend(object):
+
+    @pytest.yield_fixture
+    def websocket(self):
+        transport = WebSocket()
+        transport.register_router(
+            Router(
+                url="ws://localhost:8080", fragment_size=100,
+                compression=PerMessageDeflate(threshold=100),
+            )
+        )
+        transport.compression = transport._negotiate_extensions({
+            'sec-websocket-extensions': 'permessage-deflate',
+        })
+
+        transport.socket, receiver = socket.socketpair()
+        yield transport, receiver
+
+        transport.socket.close()
+        receiver.close()
+
+    def read_frame(self, receiver):
+        first_byte, second_byte = bytearray(receiver.recv(2))
+        length = second_byte & 0x7f
+        assert length < 126
+
+        mask_key = receiver.recv(4)
+        body = b''
+        while len(body) < length:
+            body += receiver.recv(length - len(body))
+
+        return first_byte, mask(mask_key, body)
+
+    def test_small_message_is_not_compressed(self, websocket):
+        transport, receiver = websocket
+
+        transport.send([1, "realm1", {}])
+
+        first_byte, body = self.read_frame(receiver)
+        assert first_byte == 0x81
+        assert body == b'[1,"realm1",{}]'
+
+    def test_large_message_is_compressed(self, websocket):
+        transport, receiver = websocket
+        message = [16, 1, {}, "topic", [
+            {"reading": i, "unit": "celsius"} for i in range(200)]]
+
+        eventlet.spawn(transport.send, message)
+
+        first_byte, body = self.read_frame(receiver)
+        assert first_byte == 0x41  # RSV1, text, not final
+        compressed = body
+
+        while not first_byte & 0x80:
+            first_byte, body = self.read_frame(receiver)
+            assert first_byte & 0x7f == 0x0  # continuation, no RSV1
+            compressed += body
+
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        payload = decompressor.decompress(compressed + b'\x00\x00\xff\xff')
+        assert json.loads(payload.decode('utf-8')) == message
@@ -0,0 +1,333 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import socket
+from struct import pack
+
+import eventlet
+import pytest
+
+from wampy.errors import (
+    IncompleteFrameError, MessageTooBigError, WebsocktProtocolError,
+)
+from wampy.transports.websocket.frames import (
+    NUMPY_MASK_THRESHOLD, ClientFrame, CloseFrame, ServerFrame, _numpy_mask,
+    mask,
+)
+from wampy.transports.websocket.reader import FrameReader
+
+
+def make_server_frame(payload, opcode=0x1, fin=True):
+    """ Build an unmasked Server -> Client frame around ``payload``.
+    """
+    length = len(payload)
+    header = pack('!B', (fin << 7) | opcode)
+
+    if length < 126:
+        header += pack('!B', length)
+    elif length < 1 << 16:
+        header += pack('!B', 126) + pack('!H', length)
+    else:
+        header += pack('!B', 127) + pack('!Q', length)
+
+    return header + payload
+
+
+def make_message(size):
+    """ A JSON encoded RESULT message exactly ``size`` bytes long.
+    """
+    empty = json.dumps([50, 1, {}, [""]], separators=(',', ':'))
+    padding = "x" * (size - len(empty))
+    message = json.dumps([50, 1, {}, [padding]], separators=(',', ':'))
+    assert len(message) == size
+    return message.encode('utf-8')
+
+
+@pytest.mark.parametrize("size, header_length", [
+    (125, 2),
+    (126, 4),
+    (32 * 1024 + 1, 4),
+    (64 * 1024 - 1, 4),
+    (64 * 1024, 10),
+    (5 * 1024 * 1024, 10),
+])
+def test_parse_header(size, header_length):
+    frame_bytes = make_server_frame(make_message(size))
+
+    assert ServerFrame.parse_header(frame_bytes) == (header_length, size)
+    assert ServerFrame.parse_header(
+        memoryview(frame_bytes)[:header_length]) == (header_length, size)
+
+
+@pytest.mark.parametrize("size", [126, 64 * 1024, 5 * 1024 * 1024])
+def test_incomplete_header(size):
+    frame_bytes = make_server_frame(make_message(size))
+
+    with pytest.raises(IncompleteFrameError):
+        ServerFrame.parse_header(frame_bytes[:3])
+
+
+@pytest.mark.parametrize("size", [126, 64 * 1024, 5 * 1024 * 1024])
+def test_server_frame_payload(size):
+    message = make_message(size)
+    frame = ServerFrame(make_server_frame(message))
+
+    assert len(frame.body) == size
+    assert frame.payload == json.loads(message.decode('utf-8'))
+
+
+@pytest.mark.parametrize("size", [126, 64 * 1024, 5 * 1024 * 1024])
+def test_server_frame_with_body_cut_out(size):
+    message = make_message(size)
+    frame_bytes = make_server_frame(message)
+    header_length = len(frame_bytes) - size
+
+    frame = ServerFrame(
+        frame_bytes[:header_length], body=frame_bytes[header_length:])
+
+    assert frame.body == message
+    assert frame.payload == json.loads(message.decode('utf-8'))
+
+
+@pytest.mark.parametrize("size", [126, 64 * 1024, 5 * 1024 * 1024])
+def test_incomplete_frame(size):
+    frame_bytes = make_server_frame(make_message(size))
+
+    with pytest.raises(IncompleteFrameError) as exc_info:
+        ServerFrame(frame_bytes[:-10])
+
+    assert exc_info.value.required_bytes == 10
+
+
+@pytest.yield_fixture
+def stream_reader():
+    """ Make a ``FrameReader`` that will read ``stream`` off a socket.
+    """
+    sockets = []
+
+    def make_reader(stream, **kwargs):
+        sender, receiver = socket.socketpair()
+        sockets.append(receiver)
+
+        def send():
+            sender.sendall(stream)
+            sender.close()
+
+        eventlet.spawn(send)
+        return FrameReader(receiver, bufsize=1024, **kwargs)
+
+    yield make_reader
+
+    for receiver in sockets:
+        receiver.close()
+
+
+@pytest.mark.parametrize("size", [126, 64 * 1024, 5 * 1024 * 1024])
+def test_frame_reader(stream_reader, size):
+    messages = [make_message(size), make_message(20), make_message(size)]
+    stream = b''.join(make_server_frame(message) for message in messages)
+
+    reader = stream_reader(stream)
+    frames = [reader.read_frame() for _ in messages]
+
+    assert [frame.body for frame in frames] == messages
+    assert reader.read_frame() is None
+
+
+def test_buffer_shrinks_after_a_large_frame(stream_reader):
+    messages = [make_message(5 * 1024 * 1024), make_message(20)]
+    stream = b''.join(make_server_frame(message) for message in messages)
+
+    reader = stream_reader(stream)
+
+    assert reader.read_frame().body == messages[0]
+    assert len(reader._buffer) == 1024
+    assert reader.read_frame().body == messages[1]
+    assert len(reader._buffer) == 1024
+
+
+def fragment(message, fragment_size):
+    fragments = [
+        message[i:i + fragment_size]
+        for i in range(0, len(message), fragment_size)
+    ]
+    last = len(fragments) - 1
+
+    return [
+        make_server_frame(
+            body, opcode=0x1 if i == 0 else 0x0, fin=i == last)
+        for i, body in enumerate(fragments)
+    ]
+
+
+@pytest.mark.parametrize("size", [126, 64 * 1024, 5 * 1024 * 1024])
+def test_fragmented_message_is_reassembled(stream_reader, size):
+    message = make_message(size)
+    frames = fragment(message, size // 3 + 1)
+    # a ping may arrive in between the fragments of a message
+    frames.insert(1, make_server_frame(b'ping', opcode=0x9))
+    frames.append(make_server_frame(make_message(20)))
+
+    reader = stream_reader(b''.join(frames))
+
+    ping = reader.read_message()
+    assert ping.opcode == 0x9
+    assert ping.payload == b'ping'
+
+    reassembled = reader.read_message()
+    assert reassembled.body == message
+    assert reassembled.payload == json.loads(message.decode('utf-8'))
+
+    assert reader.read_message().body == make_message(20)
+    assert reader.read_message() is None
+
+
+def test_fragmented_message_too_large(stream_reader):
+    frames = fragment(make_message(64 * 1024), 1024)
+
+    reader = stream_reader(b''.join(frames), max_message_size=32 * 1024)
+
+    with pytest.raises(MessageTooBigError):
+        reader.read_message()
+
+    # refused on the header of the fragment that took it over the limit
+    assert reader._message_length <= 32 * 1024
+
+
+def test_frame_too_large(stream_reader):
+    frames = [make_server_frame(make_message(20)), make_server_frame(
+        make_message(4096))]
+
+    reader = stream_reader(b''.join(frames), max_frame_size=2048)
+
+    assert reader.read_message().body == make_message(20)
+    with pytest.raises(MessageTooBigError):
+        reader.read_message()
+
+
+def test_frame_too_large_is_refused_before_its_body_arrives(stream_reader):
+    # a header claiming a 1G body, with no body to follow
+    reader = stream_reader(
+        b'\x81\x7f' + pack('!Q', 2 ** 30), max_message_size=2 ** 20)
+
+    with pytest.raises(MessageTooBigError):
+        reader.read_message()
+
+    assert len(reader._buffer) == 1024
+
+
+def test_messages_up_to_the_limit_are_read(stream_reader):
+    first = fragment(make_message(1024), 300)
+    second = [make_server_frame(make_message(1024))]
+
+    reader = stream_reader(
+        b''.join(first + second), max_message_size=1024, max_frame_size=1024)
+
+    assert reader.read_message().body == make_message(1024)
+    assert reader.read_message().body == make_message(1024)
+
+
+def test_continuation_frame_without_a_message(stream_reader):
+    reader = stream_reader(make_server_frame(b'[1]', opcode=0x0))
+
+    with pytest.raises(WebsocktProtocolError):
+        reader.read_message()
+
+
+def test_new_message_before_last_is_complete(stream_reader):
+    frames = fragment(make_message(1024), 100)
+    reader = stream_reader(b''.join(frames[:2] + frames))
+
+    with pytest.raises(WebsocktProtocolError):
+        reader.read_message()
+
+
+def reference_mask(mask_key, data):
+    return bytes(bytearray(
+        byte ^ bytearray(mask_key)[i % 4]
+        for i, byte in enumerate(bytearray(data))
+    ))
+
+
+@pytest.mark.parametrize("length", [0, 1, 3, 4, 5, 126, 1000, 64 * 1024])
+def test_mask_matches_byte_by_byte_masking(length):
+    mask_key = os.urandom(4)
+    data = os.urandom(length)
+
+    assert mask(mask_key, data) == reference_mask(mask_key, data)
+
+
+@pytest.mark.parametrize("length", [
+    NUMPY_MASK_THRESHOLD, NUMPY_MASK_THRESHOLD + 3,
+])
+def test_numpy_mask_matches_byte_by_byte_masking(length):
+    pytest.importorskip("numpy")
+
+    mask_key = os.urandom(4)
+    data = os.urandom(length)
+
+    assert _numpy_mask(mask_key, data) == reference_mask(mask_key, data)
+
+
+def test_client_frame_is_masked():
+    message = u'[48,1,{},"com.example.é",[],{}]'
+    frame = ClientFrame(message)
+
+    header_length = 2
+    mask_key = frame.payload[header_length:header_length + 4]
+    masked_body = frame.payload[header_length + 4:]
+
+    assert reference_mask(mask_key, masked_body) == message.encode('utf-8')
+
+
+@pytest.mark.parametrize("size, header_length", [
+    (125, 6), (126, 8), (64 * 1024, 14),
+])
+def test_client_frame_header(size, header_length):
+    message = make_message(size)
+    frame = ClientFrame(message)
+
+    assert len(frame) == size
+    assert len(frame.header) == header_length
+    assert frame.header[-4:] == frame.mask_key
+    assert len(frame.masked_body) == size
+    assert frame.payload == frame.header + frame.masked_body
+
+
+def test_client_frame_encodes_text_once():
+    message = u'[48,1,{},"com.example.é",[],{}]'
+
+    assert ClientFrame(message).body == message.encode('utf-8')
+    assert ClientFrame(message.encode('utf-8')).body == (
+        message.encode('utf-8'))
+
+
+def test_close_frame():
+    frame = CloseFrame(1001, u"é" * 100)
+
+    assert frame.opcode == 0x8
+    assert frame.body[:2] == b'\x03\xe9'
+    # cut short, but on a character boundary
+    assert frame.body[2:] == (u"é" * 61).encode('utf-8')
+
+
+@pytest.mark.parametrize("body, code, reason", [
+    (b'', 1005, u''),
+    (b'\x03\xe8', 1000, u''),
+    (b'\x03\xe9going away', 1001, u'going away'),
+])
+def test_server_close_frame(body, code, reason):
+    frame = ServerFrame(make_server_frame(body, opcode=0x8))
+
+    assert (frame.close_code, frame.close_reason) == (code, reason)
+
+
+@pytest.mark.parametrize("body", [b'\x03', b'\x03\xe8\xff'])
+def test_invalid_server_close_frame(body):
+    frame = ServerFrame(make_server_frame(body, opcode=0x8))
+
+    with pytest.raises(WebsocktProtocolError):
+        frame.close_code, frame.close_reason
@@ -0,0 +1,114 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import socket
+
+import eventlet
+import pytest
+
+from wampy.peers.clients import Client
+from wampy.transports.heartbeat import Heartbeat
+
+
+class FakeTransport(object):
+    """ Answers each ping after ``delay`` seconds, unless ``silent``.
+    """
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.silent = False
+        self.heartbeat = None
+        self.pings = []
+
+    def ping(self, payload):
+        self.pings.append(payload)
+        if not self.silent:
+            eventlet.spawn_after(self.delay, self.heartbeat.pong, payload)
+
+
+@pytest.yield_fixture
+def heartbeat():
+    transport = FakeTransport()
+    timeouts = []
+
+    heartbeat = Heartbeat(
+        transport, interval=0.02, timeout=0.1,
+        on_timeout=lambda: timeouts.append(True),
+    )
+    transport.heartbeat = heartbeat
+    heartbeat.timeouts = timeouts
+
+    yield heartbeat
+
+    heartbeat.stop()
+
+
+def test_no_stats_before_a_pong(heartbeat):
+    assert heartbeat.rtt is None
+    assert heartbeat.stats == {
+        'rtt': None, 'min': None, 'max': None, 'avg': None,
+        'samples': 0, 'pings_sent': 0, 'pongs_received': 0,
+    }
+
+
+def test_round_trip_times(heartbeat):
+    heartbeat.start()
+    eventlet.sleep(0.15)
+
+    stats = heartbeat.stats
+    assert stats['pings_sent'] >= 3
+    assert stats['pongs_received'] >= 2
+    assert stats['samples'] == stats['pongs_received']
+    assert 0.01 <= stats['min'] <= stats['avg'] <= stats['max'] < 0.1
+    assert heartbeat.timeouts == []
+
+
+def test_times_out_when_pongs_stop(heartbeat):
+    heartbeat.start()
+    eventlet.sleep(0.05)
+    assert heartbeat.stats['pongs_received']
+
+    heartbeat.transport.silent = True
+    eventlet.sleep(0.25)
+
+    assert heartbeat.timeouts == [True]
+    pings_sent = heartbeat.pings_sent
+
+    # and the heartbeat has stopped
+    eventlet.sleep(0.05)
+    assert heartbeat.pings_sent == pings_sent
+
+
+def test_unexpected_pong_is_ignored(heartbeat):
+    heartbeat.pong(b'not one of ours')
+
+    assert heartbeat.stats['pongs_received'] == 0
+
+
+def test_stop(heartbeat):
+    heartbeat.start()
+    heartbeat.stop()
+    eventlet.sleep(0.05)
+
+    assert heartbeat.pings_sent == 0
+
+
+def test_client_reconnects(monkeypatch):
+    monkeypatch.setattr('wampy.peers.clients.RECONNECT_DELAY', 0)
+
+    client = Client(url="ws://localhost:8080")
+    attempts = []
+
+    def start():
+        attempts.append(True)
+        if len(attempts) < 3:
+            raise socket.error("connection refused")
+
+    client.start = start
+    client.transport.abort = lambda: None
+
+    assert client.transport.connection_lost_callback == client._reconnect
+    client.transport.connection_lost_callback()
+
+    assert len(attempts) == 3
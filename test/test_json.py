@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Every JSON backend must agree on what WAMP puts through them.
+"""
+import json
+from collections import namedtuple
+from decimal import Decimal
+
+import pytest
+import six
+
+from wampy import serializers
+from wampy.errors import WampProtocolError, WampyError
+from wampy.serializers import (
+    JSON_BACKENDS, JsonSerializer, StdlibJsonBackend, get_json_backend,
+    set_json_backend,
+)
+
+
+@pytest.fixture(params=sorted(JSON_BACKENDS))
+def backend(request):
+    try:
+        return get_json_backend(request.param)
+    except WampyError:
+        pytest.skip("{} is not installed".format(request.param))
+
+
+@pytest.mark.parametrize("message", [
+    # an EVENT, with ids up to 2 ** 53 as WAMP allows
+    [36, 2 ** 53, 1, {}, [u"hello"], {u"key": u"value"}],
+    # unicode, in and out of the Basic Multilingual Plane
+    [16, 1, {}, u"topic", [u"café", u"日本語", u"\U0001f600"]],
+    # integers beyond 64 bits, either way
+    [48, 1, {}, u"proc", [2 ** 63, 2 ** 64, 2 ** 100, -2 ** 100]],
+    [48, 1, {}, u"proc", [-2 ** 63, -2 ** 63 - 1, 2 ** 63 - 1]],
+    # and the usual suspects
+    [50, 1, {}, [None, True, False, 0, -1, 1.5, u"", [], {}]],
+    [8, 48, 1, {}, u"wamp.error.runtime_error", [u"a\nb\t\"c\"\\/"]],
+])
+def test_round_trip(backend, message):
+    payload = backend.dumps(message)
+
+    assert isinstance(payload, bytes)
+    assert backend.loads(payload) == message
+
+
+def test_output_is_utf8_and_compact(backend):
+    payload = backend.dumps([16, 1, {}, u"café"])
+
+    assert payload == u'[16,1,{},"café"]'.encode('utf-8')
+
+
+@pytest.mark.parametrize("payload, message", [
+    (b'[16, 1, {}, "caf\\u00e9"]', [16, 1, {}, u"café"]),
+    # a surrogate pair
+    (b'["\\ud83d\\ude00"]', [u"\U0001f600"]),
+    (b' [ 1 , 18446744073709551616 ] ', [1, 2 ** 64]),
+    (b'[123456789012345678901234567890]', [123456789012345678901234567890]),
+    # the first integer below what 64 bits can hold, with only 19 digits
+    (b'[1,-9223372036854775809]', [1, -2 ** 63 - 1]),
+])
+def test_loads(backend, payload, message):
+    assert backend.loads(payload) == message
+
+
+def test_large_integers_are_not_rounded(backend):
+    value = 2 ** 64 + 1
+    loaded = backend.loads(backend.dumps([value]))[0]
+
+    assert loaded == value
+    assert isinstance(loaded, six.integer_types)
+
+
+def test_backends_agree_with_the_standard_library(backend):
+    message = [
+        36, 5512315355, 4429313566, {}, [u"100éfa", 1.5, None, True],
+        {u"key": [1, 2, 3], u"nested": {u"deep": u"value"}},
+    ]
+
+    assert json.loads(backend.dumps(message).decode('utf-8')) == message
+    assert backend.loads(StdlibJsonBackend().dumps(message)) == message
+
+
+def test_unserializable_message(backend):
+    serializer = JsonSerializer()
+    serializer.backend = backend
+
+    with pytest.raises(WampProtocolError):
+        serializer.serialize([16, 1, {}, u"topic", [object()]])
+
+
+@pytest.mark.parametrize("name", ["orjson", "simplejson"])
+def test_simplejson_types_are_still_sent(name):
+    pytest.importorskip("simplejson")
+    try:
+        backend = get_json_backend(name)
+    except WampyError:
+        pytest.skip("{} is not installed".format(name))
+
+    Point = namedtuple('Point', 'x y')
+    payload = backend.dumps(
+        [16, 1, {}, u"topic", [Point(1, 2), Decimal('1.5')]])
+
+    assert json.loads(payload.decode('utf-8')) == [
+        16, 1, {}, u"topic", [{u"x": 1, u"y": 2}, 1.5]]
+
+
+def test_fastest_backend_is_chosen_by_default():
+    expected = None
+    for name in serializers.JSON_BACKEND_PREFERENCES:
+        try:
+            get_json_backend(name)
+        except WampyError:
+            continue
+        expected = name
+        break
+
+    assert get_json_backend().name == expected
+
+
+def test_serializer_with_named_backend():
+    assert JsonSerializer(backend='json').backend.name == 'json'
+
+
+def test_unknown_backend():
+    with pytest.raises(WampyError):
+        JsonSerializer(backend='yaml')
+
+
+def test_set_json_backend(monkeypatch):
+    monkeypatch.setattr(serializers, 'JSON_BACKEND', serializers.JSON_BACKEND)
+
+    set_json_backend('json')
+
+    assert JsonSerializer().backend.name == 'json'
+
+
+def test_json_serialize_uses_the_set_backend(monkeypatch):
+    monkeypatch.setattr(serializers, 'JSON_BACKEND', serializers.JSON_BACKEND)
+    used = []
+
+    class RecordingBackend(StdlibJsonBackend):
+        def dumps(self, message):
+            used.append(message)
+            return super(RecordingBackend, self).dumps(message)
+
+    monkeypatch.setitem(JSON_BACKENDS, 'recording', RecordingBackend)
+    set_json_backend('recording')
+
+    assert serializers.json_serialize([1, u"café"]) == u'[1,"café"]'
+    assert used == [[1, u"café"]]
@@ -0,0 +1,307 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import socket
+from struct import pack, unpack
+
+import eventlet
+import pytest
+
+from wampy.errors import ConnectionError, WampProtocolError
+from wampy.peers.clients import Client
+from wampy.peers.routers import Router
+from wampy.transports import RawSocket
+from wampy.transports.rawsocket.connection import length_exponent
+
+from test.helpers import recv_exactly, recv_message, send_message
+
+
+@pytest.yield_fixture
+def rawsocket_router(request, tmpdir):
+    """ Listen as a RawSocket Router would, and hand each connection to
+    ``handler`` once the handshake is done.
+
+    Listens on TCP, unless parametrized with "unix".
+
+    """
+    if getattr(request, 'param', 'tcp') == 'unix':
+        path = str(tmpdir.join('router.socket'))
+        server = eventlet.listen(path, family=socket.AF_UNIX)
+        url = 'rs+unix://{}'.format(path)
+    else:
+        server = eventlet.listen(('127.0.0.1', 0))
+        url = 'rs://127.0.0.1:{}'.format(server.getsockname()[1])
+
+    state = {
+        'handler': None,
+        'serializers': (1,),
+        'length_exponent': 15,
+        'handshakes': [],
+    }
+
+    def serve():
+        while True:
+            sock, _ = server.accept()
+            magic, second_byte, _ = unpack('!BBH', recv_exactly(sock, 4))
+            assert magic == 0x7F
+            state['handshakes'].append(second_byte)
+
+            serializer_id = second_byte & 0x0f
+            if serializer_id not in state['serializers']:
+                # "serializer unsupported"
+                sock.sendall(pack('!BBH', 0x7F, 1 << 4, 0))
+                sock.close()
+                continue
+
+            sock.sendall(pack(
+                '!BBH', 0x7F,
+                (state['length_exponent'] << 4) | serializer_id, 0,
+            ))
+            eventlet.spawn(state['handler'], sock)
+
+    thread = eventlet.spawn(serve)
+    state['url'] = url
+
+    yield state
+
+    thread.kill()
+    server.close()
+
+
+def echo(sock):
+    while True:
+        message_type, body = recv_message(sock)
+        if message_type == 1:
+            # answer a ping with a pong
+            message_type = 2
+        send_message(sock, body, message_type)
+
+
+@pytest.mark.parametrize("url, port", [
+    ("rs://example.com", 8080),
+    ("tcp://example.com:9000", 9000),
+])
+def test_parse_url(url, port):
+    router = Router(url=url)
+
+    assert router.scheme == url.split(':')[0]
+    assert (router.host, router.port) == ("example.com", port)
+    assert isinstance(Client(url=url).transport, RawSocket)
+
+
+@pytest.mark.parametrize("max_length, exponent", [
+    (100, 0), (2 ** 9, 0), (2 ** 16 + 1, 7), (2 ** 24 - 2, 14),
+    # the longest a RawSocket message can be
+    (2 ** 24 - 1, 15), (2 ** 30, 15),
+])
+def test_length_exponent(max_length, exponent):
+    assert length_exponent(max_length) == exponent
+
+
+def test_send_and_receive(rawsocket_router):
+    rawsocket_router['handler'] = echo
+
+    transport = RawSocket()
+    transport.register_router(
+        Router(url=rawsocket_router['url'], max_message_size=2 ** 20))
+    transport.connect()
+
+    # JSON, with a maximum message length of 1M
+    assert rawsocket_router['handshakes'] == [(11 << 4) | 1]
+    assert transport.max_send_size == 2 ** 24 - 1
+
+    messages = [
+        [16, 1, {}, "topic", [u"café"]],
+        [16, 2, {}, "topic", ["x" * 100 * 1024]],
+    ]
+    for message in messages:
+        transport.send(message)
+
+    for message in messages:
+        assert transport.receive().payload == message
+
+    transport.disconnect()
+
+
+@pytest.mark.parametrize("rawsocket_router", ["unix"], indirect=True)
+def test_unix_socket(rawsocket_router):
+    rawsocket_router['handler'] = echo
+
+    client = Client(url=rawsocket_router['url'])
+    transport = client.transport
+    assert transport.unix_socket_path.endswith('router.socket')
+
+    transport.connect()
+    assert transport.socket.family == socket.AF_UNIX
+
+    transport.send([1, "realm1", {}])
+    assert transport.receive().payload == [1, "realm1", {}]
+
+    transport.disconnect()
+
+
+def test_ping_is_answered(rawsocket_router):
+    pongs = eventlet.Queue()
+
+    def ping(sock):
+        send_message(sock, b'are you there?', message_type=1)
+        send_message(sock, b'[1]')
+        pongs.put(recv_message(sock))
+
+    rawsocket_router['handler'] = ping
+
+    transport = RawSocket()
+    transport.register_router(Router(url=rawsocket_router['url']))
+    transport.connect()
+
+    assert transport.receive().payload == [1]
+    assert pongs.get(timeout=1) == (2, b'are you there?')
+
+    transport.disconnect()
+
+
+def test_serializers_are_tried_in_turn(rawsocket_router):
+    pytest.importorskip("msgpack")
+
+    rawsocket_router['handler'] = echo
+    rawsocket_router['serializers'] = (1,)
+
+    transport = RawSocket()
+    transport.register_router(
+        Router(url=rawsocket_router['url'], serializers=["msgpack", "json"]))
+    transport.connect()
+
+    assert [
+        second_byte & 0x0f for second_byte in rawsocket_router['handshakes']
+    ] == [2, 1]
+    assert transport.serializer.SUBPROTOCOL == 'wamp.2.json'
+
+    transport.send([1, "realm1", {}])
+    body = transport.receive().body
+    assert json.loads(body.decode('utf-8')) == [1, "realm1", {}]
+
+    transport.disconnect()
+
+
+def test_no_serializer_accepted(rawsocket_router):
+    rawsocket_router['serializers'] = ()
+
+    transport = RawSocket()
+    transport.register_router(Router(url=rawsocket_router['url']))
+
+    with pytest.raises(WampProtocolError):
+        transport.connect()
+
+
+def test_message_longer_than_router_accepts(rawsocket_router):
+    rawsocket_router['handler'] = echo
+    rawsocket_router['length_exponent'] = 0
+
+    transport = RawSocket()
+    transport.register_router(Router(url=rawsocket_router['url']))
+    transport.connect()
+
+    assert transport.max_send_size == 512
+
+    with pytest.raises(WampProtocolError):
+        transport.send([16, 1, {}, "topic", ["x" * 512]])
+
+    transport.disconnect()
+
+
+def test_send_before_connecting():
+    transport = RawSocket()
+    transport.register_router(Router(url='rs://localhost:8080'))
+
+    with pytest.raises(ConnectionError):
+        transport.send([1, "realm1", {}])
+
+
+def test_socket_is_closed_when_the_handshake_fails():
+    server = eventlet.listen(('127.0.0.1', 0))
+    closed = eventlet.Event()
+
+    def serve():
+        sock, _ = server.accept()
+        recv_exactly(sock, 4)
+        # not a RawSocket Router
+        sock.sendall(b'HTTP')
+        closed.send(sock.recv(1) == b'')
+
+    thread = eventlet.spawn(serve)
+
+    transport = RawSocket()
+    transport.register_router(
+        Router(url='rs://127.0.0.1:{}'.format(server.getsockname()[1])))
+
+    with pytest.raises(WampProtocolError):
+        transport.connect()
+
+    with eventlet.Timeout(1):
+        assert closed.wait()
+
+    thread.kill()
+    server.close()
+
+
+def test_message_longer_than_agreed(rawsocket_router):
+    def send_too_much(sock):
+        send_message(sock, b'[' + b' ' * 2048 + b']')
+
+    rawsocket_router['handler'] = send_too_much
+
+    transport = RawSocket()
+    transport.register_router(
+        Router(url=rawsocket_router['url'], max_message_size=1024))
+    transport.connect()
+
+    with pytest.raises(WampProtocolError):
+        transport.receive()
+
+    transport.disconnect()
+
+
+def test_heartbeat(rawsocket_router):
+    rawsocket_router['handler'] = echo
+
+    transport = RawSocket()
+    transport.register_router(Router(
+        url=rawsocket_router['url'], heartbeat_interval=0.02))
+    transport.connect()
+
+    # pongs are handled as messages are read
+    reader = eventlet.spawn(transport.receive)
+    eventlet.sleep(0.1)
+    reader.kill()
+
+    stats = transport.heartbeat.stats
+    assert stats['pongs_received'] >= 2
+    assert stats['rtt'] < 0.02
+
+    transport.disconnect()
+
+
+def test_heartbeat_times_out(rawsocket_router):
+    def never_answer(sock):
+        while True:
+            recv_message(sock)
+
+    rawsocket_router['handler'] = never_answer
+
+    transport = RawSocket()
+    transport.register_router(Router(
+        url=rawsocket_router['url'], heartbeat_interval=0.02,
+        heartbeat_timeout=0.05,
+    ))
+    lost = eventlet.Event()
+    transport.connection_lost_callback = lambda: lost.send(True)
+    transport.connect()
+
+    with eventlet.Timeout(1):
+        assert lost.wait()
+
+    # the socket has been torn down
+    with pytest.raises(Exception):
+        transport.receive()
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import socket
+
+import pytest
+
+from wampy.errors import WampProtocolError, WampyError, WebsocktProtocolError
+from wampy.message_handler import MessageHandler
+from wampy.peers.routers import Router
+from wampy.serializers import (
+    CborSerializer, JsonSerializer, LazyPayload, LazySerializer,
+    MsgPackSerializer, get_serializers,
+)
+from wampy.transports import WebSocket
+from wampy.transports.websocket.frames import ServerFrame, mask
+
+from test.test_frames import make_server_frame
+
+
+MESSAGE = [
+    36, 5512315355, 4429313566, {}, [u"100éfa", 1.5, None, True],
+    {u"key": [1, 2, 3], u"nested": {u"deep": u"value"}},
+]
+
+
+@pytest.fixture(params=["json", "msgpack", "cbor"])
+def serializer(request):
+    if request.param == "msgpack":
+        pytest.importorskip("msgpack")
+        return MsgPackSerializer()
+
+    if request.param == "cbor":
+        pytest.importorskip("cbor2")
+        return CborSerializer()
+
+    return JsonSerializer()
+
+
+def test_round_trip(serializer):
+    payload = serializer.serialize(MESSAGE)
+
+    assert isinstance(payload, bytes)
+    assert serializer.deserialize(payload) == MESSAGE
+
+
+def test_server_frame_decodes_with_serializer(serializer):
+    opcode = 0x2 if serializer.BINARY else 0x1
+    frame_bytes = make_server_frame(serializer.serialize(MESSAGE), opcode)
+
+    frame = ServerFrame(frame_bytes, serializer=serializer)
+
+    assert frame.opcode == opcode
+    assert frame.payload == MESSAGE
+
+
+@pytest.mark.parametrize("payload, head", [
+    (b'[36,5512315355,4429313566,{},[1]]', [36, 5512315355, 4429313566]),
+    (b' [ 2 , 9 , {"roles": {}}]', [2, 9]),
+    (b'[3,{},"wamp.error.no_such_realm"]', [3]),
+    (b'[6]', [6]),
+    (b'[8,1.5,3]', [8]),
+    (b'{"not": "a message"}', []),
+])
+def test_json_peek(payload, head):
+    assert JsonSerializer().peek(payload, 3) == head
+
+
+def test_msgpack_peek():
+    pytest.importorskip("msgpack")
+    serializer = MsgPackSerializer()
+
+    payload = serializer.serialize(MESSAGE)
+    assert serializer.peek(payload, 3) == MESSAGE[:3]
+    assert serializer.peek(serializer.serialize([2, {}, 3]), 3) == [2]
+
+
+class CountingSerializer(JsonSerializer):
+
+    def __init__(self):
+        super(CountingSerializer, self).__init__()
+        self.deserialized = 0
+
+    def deserialize(self, payload):
+        self.deserialized += 1
+        return super(CountingSerializer, self).deserialize(payload)
+
+
+def test_lazy_payload_is_only_decoded_when_needed():
+    serializer = CountingSerializer()
+    payload = LazyPayload(serializer.serialize(MESSAGE), serializer)
+
+    assert (payload[0], payload[1], payload[2]) == tuple(MESSAGE[:3])
+    assert serializer.deserialized == 0
+    assert not payload.is_decoded
+
+    assert payload[4] == MESSAGE[4]
+    assert payload[1:] == MESSAGE[1:]
+    assert payload == MESSAGE
+    assert serializer.deserialized == 1
+
+
+def test_lazy_payload_without_peek():
+    class Serializer(object):
+        SUBPROTOCOL = 'wamp.2.example'
+
+        def deserialize(self, payload):
+            return [36, 1]
+
+    payload = LazyPayload(b'...', Serializer())
+
+    assert payload.head == []
+    assert payload[0] == 36
+
+
+def test_lazy_payload_fails_to_decode():
+    payload = LazyPayload(b'[36, 1, 2, {', JsonSerializer())
+
+    assert payload[0] == 36
+    with pytest.raises(WampProtocolError):
+        payload[3]
+
+
+def test_lazy_server_frame():
+    serializer = LazySerializer(JsonSerializer())
+    frame_bytes = make_server_frame(serializer.serialize(MESSAGE))
+
+    frame = ServerFrame(frame_bytes, serializer=serializer)
+
+    assert isinstance(frame.payload, LazyPayload)
+    assert frame.payload == MESSAGE
+
+
+def test_get_lazy_serializers():
+    serializers = get_serializers(["json"], lazy=True)
+
+    assert [s.SUBPROTOCOL for s in serializers] == ['wamp.2.json']
+    assert isinstance(serializers[0], LazySerializer)
+
+
+class TestLazyMessageHandling(object):
+
+    class Client(object):
+        def __init__(self):
+            self.calls = []
+            self.session = self
+            self.subscription_map = {
+                MESSAGE[1]: (self.handler, "topic"),
+            }
+
+        def handler(self, *args, **kwargs):
+            self.calls.append((args, kwargs))
+
+    @pytest.fixture
+    def client(self):
+        return self.Client()
+
+    def test_event_is_decoded_by_default_handler(self, client):
+        payload = LazyPayload(
+            JsonSerializer().serialize(MESSAGE), JsonSerializer())
+
+        MessageHandler().handle_message(payload, client)
+
+        [(args, kwargs)] = client.calls
+        assert list(args) == MESSAGE[4]
+        assert kwargs['key'] == [1, 2, 3]
+        assert kwargs['meta']['subscription_id'] == MESSAGE[1]
+
+    def test_event_dropped_without_decoding(self, client):
+        seen = []
+
+        class Gateway(MessageHandler):
+            def handle_event(self, message_obj):
+                # routed on the subscription id alone
+                seen.append(
+                    (message_obj.subscription_id, message_obj.publication_id)
+                )
+
+        payload = LazyPayload(
+            JsonSerializer().serialize(MESSAGE), JsonSerializer())
+
+        Gateway().handle_message(payload, client)
+
+        assert seen == [tuple(MESSAGE[1:3])]
+        assert not payload.is_decoded
+
+
+def test_cbor_bytes_are_byte_strings():
+    pytest.importorskip("cbor2")
+
+    serializer = CborSerializer()
+    binary = b'\x00\x01\xfe\xff' * 8
+    payload = serializer.serialize([16, 1, {}, u"topic", [binary]])
+
+    # a CBOR byte string of 32 bytes: major type 2, length in next byte
+    assert b'\x58\x20' + binary in payload
+    assert serializer.deserialize(payload)[4] == [binary]
+
+
+def test_msgpack_is_sent_in_binary_frames():
+    pytest.importorskip("msgpack")
+
+    transport = WebSocket()
+    transport.register_router(
+        Router(url="ws://localhost:8080", serializers=["msgpack"])
+    )
+    assert "Sec-WebSocket-Protocol: wamp.2.msgpack" in (
+        transport._get_handshake_headers())
+
+    transport.socket, receiver = socket.socketpair()
+    try:
+        transport.send(MESSAGE)
+
+        first_byte, second_byte = bytearray(receiver.recv(2))
+        mask_key = receiver.recv(4)
+        body = mask(mask_key, receiver.recv(second_byte & 0x7f))
+    finally:
+        transport.socket.close()
+        receiver.close()
+
+    assert first_byte == 0x82
+    assert MsgPackSerializer().deserialize(body) == MESSAGE
+
+
+def test_get_serializers_in_order_of_preference():
+    pytest.importorskip("msgpack")
+    pytest.importorskip("cbor2")
+
+    serializers = get_serializers(["msgpack", "cbor", "json"])
+
+    assert [serializer.SUBPROTOCOL for serializer in serializers] == [
+        "wamp.2.msgpack", "wamp.2.cbor", "wamp.2.json"]
+
+
+def test_get_serializers_skips_unavailable(monkeypatch):
+    monkeypatch.setattr("wampy.serializers.msgpack", None)
+
+    serializers = get_serializers(["msgpack", "json"])
+
+    assert [serializer.SUBPROTOCOL for serializer in serializers] == [
+        "wamp.2.json"]
+
+    with pytest.raises(WampyError):
+        get_serializers(["msgpack"])
+
+
+def test_get_serializers_unknown_name():
+    with pytest.raises(WampyError):
+        get_serializers(["yaml"])
+
+
+class TestSubprotocolNegotiation(object):
+
+    @pytest.fixture
+    def transport(self):
+        class FakeSerializer(JsonSerializer):
+            SUBPROTOCOL = 'wamp.2.fake'
+
+        transport = WebSocket()
+        transport.register_router(
+            Router(
+                url="ws://localhost:8080",
+                serializers=[FakeSerializer(), "json"],
+            )
+        )
+        return transport
+
+    def test_all_subprotocols_are_offered(self, transport):
+        assert (
+            "Sec-WebSocket-Protocol: wamp.2.fake, wamp.2.json" in
+            transport._get_handshake_headers()
+        )
+
+    @pytest.mark.parametrize("subprotocol", ["wamp.2.fake", "wamp.2.json"])
+    def test_router_selects_subprotocol(self, transport, subprotocol):
+        serializer = transport._negotiate_subprotocol(
+            {'sec-websocket-protocol': subprotocol})
+
+        assert serializer.SUBPROTOCOL == subprotocol
+
+    @pytest.mark.parametrize("headers", [
+        {}, {'sec-websocket-protocol': 'wamp.2.cbor'},
+    ])
+    def test_router_selects_nothing_offered(self, transport, headers):
+        with pytest.raises(WebsocktProtocolError):
+            transport._negotiate_subprotocol(headers)
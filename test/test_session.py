@@ -0,0 +1,244 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import eventlet
+import pytest
+
+from wampy.errors import (
+    ConnectionClosedError, ConnectionError, MessageTooBigError,
+    WampProtocolError,
+)
+from wampy.message_handler import MessageHandler
+from wampy.messages import Call
+from wampy.peers.clients import Client
+from wampy.roles.callee import callee
+from wampy.session import Session
+
+
+class Frame(object):
+
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class FakeConnection(object):
+    """ Stands in for a transport, with the Router's side played by the
+    test: whatever is sent is kept, and whatever is put on ``incoming``
+    is received.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.incoming = eventlet.Queue()
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def receive(self):
+        message = self.incoming.get()
+        if isinstance(message, Exception):
+            raise message
+        return Frame(message)
+
+
+class FakeClient(object):
+    name = "test client"
+    session = None
+    reconnect = True
+
+    def __init__(self):
+        self.reconnects = []
+
+    def _reconnect(self, session=None):
+        self.reconnects.append(session)
+
+
+@pytest.fixture
+def session():
+    client = FakeClient()
+    client.session = Session(
+        client, router=None, connection=FakeConnection(),
+        message_handler=MessageHandler(),
+    )
+    return client.session
+
+
+def call(session, procedure):
+    return session.request(Call(procedure=procedure))
+
+
+def test_concurrent_requests_get_their_own_responses(session):
+    first = eventlet.spawn(call, session, "first")
+    second = eventlet.spawn(call, session, "second")
+    eventlet.sleep()
+
+    (_, first_id, _, _, _, _), (_, second_id, _, _, _, _) = (
+        session.connection.sent)
+
+    # the Router answers out of order
+    session.connection.incoming.put(
+        [50, second_id, {}, [], {"message": "second"}])
+    session.connection.incoming.put(
+        [50, first_id, {}, [], {"message": "first"}])
+
+    with eventlet.Timeout(1):
+        assert first.wait().value == "first"
+        assert second.wait().value == "second"
+
+    assert session._pending_requests == {}
+    assert session._message_queue.empty()
+
+
+def test_error_goes_to_its_request(session):
+    caller = eventlet.spawn(call, session, "broken")
+    eventlet.sleep()
+
+    request_id = session.connection.sent[0][1]
+    session.connection.incoming.put(
+        [8, 48, request_id, {}, "wamp.error.runtime_error", [], {}])
+
+    with eventlet.Timeout(1):
+        response = caller.wait()
+
+    assert response.WAMP_CODE == 8
+    assert response.request_id == request_id
+
+
+def test_unrequested_result_is_dropped(session):
+    session.connection.incoming.put([50, 1234, {}, [], {"message": 1}])
+    eventlet.sleep(0.01)
+
+    assert session._message_queue.empty()
+
+
+def test_late_response_is_dropped(session):
+    with pytest.raises(WampProtocolError):
+        session.request(Call(procedure="slow"), timeout=0.01)
+
+    request_id = session.connection.sent[0][1]
+    session.connection.incoming.put(
+        [8, 48, request_id, {}, "wamp.error.runtime_error", [], {}])
+    eventlet.sleep(0.01)
+
+    assert session._message_queue.empty()
+
+
+def test_request_times_out(session):
+    with pytest.raises(WampProtocolError):
+        session.request(Call(procedure="slow"), timeout=0.01)
+
+    assert session._pending_requests == {}
+
+
+def test_connection_lost_fails_waiting_requests(session):
+    caller = eventlet.spawn(call, session, "unanswered")
+    eventlet.sleep()
+
+    session.connection.incoming.put(ConnectionError("gone"))
+
+    with pytest.raises(ConnectionError):
+        with eventlet.Timeout(1):
+            caller.wait()
+
+
+def test_protocol_failure_fails_waiting_requests_and_reconnects(session):
+    session.session_id = 1234
+    caller = eventlet.spawn(call, session, "unanswered")
+    eventlet.sleep()
+
+    session.connection.incoming.put(MessageTooBigError("too big"))
+
+    with pytest.raises(ConnectionError):
+        with eventlet.Timeout(1):
+            caller.wait()
+
+    eventlet.sleep(0.01)
+    assert session._managed_thread.dead
+    assert session.client.reconnects == [session]
+
+
+def test_subscribed_is_delivered(session):
+    request_id = session._subscribe_to_topic(lambda: None, "topic")
+
+    assert session.connection.sent[0][1] == request_id
+    session.connection.incoming.put([33, request_id, 5678])
+
+    response = session.wait_for_response(request_id, timeout=1)
+
+    assert response.subscription_id == 5678
+    assert 5678 in session.subscription_map
+    assert session._pending_requests == {}
+
+
+class DateService(Client):
+
+    @callee
+    def get_date(self):
+        pass
+
+
+def test_refused_registration_is_raised():
+    client = DateService(url="ws://localhost:8080")
+    client._session = Session(
+        client, router=None, connection=FakeConnection(),
+        message_handler=MessageHandler(),
+    )
+
+    registering = eventlet.spawn(client.register_roles)
+    eventlet.sleep()
+
+    (_, request_id, _, procedure), = client.session.connection.sent
+    assert procedure == "get_date"
+    client.session.connection.incoming.put([
+        8, 64, request_id, {}, "wamp.error.procedure_already_exists",
+        [], {},
+    ])
+
+    with pytest.raises(WampProtocolError) as exc_info:
+        with eventlet.Timeout(1):
+            registering.wait()
+
+    assert "procedure_already_exists" in str(exc_info.value)
+
+
+def test_lost_connection_is_reported_to_the_client(session):
+    session.session_id = 1234
+    session.connection.incoming.put(ConnectionError("gone"))
+    eventlet.sleep(0.01)
+
+    assert session.client.reconnects == [session]
+
+
+def test_lost_connection_is_not_replaced_without_reconnect(session):
+    session.client.reconnect = False
+    session.session_id = 1234
+    session.connection.incoming.put(ConnectionError("gone"))
+    eventlet.sleep(0.01)
+
+    assert session.client.reconnects == []
+
+
+@pytest.mark.parametrize("code", [1000, 1001])
+def test_connection_closed_by_the_router_is_not_replaced(session, code):
+    session.session_id = 1234
+    session.connection.incoming.put(ConnectionClosedError(code, u"bye"))
+    eventlet.sleep(0.01)
+
+    assert session.close_code == code
+    assert session.client.reconnects == []
+
+
+def test_connection_failed_by_the_router_is_replaced(session):
+    session.session_id = 1234
+    session.connection.incoming.put(ConnectionClosedError(1011, u"oops"))
+    eventlet.sleep(0.01)
+
+    assert session.client.reconnects == [session]
+
+
+def test_lost_connection_before_welcome_is_not_replaced(session):
+    session.connection.incoming.put(ConnectionError("gone"))
+    eventlet.sleep(0.01)
+
+    assert session.client.reconnects == []
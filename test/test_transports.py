@@ -3,14 +3,33 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import datetime
+import json
+import os
+import re
+import socket
 import ssl
+import subprocess
+from base64 import b64encode
 from datetime import date
+from hashlib import sha1
+from struct import pack, unpack
 
+import eventlet
 import pytest
 
+from wampy.errors import (
+    ConnectionClosedError, ConnectionError, MessageTooBigError,
+    WampyError, WebsocktProtocolError,
+)
 from wampy.peers.clients import Client
+from wampy.peers.routers import Crossbar, Router
 from wampy.roles.callee import callee
 from wampy.testing.helpers import wait_for_session, wait_for_registrations
+from wampy.transports import SecureWebSocket, WebSocket
+from wampy.transports import sockets
+from wampy.transports.sockets import SocketOptions, connect
+from wampy.transports.websocket.frames import mask
+from wampy.transports.websocket.reader import FrameReader
 
 
 class DateService(Client):
@@ -120,3 +139,671 @@ class TestSecureWebSocket(object):
         today = date.today()
 
         assert result == today.isoformat()
+
+
+class TestFragmentation(object):
+
+    @pytest.yield_fixture
+    def websocket(self):
+        transport = WebSocket()
+        transport.register_router(
+            Router(url="ws://localhost:8080", fragment_size=1024)
+        )
+
+        transport.socket, receiver = socket.socketpair()
+        yield transport, receiver
+
+        transport.socket.close()
+        receiver.close()
+
+    def read_frame(self, receiver):
+        first_byte, second_byte = bytearray(receiver.recv(2))
+        length = second_byte & 0x7f
+        if length == 126:
+            length = unpack('!H', receiver.recv(2))[0]
+
+        mask_key = receiver.recv(4)
+        body = b''
+        while len(body) < length:
+            body += receiver.recv(length - len(body))
+
+        return first_byte >> 7, first_byte & 0xf, mask(mask_key, body)
+
+    def test_small_message_is_one_frame(self, websocket):
+        transport, receiver = websocket
+
+        transport.send([16, 1, {}, "topic", ["hello"]])
+
+        fin, opcode, body = self.read_frame(receiver)
+        assert (fin, opcode) == (1, 0x1)
+        assert json.loads(body.decode('utf-8')) == [
+            16, 1, {}, "topic", ["hello"]]
+
+    def test_large_message_is_fragmented(self, websocket):
+        transport, receiver = websocket
+        message = [16, 1, {}, "topic", ["x" * 3000]]
+
+        eventlet.spawn(transport.send, message)
+
+        frames = [self.read_frame(receiver) for _ in range(3)]
+
+        assert [(fin, opcode) for fin, opcode, _ in frames] == [
+            (0, 0x1), (0, 0x0), (1, 0x0)]
+        assert [len(body) for _, _, body in frames[:2]] == [1024, 1024]
+
+        body = b''.join(body for _, _, body in frames)
+        assert json.loads(body.decode('utf-8')) == message
+
+
+def read_upgrade_request(sock):
+    request = b''
+    while not request.endswith(b'\r\n\r\n'):
+        request += sock.recv(1)
+    return request.decode('utf-8')
+
+
+def upgrade_response(request, status=b'101 Switching Protocols', accept=None):
+    """ What a Router would answer to the upgrade ``request`` with.
+    """
+    if accept is None:
+        key = re.search(r'Sec-WebSocket-Key: (\S+)', request).group(1)
+        accept = b64encode(sha1(
+            (key + '258EAFA5-E914-47DA-95CA-C5AB0DC85B11').encode('utf-8')
+        ).digest())
+
+    return (
+        b'HTTP/1.1 ' + status + b'\r\n'
+        b'Upgrade: WebSocket\r\n'
+        b'Connection: Upgrade\r\n'
+        b'Sec-WebSocket-Protocol: wamp.2.json\r\n'
+        b'Sec-WebSocket-Accept: ' + accept + b'\r\n'
+        b'\r\n'
+    )
+
+
+class TestUnixSocket(object):
+
+    @pytest.yield_fixture
+    def unix_router(self, tmpdir):
+        path = str(tmpdir.join('router.socket'))
+        server = eventlet.listen(path, family=socket.AF_UNIX)
+        requests = eventlet.Queue()
+
+        def serve():
+            sock, _ = server.accept()
+            request = read_upgrade_request(sock)
+            requests.put(request)
+
+            # an unmasked text frame follows straight after
+            sock.sendall(upgrade_response(request) + b'\x81\x03[1]')
+
+        thread = eventlet.spawn(serve)
+        yield 'ws+unix://{}'.format(path), requests
+
+        thread.kill()
+        server.close()
+
+    def test_connect_over_unix_socket(self, unix_router):
+        url, requests = unix_router
+
+        client = Client(url=url)
+        transport = client.transport
+        transport.connect()
+
+        assert transport.socket.family == socket.AF_UNIX
+        assert "Host: localhost\r\n" in requests.get(timeout=1)
+        assert transport.receive().payload == [1]
+
+        transport.disconnect()
+
+
+class TestHandshake(object):
+
+    @pytest.yield_fixture
+    def websocket(self):
+        transport = WebSocket()
+        transport.register_router(Router(url="ws://localhost:8080"))
+
+        sock, router_sock = socket.socketpair()
+
+        def connect():
+            transport.socket = sock
+
+        transport._connect = connect
+        yield transport, router_sock
+
+        sock.close()
+        router_sock.close()
+
+    def test_response_in_pieces_with_frames_behind(self, websocket):
+        transport, router_sock = websocket
+
+        def respond():
+            request = read_upgrade_request(router_sock)
+            response = upgrade_response(request) + (
+                b'\x81\x03[1]\x81\x03[2]')
+            for i in range(0, len(response), 5):
+                router_sock.sendall(response[i:i + 5])
+                eventlet.sleep()
+
+        eventlet.spawn(respond)
+        transport.connect()
+
+        assert transport.status == 101
+        assert transport.headers['upgrade'] == 'websocket'
+        assert transport.receive().payload == [1]
+        assert transport.receive().payload == [2]
+
+    def test_response_read_in_one(self, websocket):
+        transport, router_sock = websocket
+        calls = []
+
+        def respond():
+            request = read_upgrade_request(router_sock)
+            router_sock.sendall(upgrade_response(request) + b'\x81\x03[1]')
+
+        eventlet.spawn(respond)
+
+        class CountingSocket(object):
+            def __init__(self, sock):
+                self.sock = sock
+
+            def recv(self, bufsize):
+                calls.append(bufsize)
+                return self.sock.recv(bufsize)
+
+            def __getattr__(self, name):
+                return getattr(self.sock, name)
+
+        connect = transport._connect
+
+        def counting_connect():
+            connect()
+            transport.socket = CountingSocket(transport.socket)
+
+        transport._connect = counting_connect
+        transport.connect()
+
+        assert len(calls) == 1
+        assert transport.receive().payload == [1]
+
+    @pytest.mark.parametrize("status, accept", [
+        (b'101 Switching Protocols', b'bm90IHRoZSByaWdodCBrZXk='),
+        (b'400 Bad Request', None),
+    ])
+    def test_upgrade_refused(self, websocket, status, accept):
+        transport, router_sock = websocket
+
+        def respond():
+            request = read_upgrade_request(router_sock)
+            router_sock.sendall(
+                upgrade_response(request, status=status, accept=accept))
+
+        eventlet.spawn(respond)
+
+        with pytest.raises(WebsocktProtocolError):
+            transport.connect()
+
+    def test_each_handshake_has_its_own_key(self):
+        transport = WebSocket()
+        transport.register_router(Router(url="ws://localhost:8080"))
+        router_socks = []
+        keys = []
+
+        def respond(router_sock):
+            request = read_upgrade_request(router_sock)
+            keys.append(
+                re.search(r'Sec-WebSocket-Key: (\S+)', request).group(1))
+            router_sock.sendall(upgrade_response(request))
+
+        def connect():
+            transport.socket, router_sock = socket.socketpair()
+            router_socks.append(router_sock)
+            eventlet.spawn(respond, router_sock)
+
+        transport._connect = connect
+        for _ in range(2):
+            transport.connect()
+            transport.abort()
+
+        assert len(set(keys)) == 2
+
+        for router_sock in router_socks:
+            router_sock.close()
+
+    def test_router_hangs_up(self, websocket):
+        transport, router_sock = websocket
+
+        def respond():
+            read_upgrade_request(router_sock)
+            router_sock.sendall(b'HTTP/1.1 101 Switching Protocols\r\n')
+            router_sock.close()
+
+        eventlet.spawn(respond)
+
+        with pytest.raises(WebsocktProtocolError):
+            transport.connect()
+
+
+class TestSocketOptions(object):
+
+    @pytest.yield_fixture
+    def server(self):
+        server = eventlet.listen(('127.0.0.1', 0))
+        thread = eventlet.spawn(server.accept)
+        yield server.getsockname()
+
+        thread.kill()
+        server.close()
+
+    def test_tcp_nodelay_by_default(self, server):
+        host, port = server
+
+        sock = connect(host, port)
+
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert not sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        sock.close()
+
+    def test_options_are_applied(self, server):
+        host, port = server
+        socket_options = SocketOptions(
+            tcp_nodelay=False, keepalive=True, keepalive_idle=30,
+            keepalive_interval=5, keepalive_count=3,
+            receive_buffer_size=64 * 1024,
+        )
+
+        sock = connect(host, port, socket_options=socket_options)
+
+        assert not sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            assert sock.getsockopt(
+                socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 30
+        if hasattr(socket, 'TCP_KEEPINTVL'):
+            assert sock.getsockopt(
+                socket.IPPROTO_TCP, socket.TCP_KEEPINTVL) == 5
+        if hasattr(socket, 'TCP_KEEPCNT'):
+            assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT) == 3
+        # the kernel may double what's asked for, to allow for bookkeeping
+        assert sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF) >= 64 * 1024
+        sock.close()
+
+    def test_client_passes_options_to_transport(self):
+        socket_options = SocketOptions(keepalive=True)
+
+        client = Client(
+            url="ws://localhost:8080", socket_options=socket_options)
+
+        assert client.router.socket_options is socket_options
+        assert client.transport.socket_options is socket_options
+
+
+V4 = (socket.AF_INET, ('127.0.0.1', 0))
+V6 = (socket.AF_INET6, ('::1', 0, 0, 0))
+
+
+class TestResolve(object):
+
+    @pytest.yield_fixture
+    def lookups(self, monkeypatch):
+        """ Answer ``getaddrinfo`` with both address families, counting
+        the lookups.
+        """
+        lookups = []
+
+        def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+            lookups.append((host, port, family))
+            return [
+                (socket.AF_INET6, type, 6, '', ('::1', port, 0, 0)),
+                (socket.AF_INET6, type, 6, '', ('::2', port, 0, 0)),
+                (socket.AF_INET, type, 6, '', ('127.0.0.1', port)),
+            ]
+
+        monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+        sockets._resolve_cache.clear()
+        yield lookups
+        sockets._resolve_cache.clear()
+
+    def test_families_are_interleaved(self, lookups):
+        addresses = sockets.resolve('router.example.com', 8080)
+
+        assert [family for family, _ in addresses] == [
+            socket.AF_INET6, socket.AF_INET, socket.AF_INET6,
+        ]
+        assert lookups == [('router.example.com', 8080, socket.AF_UNSPEC)]
+
+    def test_answers_are_cached(self, lookups, monkeypatch):
+        first = sockets.resolve('router.example.com', 8080)
+        assert sockets.resolve('router.example.com', 8080) == first
+        assert len(lookups) == 1
+
+        # but not for another port, or IP version
+        sockets.resolve('router.example.com', 8081)
+        sockets.resolve('router.example.com', 8080, ipv=4)
+        assert len(lookups) == 3
+
+        monkeypatch.setattr(sockets, 'RESOLVE_TTL', 0)
+        sockets._resolve_cache.clear()
+        sockets.resolve('router.example.com', 8080)
+        sockets.resolve('router.example.com', 8080)
+        assert len(lookups) == 5
+
+    def test_unknown_ip_version(self):
+        with pytest.raises(WampyError):
+            sockets.resolve('router.example.com', 8080, ipv=5)
+
+
+class TestRace(object):
+
+    @pytest.yield_fixture
+    def server(self):
+        server = eventlet.listen(('127.0.0.1', 0))
+        thread = eventlet.spawn(server.accept)
+        yield server.getsockname()[1]
+
+        thread.kill()
+        server.close()
+
+    @pytest.fixture
+    def refused_port(self):
+        # a port nothing is listening on
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def test_slow_address_is_overtaken(self, server, monkeypatch):
+        monkeypatch.setattr(sockets, 'CONNECTION_ATTEMPT_DELAY', 0.05)
+        connect_address = sockets.connect_address
+        abandoned = []
+
+        def slow_connect(address, socket_options):
+            if address[0] == socket.AF_INET6:
+                # a route that's black-holed
+                try:
+                    eventlet.sleep(5)
+                except eventlet.greenlet.GreenletExit:
+                    abandoned.append(address)
+                    raise
+            return connect_address(address, socket_options)
+
+        monkeypatch.setattr(sockets, 'connect_address', slow_connect)
+
+        with eventlet.Timeout(1):
+            sock = sockets.race([
+                V6,
+                (socket.AF_INET, ('127.0.0.1', server)),
+            ], SocketOptions())
+
+        assert sock.getpeername()[1] == server
+        assert abandoned == [V6]
+        sock.close()
+
+    def test_failed_address_is_passed_over_at_once(
+        self, server, refused_port, monkeypatch,
+    ):
+        monkeypatch.setattr(sockets, 'CONNECTION_ATTEMPT_DELAY', 5)
+
+        with eventlet.Timeout(1):
+            sock = sockets.race([
+                (socket.AF_INET, ('127.0.0.1', refused_port)),
+                (socket.AF_INET, ('127.0.0.1', server)),
+            ], SocketOptions())
+
+        assert sock.getpeername()[1] == server
+        sock.close()
+
+    def test_every_address_fails(self, refused_port):
+        with pytest.raises(socket.error):
+            sockets.race([
+                (socket.AF_INET, ('127.0.0.1', refused_port)),
+                (socket.AF_INET, ('127.0.0.1', refused_port)),
+            ], SocketOptions())
+
+    def test_connect_to_ipv6_host(self):
+        try:
+            server = eventlet.listen(('::1', 0), family=socket.AF_INET6)
+        except socket.error:
+            pytest.skip("no IPv6 loopback")
+
+        thread = eventlet.spawn(server.accept)
+        try:
+            sock = connect('::1', server.getsockname()[1], ipv=6)
+            assert sock.family == socket.AF_INET6
+            sock.close()
+        finally:
+            thread.kill()
+            server.close()
+
+
+def test_authority_of_ipv6_literal():
+    transport = WebSocket()
+    transport.register_router(Router(url="ws://[::1]:8080"))
+
+    assert transport._authority == "[::1]:8080"
+
+
+def read_client_frame(sock):
+    """ Read a masked Client -> Server frame of less than 64K.
+    """
+    first_byte, second_byte = bytearray(recv_exactly(sock, 2))
+    length = second_byte & 0x7f
+    if length == 126:
+        length = unpack('!H', recv_exactly(sock, 2))[0]
+
+    mask_key = recv_exactly(sock, 4)
+    return first_byte & 0xf, mask(mask_key, recv_exactly(sock, length))
+
+
+def recv_exactly(sock, length):
+    data = b''
+    while len(data) < length:
+        received = sock.recv(length - len(data))
+        if not received:
+            raise EOFError()
+        data += received
+    return data
+
+
+class TestCloseHandshake(object):
+
+    @pytest.yield_fixture
+    def websocket(self):
+        transport = WebSocket()
+        transport.register_router(Router(url="ws://localhost:8080"))
+
+        transport.socket, router_sock = socket.socketpair()
+        transport.reader = FrameReader(transport.socket)
+        yield transport, router_sock
+
+        transport.socket.close()
+        router_sock.close()
+
+    def test_disconnect(self, websocket):
+        transport, router_sock = websocket
+
+        def router():
+            # a message that was already on its way
+            router_sock.sendall(b'\x81\x03[1]')
+            received = read_client_frame(router_sock)
+            router_sock.sendall(b'\x88\x02\x03\xe8')
+            return received
+
+        thread = eventlet.spawn(router)
+        transport.disconnect()
+
+        assert thread.wait() == (0x8, b'\x03\xe8')
+        assert transport.close_code == 1000
+        # and the socket has been closed
+        assert router_sock.recv(1) == b''
+
+    def test_disconnect_while_receiving(self, websocket):
+        transport, router_sock = websocket
+        reader = eventlet.spawn(transport.receive)
+
+        def router():
+            received = read_client_frame(router_sock)
+            router_sock.sendall(b'\x88\x02\x03\xe8')
+            return received
+
+        thread = eventlet.spawn(router)
+        eventlet.sleep()
+        transport.disconnect(code=1001, reason=u"going away")
+
+        assert thread.wait() == (0x8, b'\x03\xe9going away')
+        with pytest.raises(ConnectionClosedError):
+            reader.wait()
+
+    def test_disconnect_without_answer(self, websocket, monkeypatch):
+        monkeypatch.setattr(
+            'wampy.transports.websocket.connection.CLOSE_TIMEOUT', 0.1)
+        transport, router_sock = websocket
+
+        with eventlet.Timeout(1):
+            transport.disconnect()
+
+        assert read_client_frame(router_sock) == (0x8, b'\x03\xe8')
+        assert router_sock.recv(1) == b''
+        assert transport.close_code is None
+
+    def test_router_closes(self, websocket):
+        transport, router_sock = websocket
+        router_sock.sendall(b'\x88\x0c\x03\xe9restarting')
+
+        with pytest.raises(ConnectionClosedError) as exc_info:
+            transport.receive()
+
+        assert (exc_info.value.code, exc_info.value.reason) == (
+            1001, u"restarting")
+        assert (transport.close_code, transport.close_reason) == (
+            1001, u"restarting")
+
+        # the close is echoed, and the socket closed
+        assert read_client_frame(router_sock) == (0x8, b'\x03\xe9')
+        assert router_sock.recv(1) == b''
+
+        with pytest.raises(ConnectionError):
+            transport.send([1, "realm1", {}])
+
+    def test_router_closes_without_status(self, websocket):
+        transport, router_sock = websocket
+        router_sock.sendall(b'\x88\x00')
+
+        with pytest.raises(ConnectionClosedError):
+            transport.receive()
+
+        assert transport.close_code == 1005
+        assert read_client_frame(router_sock) == (0x8, b'')
+
+    def test_protocol_error(self, websocket):
+        transport, router_sock = websocket
+        # a continuation frame, with no message to continue
+        router_sock.sendall(b'\x80\x03[1]')
+
+        with pytest.raises(WebsocktProtocolError):
+            transport.receive()
+
+        opcode, body = read_client_frame(router_sock)
+        assert (opcode, body[:2]) == (0x8, b'\x03\xea')
+
+    def test_message_too_big(self, websocket):
+        transport, router_sock = websocket
+        transport.reader.max_message_size = 1024
+        # a header claiming a 1G body, with no body to follow
+        router_sock.sendall(b'\x81\x7f' + pack('!Q', 2 ** 30))
+
+        with pytest.raises(MessageTooBigError):
+            with eventlet.Timeout(1):
+                transport.receive()
+
+        opcode, body = read_client_frame(router_sock)
+        assert (opcode, body[:2]) == (0x8, b'\x03\xf1')
+
+
+class TestTLSSessionResumption(object):
+
+    @pytest.yield_fixture
+    def tls_router(self, tmpdir):
+        if not hasattr(ssl, 'PROTOCOL_TLS_SERVER'):
+            pytest.skip("Python Environment has no TLS session resumption")
+
+        cert, key = str(tmpdir.join('cert.pem')), str(tmpdir.join('key.pem'))
+        try:
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call([
+                    'openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                    '-nodes', '-keyout', key, '-out', cert, '-days', '1',
+                    '-subj', '/CN=localhost',
+                    '-addext', 'subjectAltName=DNS:localhost',
+                ], stdout=devnull, stderr=devnull)
+        except (OSError, subprocess.CalledProcessError):
+            pytest.skip("can't make a certificate with openssl")
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server = eventlet.listen(('127.0.0.1', 0))
+
+        def serve():
+            while True:
+                sock, _ = server.accept()
+                try:
+                    sock = context.wrap_socket(sock, server_side=True)
+                    request = read_upgrade_request(sock)
+                    sock.sendall(upgrade_response(request))
+                    read_client_frame(sock)
+                    sock.sendall(b'\x88\x02\x03\xe8')
+                except (ssl.SSLError, EOFError, socket.error):
+                    pass
+                sock.close()
+
+        thread = eventlet.spawn(serve)
+        yield server.getsockname()[1], cert
+
+        thread.kill()
+        server.close()
+
+    def test_context_is_shared_and_session_resumed(self, tls_router):
+        port, cert = tls_router
+        router = Router(
+            url="wss://localhost:{}".format(port), cert_path=cert)
+
+        transport = SecureWebSocket()
+        transport.register_router(router)
+
+        transport.connect()
+        assert not transport.socket.session_reused
+        transport.disconnect()
+
+        transport.connect()
+        assert transport.socket.session_reused
+        transport.disconnect()
+
+        another = SecureWebSocket()
+        another.register_router(router)
+        assert another.ssl_context is transport.ssl_context
+
+    def test_hostname_is_verified(self, tls_router):
+        port, cert = tls_router
+        transport = SecureWebSocket()
+        transport.register_router(Router(
+            url="wss://127.0.0.1:{}".format(port), cert_path=cert))
+
+        with pytest.raises(ssl.SSLError):
+            transport.connect()
+
+
+def test_crossbar_takes_the_same_transport_options():
+    crossbar = Crossbar(
+        config_path='./wampy/testing/configs/crossbar.json',
+        fragment_size=1024, heartbeat_interval=5,
+    )
+
+    assert crossbar.fragment_size == 1024
+    assert crossbar.heartbeat_interval == 5
+    assert isinstance(crossbar.socket_options, SocketOptions)
+
+    with pytest.raises(TypeError):
+        Router(url="ws://localhost:8080", no_such_option=True)
@@ -0,0 +1,276 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import eventlet
+import pytest
+
+from wampy.errors import ConnectionError, SendBufferFullError, WampyError
+from wampy.transports.writer import (
+    BLOCK, DROP_OLDEST, MAX_BATCH_SIZE, RAISE, FlowControl, Writer,
+)
+
+
+class RecordingWrite(object):
+    """ Stands in for a socket write, remembering each batch.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, buffers):
+        self.batches.append(list(buffers))
+
+
+class StalledWrite(RecordingWrite):
+    """ A socket write that blocks until released, as it would were the
+    Router not reading.
+    """
+
+    def __init__(self):
+        super(StalledWrite, self).__init__()
+        self.released = eventlet.Event()
+
+    def __call__(self, buffers):
+        self.released.wait()
+        super(StalledWrite, self).__call__(buffers)
+
+
+def test_queued_frames_are_written_together():
+    write = RecordingWrite()
+    writer = Writer(write)
+
+    # nothing is written until the writer's thread gets to run
+    for n in range(3):
+        writer.put([b'header', b'body %d' % n])
+    assert writer.pending
+    assert write.batches == []
+
+    writer.flush()
+
+    assert not writer.pending
+    assert write.batches == [
+        [b'header', b'body 0', b'header', b'body 1', b'header', b'body 2'],
+    ]
+
+
+def test_control_frames_go_first():
+    write = RecordingWrite()
+    writer = Writer(write)
+
+    writer.put([b'data'])
+    writer.put([b'pong'], control=True)
+    writer.flush()
+
+    assert write.batches == [[b'pong', b'data']]
+
+
+def test_batches_are_capped():
+    write = RecordingWrite()
+    writer = Writer(write)
+
+    body = b'x' * (MAX_BATCH_SIZE // 2)
+    for _ in range(3):
+        writer.put([body])
+    writer.flush()
+
+    assert [len(batch) for batch in write.batches] == [2, 1]
+
+
+def test_linger_gathers_later_frames():
+    write = RecordingWrite()
+    writer = Writer(write, linger=0.05)
+
+    writer.put([b'one'])
+    eventlet.sleep(0.01)
+    writer.put([b'two'])
+    writer.flush()
+
+    assert write.batches == [[b'one', b'two']]
+
+
+def test_control_frames_do_not_linger():
+    write = RecordingWrite()
+    writer = Writer(write, linger=1)
+
+    writer.put([b'pong'], control=True)
+    with eventlet.Timeout(0.1):
+        writer.flush()
+
+    assert write.batches == [[b'pong']]
+
+
+def test_full_batch_does_not_linger():
+    write = RecordingWrite()
+    writer = Writer(write, linger=1)
+
+    writer.put([b'x' * MAX_BATCH_SIZE])
+    with eventlet.Timeout(0.1):
+        writer.flush()
+
+    assert len(write.batches) == 1
+
+
+def test_write_error_is_raised_by_the_next_send():
+    def write(buffers):
+        raise IOError("broken pipe")
+
+    writer = Writer(write)
+    writer.put([b'data'])
+
+    with pytest.raises(ConnectionError):
+        writer.flush()
+
+    with pytest.raises(ConnectionError):
+        writer.put([b'more'])
+
+
+def test_stop_drops_what_is_queued():
+    write = RecordingWrite()
+    writer = Writer(write)
+
+    writer.put([b'data'])
+    writer.stop()
+    eventlet.sleep()
+
+    assert write.batches == []
+    assert not writer.pending
+    # and flushing a stopped writer doesn't block
+    with eventlet.Timeout(1):
+        writer.flush()
+
+
+def test_stopped_writer_refuses_more():
+    write = RecordingWrite()
+    writer = Writer(write)
+    writer.stop()
+
+    with pytest.raises(ConnectionError):
+        writer.put_message([[b'data']])
+    with pytest.raises(ConnectionError):
+        writer.put([b'pong'], control=True)
+
+    eventlet.sleep()
+    assert write.batches == []
+
+
+@pytest.mark.parametrize("high, low", [(100, 100), (100, 200), (100, -1)])
+def test_flow_control_watermarks_must_be_ordered(high, low):
+    with pytest.raises(WampyError):
+        FlowControl(high, low)
+
+
+def test_flow_control_policy_must_be_known():
+    with pytest.raises(WampyError):
+        FlowControl(100, when_full='ignore')
+
+
+class TestFlowControl(object):
+
+    def make_writer(self, when_full, on_writable=None):
+        write = StalledWrite()
+        writer = Writer(write, flow_control=FlowControl(
+            high_watermark=100, low_watermark=50, when_full=when_full,
+            on_writable=on_writable,
+        ))
+        return writer, write
+
+    def test_writable_state_follows_the_watermarks(self):
+        changes = []
+        writer, write = self.make_writer(BLOCK, on_writable=changes.append)
+
+        writer.put_message([[b'x' * 60]])
+        assert writer.writable
+        writer.put_message([[b'x' * 60]])
+        assert not writer.writable
+        assert writer.buffered == 120
+
+        write.released.send(True)
+        writer.flush()
+
+        assert writer.writable
+        assert writer.buffered == 0
+        assert changes == [False, True]
+
+    def test_block_until_writable(self):
+        writer, write = self.make_writer(BLOCK)
+
+        writer.put_message([[b'x' * 100]])
+        sender = eventlet.spawn(writer.put_message, [[b'more']])
+        eventlet.sleep(0.01)
+        assert not sender.dead
+
+        write.released.send(True)
+        with eventlet.Timeout(1):
+            sender.wait()
+        writer.flush()
+
+        assert write.batches[-1] == [b'more']
+
+    def test_blocked_send_fails_when_stopped(self):
+        writer, _ = self.make_writer(BLOCK)
+
+        writer.put_message([[b'x' * 100]])
+        sender = eventlet.spawn(writer.put_message, [[b'more']])
+        eventlet.sleep(0.01)
+        writer.stop()
+
+        with pytest.raises(ConnectionError):
+            with eventlet.Timeout(1):
+                sender.wait()
+
+    def test_raise_when_full(self):
+        writer, _ = self.make_writer(RAISE)
+
+        writer.put_message([[b'x' * 100]])
+        with pytest.raises(SendBufferFullError):
+            writer.put_message([[b'more']])
+
+        # control frames are never refused
+        writer.put([b'pong'], control=True)
+
+    def test_drop_oldest_when_full(self):
+        writer, write = self.make_writer(DROP_OLDEST)
+
+        # the first is taken by the writer, so can't be dropped
+        writer.put_message([[b'a' * 40]])
+        eventlet.sleep()
+        writer.put_message([[b'b' * 30], [b'b' * 10]])
+        writer.put_message([[b'c' * 10]], droppable=False)
+        writer.put_message([[b'd' * 30]])
+        assert not writer.writable
+
+        writer.put_message([[b'e']])
+
+        assert writer.dropped == 2
+        write.released.send(True)
+        writer.flush()
+
+        assert write.batches == [[b'a' * 40], [b'c' * 10, b'e']]
+
+    def test_drop_oldest_with_nothing_droppable(self):
+        writer, write = self.make_writer(DROP_OLDEST)
+
+        # compressed messages, say, which can't be dropped
+        writer.put_message([[b'a' * 60]], droppable=False)
+        writer.put_message([[b'b' * 60]], droppable=False)
+        assert not writer.writable
+
+        # so the new message is dropped instead
+        writer.put_message([[b'c']])
+        assert writer.dropped == 1
+        assert writer.buffered == 120
+
+        # or, if it can't be, waits for room
+        sender = eventlet.spawn(
+            writer.put_message, [[b'd']], droppable=False)
+        eventlet.sleep(0.01)
+        assert not sender.dead
+        assert writer.buffered == 120
+
+        write.released.send(True)
+        with eventlet.Timeout(1):
+            sender.wait()
+        writer.flush()
+
+        assert write.batches == [[b'a' * 60, b'b' * 60], [b'd']]
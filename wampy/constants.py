@@ -8,8 +8,15 @@ DEFAULT_PORT = 8080
 CROSSBAR_DEFAULT = "ws://{}/{}".format(DEFAULT_HOST, DEFAULT_PORT)
 
 WEBSOCKET_VERSION = 13
+# deprecated, and no longer used: the subprotocols offered are those of
+# the Router's ``serializers``
 WEBSOCKET_SUBPROTOCOLS = 'wamp.2.json'
 WEBSOCKET_SUCCESS_STATUS = 101
+# concatenated with the key to make the Sec-WebSocket-Accept response
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# the largest message wampy will reassemble from a sequence of fragments
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
 
 CALLEE = 'CALLEE'
 CALLER = 'CALLER'
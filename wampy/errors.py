@@ -11,6 +11,17 @@ class ConnectionError(Exception):
     pass
 
 
+class ConnectionClosedError(ConnectionError):
+    """ The connection was closed, and why, if the other side said.
+    """
+    def __init__(self, code=None, reason=None):
+        self.code = code
+        self.reason = reason
+
+        message = 'Connection closed: {} "{}"'.format(code, reason or '')
+        super(ConnectionClosedError, self).__init__(message)
+
+
 class IncompleteFrameError(Exception):
     def __init__(self, required_bytes):
         self.required_bytes = required_bytes
@@ -32,6 +43,11 @@ class WebsocktProtocolError(Exception):
     pass
 
 
+class MessageTooBigError(WebsocktProtocolError):
+    """ A frame or message was larger than we're willing to accept.
+    """
+
+
 class ProcedureNotFoundError(AttributeError):
     pass
 
@@ -44,6 +60,11 @@ class WampyError(Exception):
     pass
 
 
+class SendBufferFullError(WampyError):
+    """ Nothing more can be sent until the Router catches up.
+    """
+
+
 class WelcomeAbortedError(WampProtocolError):
     pass
 
@@ -6,7 +6,8 @@ import logging
 import os
 
 from wampy.auth import compute_wcs
-from wampy.messages import Authenticate, MESSAGE_TYPE_MAP
+from wampy.messages import Authenticate, LazyMessage, MESSAGE_TYPE_MAP
+from wampy.serializers import LazyPayload
 
 logger = logging.getLogger('wampy.messagehandler')
 
@@ -44,9 +45,14 @@ class MessageHandler(object):
         self.session = client.session
 
         message_class = MESSAGE_TYPE_MAP[wamp_code]
-        # instantiate our Message obj using the incoming payload - but slicing
-        # off the WAMP code, which we already know
-        message_obj = message_class(*message[1:])
+        if isinstance(message, LazyPayload):
+            # the rest of the message is only deserialized should the
+            # handler need it
+            message_obj = LazyMessage(message_class, message)
+        else:
+            # instantiate our Message obj using the incoming payload - but
+            # slicing off the WAMP code, which we already know
+            message_obj = message_class(*message[1:])
 
         handler_name = "handle_{}".format(message_obj.name)
         handler = getattr(self, handler_name)
@@ -76,7 +82,7 @@ class MessageHandler(object):
 
     def handle_error(self, message_obj):
         logger.error("received error: %s", message_obj.message)
-        self.session._message_queue.put(message_obj)
+        self._deliver_response(message_obj)
 
     def handle_event(self, message_obj):
         session = self.session
@@ -103,6 +109,7 @@ class MessageHandler(object):
         topic = original_message.topic
 
         session.subscription_map[message_obj.subscription_id] = handler, topic
+        session.deliver_response(message_obj)
 
     def handle_invocation(self, message_obj):
         session = self.session
@@ -128,15 +135,24 @@ class MessageHandler(object):
         session = self.session
         procedure_name = session.request_ids[message_obj.request_id]
         session.registration_map[message_obj.registration_id] = procedure_name
+        session.deliver_response(message_obj)
 
     def handle_result(self, message_obj):
-        self.session._message_queue.put(message_obj)
+        self._deliver_response(message_obj)
 
     def handle_welcome(self, message_obj):
         logger.info("client %s has been welcomed", self.client.name)
         self.session.session_id = message_obj.session_id
         self.session._message_queue.put(message_obj)
-        self.client.register_roles()
+
+    def _deliver_response(self, message_obj):
+        # a response no-one is waiting on, say one that came too late,
+        # is of no use to anyone
+        if not self.session.deliver_response(message_obj):
+            logger.warning(
+                "dropping %s to request %s, which is not awaited",
+                message_obj.name, message_obj.request_id,
+            )
 
     def process_result(self, message_obj, result, exc=None):
         result_kwargs = {}
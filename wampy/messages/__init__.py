@@ -11,6 +11,7 @@ from . event import Event
 from . hello import Hello
 from . invocation import Invocation
 from . goodbye import Goodbye
+from . lazy import LazyMessage
 from . publish import Publish
 from . register import Register
 from . registered import Registered
@@ -23,8 +24,8 @@ from . welcome import Welcome
 
 __all__ = [
     Abort, Authenticate, Call, Challenge, Error, Event, Goodbye, Hello,
-    Invocation, Publish, Register, Registered, Result, Subscribe,
-    Subscribed, Welcome, Yield
+    Invocation, LazyMessage, Publish, Register, Registered, Result,
+    Subscribe, Subscribed, Welcome, Yield
 ]
 
 
@@ -0,0 +1,68 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import inspect
+
+getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+
+# where each field of a message class is found in a message, by class
+_field_positions = {}
+
+
+def field_positions(message_class):
+    """ The position in a message of each of ``message_class``'s fields,
+    which are the arguments it's made from, in order.
+    """
+    try:
+        return _field_positions[message_class]
+    except KeyError:
+        pass
+
+    # skipping ``self``, and the WAMP code that comes first in a message
+    names = getargspec(message_class.__init__).args[1:]
+    positions = dict((name, i) for i, name in enumerate(names, start=1))
+    _field_positions[message_class] = positions
+    return positions
+
+
+class LazyMessage(object):
+    """ Stands in for the ``message_class`` instance that a
+    ``wampy.serializers.LazyPayload`` would make.
+
+    The fields at the start of the message, e.g. an EVENT's subscription
+    id, are answered from what the payload peeked at. Anything else
+    deserializes the payload, and makes the real message to ask.
+
+    """
+
+    def __init__(self, message_class, payload):
+        self.message_class = message_class
+        self.payload = payload
+        self.WAMP_CODE = message_class.WAMP_CODE
+        self.name = message_class.name
+        self._message_obj = None
+
+    @property
+    def message_obj(self):
+        if self._message_obj is None:
+            self._message_obj = self.message_class(*self.payload[1:])
+        return self._message_obj
+
+    @property
+    def is_decoded(self):
+        return self.payload.is_decoded
+
+    def __getattr__(self, name):
+        # only called for what isn't found the usual way
+        if name.startswith('_') or name in ('message_class', 'payload'):
+            raise AttributeError(name)
+
+        position = field_positions(self.message_class).get(name)
+        if position is not None and position < len(self.payload.head):
+            return self.payload.head[position]
+
+        return getattr(self.message_obj, name)
+
+    def __repr__(self):
+        return "<LazyMessage {} {!r}>".format(self.name, self.payload)
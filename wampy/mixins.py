@@ -15,12 +15,15 @@ class ParseUrlMixin(object):
         - ws://host[:port][path]
         - wss://host[:port][path]
         - ws+unix:///path/to/my.socket
+        - rs://host[:port] or tcp://host[:port], for WAMP RawSocket
+        - rs+unix:///path/to/my.socket
 
         """
         self.scheme = None
         self.resource = None
         self.host = None
         self.port = None
+        self.unix_socket_path = None
 
         if self.url is None:
             return
@@ -43,7 +46,10 @@ class ParseUrlMixin(object):
         elif scheme == "wss":
             if not self.port:
                 self.port = 443
-        elif scheme in ('ws+unix', 'wss+unix'):
+        elif scheme in ('rs', 'tcp'):
+            if not self.port:
+                self.port = 8080
+        elif scheme in ('ws+unix', 'wss+unix', 'rs+unix'):
             pass
         else:
             raise ValueError("Invalid scheme: %s" % scheme)
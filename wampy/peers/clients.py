@@ -5,23 +5,37 @@
 import inspect
 import logging
 import os
+import time
+
+import eventlet
+import six
 
 from wampy.constants import (
     CROSSBAR_DEFAULT, DEFAULT_ROLES, DEFAULT_REALM
 )
 from wampy.errors import (
-    WampProtocolError, WampyError, WelcomeAbortedError
+    ConnectionError, WampProtocolError, WampyError, WelcomeAbortedError
 )
 from wampy.session import Session
-from wampy.messages import Abort, Challenge
+from wampy.messages import Abort, Challenge, Error
 from wampy.message_handler import MessageHandler
 from wampy.peers.routers import Router
 from wampy.roles.caller import CallProxy, RpcProxy
 from wampy.roles.publisher import PublishProxy
-from wampy.transports import WebSocket, SecureWebSocket
+from wampy.transports import RawSocket, WebSocket, SecureWebSocket
 
 logger = logging.getLogger("wampy.clients")
 
+# how many times, and how soon, to try to reconnect after the connection
+# is lost. the delay doubles after each failure.
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 0.5
+
+# seconds a Router has to connect in, when there are several to choose from
+PROBE_TIMEOUT = 5
+
+now = getattr(time, 'monotonic', time.time)
+
 
 class Client(object):
     """ A WAMP Client for use in Python applications, scripts and shells.
@@ -32,6 +46,8 @@ class Client(object):
             url=None, cert_path=None,
             realm=DEFAULT_REALM, roles=DEFAULT_ROLES,
             message_handler=None, name=None, router=None,
+            serializers=None, socket_options=None, flow_control=None,
+            lazy_decoding=False, endpoints=None, reconnect=None,
     ):
         """ A WAMP Client "Peer".
 
@@ -48,7 +64,10 @@ class Client(object):
                 This must include protocol, host and port and an optional path,
                 e.g. "ws://example.com:8080" or "wss://example.com:8080/ws".
                 Note though that "ws" protocol defaults to port 8080, an "wss"
-                to 443.
+                to 443. Use "rs://" (or "tcp://") for WAMP over RawSocket
+                rather than WebSocket, and "ws+unix:///path/to/my.socket"
+                or "rs+unix:///path/to/my.socket" for a Router listening on
+                a Unix domain socket.
             cert_path : str
                 If using ``wss`` protocol, a certificate might be required by
                 the Router. If so, provide here.
@@ -72,16 +91,66 @@ class Client(object):
                 This is more configurable and powerful, but requires a copy
                 of the Router's config file, making this only really useful
                 in single host setups or testing.
+            serializers : list
+                Optional. The serializers the ``Client`` may use, most
+                preferred first, e.g. ``["msgpack", "cbor", "json"]``. All
+                are offered to the Router, which picks one. Those whose
+                package is not installed are skipped. Defaults to JSON
+                only. Used when connecting by ``url``, otherwise configure
+                the ``router``.
+            socket_options : instance
+                Optional. A ``wampy.transports.sockets.SocketOptions``, to
+                tune the socket to the Router, e.g. with TCP keepalive.
+                Used when connecting by ``url``, like ``serializers``.
+            flow_control : instance
+                Optional. A ``wampy.transports.writer.FlowControl``, to
+                bound the messages waiting to be sent to the Router, and
+                say what happens to more while it's full. Used when
+                connecting by ``url``, like ``serializers``.
+            lazy_decoding : bool
+                Optional. Only deserialize the arguments of a message
+                when a handler asks for them, so that, e.g., a subclass
+                of ``MessageHandler`` can route or drop an EVENT by its
+                ``subscription_id`` alone. Used when connecting by
+                ``url``, like ``serializers``.
+            endpoints : list
+                An alternative to ``url`` or ``router``: several Routers,
+                as URLs or Router instances, any of which will do. All
+                are raced on ``start``, and the first to complete its
+                connection and handshake is used. Should the connection
+                later be lost, the race is run again, so the Client fails
+                over to another.
+            reconnect : bool
+                Optional. Whether to replace a connection that is lost
+                while in a session, unless the Router closed it normally.
+                Defaults to ``True`` given ``endpoints``, else ``False``.
 
         """
-        if url and router:
+        if len([arg for arg in (url, router, endpoints) if arg]) > 1:
             raise WampyError(
-                'Both ``url`` and ``router`` decide how your client connects '
-                'to the Router, and so only one can be defined on '
-                'instantiation. Please choose one or the other.'
+                'Each of ``url``, ``router`` and ``endpoints`` decide how '
+                'your client connects to the Router, and so only one can be '
+                'defined on instantiation. Please choose one.'
             )
 
+        # the Routers we may connect to, by URL, as configured here
+        router_kwargs = dict(
+            cert_path=cert_path, serializers=serializers,
+            socket_options=socket_options, flow_control=flow_control,
+            lazy_decoding=lazy_decoding,
+        )
+        self.routers = [
+            Router(url=endpoint, **router_kwargs)
+            if isinstance(endpoint, six.string_types) else endpoint
+            for endpoint in endpoints or []
+        ]
+        # how long, in seconds, each Router took to connect to when last
+        # raced, by URL
+        self.router_latencies = {}
+
         # the endpoint of a WAMP Router
+        if self.routers:
+            url = self.routers[0].url
         self.url = url or CROSSBAR_DEFAULT
 
         # the ``realm`` is the administrive domain to route messages over.
@@ -91,30 +160,35 @@ class Client(object):
         self.roles = roles
         # a Session is a transient conversation between two Peers - a Client
         # and a Router. Here we model the Peer we are going to connect to.
-        self.router = router or Router(url=self.url, cert_path=cert_path)
+        if not self.routers:
+            self.routers = [
+                router or Router(url=self.url, **router_kwargs)]
+        # of these, the one we're connected to, or will be
+        self.router = self.routers[0]
         # wampy uses a decoupled "messge handler" to process incoming messages.
         # wampy also provides a very adequate default.
         self.message_handler = message_handler or MessageHandler()
 
-        # this conversation is over a transport. WAMP messages are transmitted
-        # as WebSocket messages by default (well, actually... that's because no
-        # other transports are supported!)
-        if self.router.scheme == "ws":
-            self.transport = WebSocket()
-        elif self.router.scheme == "wss":
-            self.transport = SecureWebSocket()
-        else:
-            raise WampyError(
-                'Network protocl must be "ws" or "wss"'
-            )
-
-        # the transport is responsible for the connection.
-        self.transport.register_router(self.router)
+        # this conversation is over a transport, which is responsible for
+        # the connection.
+        self.transport = self._make_transport(self.router)
+        # any other Router is only connected to on ``start``, but a bad URL
+        # should be refused now, not then
+        for other in self.routers[1:]:
+            self._make_transport(other)
 
         # generally ``name`` is used for debuggubg and logging only
         self.name = name or self.__class__.__name__
 
+        # whether a lost connection is replaced with another
+        if reconnect is None:
+            reconnect = bool(endpoints)
+        self.reconnect = reconnect
+
         self._session = None
+        # set by ``stop``, after which a lost connection is not replaced
+        self._stopped = False
+        self._reconnecting = False
 
     def __enter__(self):
         self.start()
@@ -152,8 +226,13 @@ class Client(object):
         return PublishProxy(client=self)
 
     def start(self):
+        self._stopped = False
+
         # establish the underlying connection. this will raise on error.
-        connection = self.transport.connect()
+        if len(self.routers) > 1:
+            connection = self._connect_fastest()
+        else:
+            connection = self.transport.connect()
 
         # create a Session repr between ourselves and the Router.
         # pass in the live connection over a transport that the Session
@@ -190,12 +269,153 @@ class Client(object):
             self.name, self.session.id
         )
 
+        self.register_roles()
+
     def stop(self):
+        self._stopped = True
+
         if self.session and self.session.id:
             self.session.end()
 
         self.transport.disconnect()
 
+    def _reconnect(self, session=None):
+        """ Replace a lost connection, with another to the same Router or,
+        given several, whichever now connects first.
+
+        Both the heartbeat and the ``session`` listening to the connection
+        may find it lost, but only the first to do so reconnects.
+
+        """
+        if self._stopped or self._reconnecting:
+            return
+        if session is not None and session is not self._session:
+            # a connection already replaced
+            return
+
+        logger.warning(
+            "%s lost its connection to %s, reconnecting",
+            self.name, self.router.url,
+        )
+        # the lost session is kept until another replaces it, so that
+        # anything sent meanwhile fails with a ``ConnectionError``
+        self._reconnecting = True
+
+        try:
+            self._start_again()
+        finally:
+            self._reconnecting = False
+
+    def _start_again(self):
+        # don't leave the lost connection half open, nor its heartbeat
+        # running
+        try:
+            self.transport.abort()
+        except Exception:
+            pass
+
+        delay = RECONNECT_DELAY
+        for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+            if self._stopped:
+                return
+
+            try:
+                self.start()
+            except Exception as exc:
+                logger.warning(
+                    "%s failed to reconnect (attempt %s): %s",
+                    self.name, attempt, exc,
+                )
+                try:
+                    self.transport.abort()
+                except Exception:
+                    pass
+
+                eventlet.sleep(delay)
+                delay *= 2
+            else:
+                logger.info("%s reconnected", self.name)
+                return
+
+        logger.error(
+            "%s gave up reconnecting to %s", self.name, self.router.url)
+
+    def _make_transport(self, router):
+        # WAMP messages are transmitted as WebSocket messages by default, or
+        # else over a RawSocket. The "+unix" schemes reach a Router on the
+        # same host over a Unix domain socket.
+        if router.scheme in ("ws", "ws+unix"):
+            transport = WebSocket()
+        elif router.scheme == "wss":
+            transport = SecureWebSocket()
+        elif router.scheme in ("rs", "tcp", "rs+unix"):
+            transport = RawSocket()
+        else:
+            raise WampyError(
+                'Network protocl must be "ws", "wss", "rs", "tcp", '
+                '"ws+unix" or "rs+unix"'
+            )
+
+        transport.register_router(router)
+        # should a heartbeat find the connection dead, start over
+        transport.connection_lost_callback = self._reconnect
+        return transport
+
+    def _connect_fastest(self):
+        """ Connect to every Router at once, and keep the connection to
+        whichever is first to complete its handshake.
+        """
+        results = eventlet.Queue()
+
+        def probe(router):
+            transport = self._make_transport(router)
+            started = now()
+            try:
+                with eventlet.Timeout(PROBE_TIMEOUT):
+                    transport.connect()
+            except (Exception, eventlet.Timeout) as exc:
+                logger.warning("failed to connect to %s: %s", router.url, exc)
+                transport.abort()
+                results.put((router, None, exc))
+                return
+
+            self.router_latencies[router.url] = now() - started
+            results.put((router, transport, None))
+
+        for router in self.routers:
+            eventlet.spawn(probe, router)
+
+        errors = []
+        for _ in self.routers:
+            router, transport, exc = results.get()
+            if transport is not None:
+                break
+            errors.append("{}: {}".format(router.url, exc))
+        else:
+            raise ConnectionError(
+                "failed to connect to any Router: {}".format(
+                    "; ".join(errors))
+            )
+
+        logger.info(
+            "%s connected to %s in %.3f seconds", self.name, router.url,
+            self.router_latencies[router.url],
+        )
+        self.router = router
+        self.transport = transport
+
+        # the rest are only kept open long enough to time them
+        eventlet.spawn(self._close_slower, results, len(self.routers) - 1)
+
+        return transport
+
+    @staticmethod
+    def _close_slower(results, count):
+        for _ in range(count):
+            _, transport, _ = results.get()
+            if transport is not None:
+                transport.disconnect()
+
     def send_message(self, message):
         self.session.send_message(message)
 
@@ -205,10 +425,8 @@ class Client(object):
     def make_rpc(self, message):
         logger.debug("%s sending message: %s", self.name, message)
 
-        self.session.send_message(message)
-
         try:
-            response = self.session.recv_message()
+            response = self.session.request(message)
         except WampProtocolError as wamp_err:
             logger.error(wamp_err)
             raise
@@ -233,24 +451,32 @@ class Client(object):
                 inspect.isclass(base) and callable(v)
             )
 
+        # the request ids of each REGISTER and SUBSCRIBE, with what it's
+        # for, which are all sent before any answer is waited on
+        requests = []
+
         for maybe_role in maybe_roles:
 
             if hasattr(maybe_role, 'callee'):
                 procedure_name = maybe_role.__name__
                 invocation_policy = maybe_role.invocation_policy
-                self.session._register_procedure(
+                request_id = self.session._register_procedure(
                     procedure_name, invocation_policy)
-
-                logger.debug(
-                    '%s registered callee "%s"', self.name, procedure_name,
-                )
+                requests.append((request_id, procedure_name))
 
             if hasattr(maybe_role, 'subscriber'):
                 topic = maybe_role.topic
                 handler_name = maybe_role.handler.__name__
                 handler = getattr(self, handler_name)
-                self.session._subscribe_to_topic(handler, topic)
-
-                logger.debug(
-                    '%s subscribed to topic "%s"', self.name, topic,
+                request_id = self.session._subscribe_to_topic(handler, topic)
+                requests.append((request_id, topic))
+
+        for request_id, name in requests:
+            response = self.session.wait_for_response(request_id)
+            if response.WAMP_CODE == Error.WAMP_CODE:
+                raise WampProtocolError(
+                    '{} failed to register or subscribe "{}": {}'.format(
+                        self.name, name, response.error)
                 )
+
+            logger.debug('%s registered or subscribed "%s"', self.name, name)
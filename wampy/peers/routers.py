@@ -10,27 +10,87 @@ import subprocess
 from socket import error as socket_error
 from time import time as now, sleep
 
+from wampy.constants import MAX_MESSAGE_SIZE
 from wampy.errors import ConnectionError, WampyError
 from wampy.mixins import ParseUrlMixin
+from wampy.serializers import get_serializers
+from wampy.transports.sockets import SocketOptions, create_ssl_context
 
 logger = logging.getLogger('wampy.peers.routers')
 
 
-class Router(ParseUrlMixin):
-    def __init__(self, url, cert_path=None, ipv=4):
+class TransportOptionsMixin(object):
+    """ How a Router is to be connected to, whatever the Router.
+    """
+
+    def set_transport_options(
+        self, max_message_size=MAX_MESSAGE_SIZE, fragment_size=None,
+        compression=None, serializers=None, socket_options=None,
+        heartbeat_interval=None, heartbeat_timeout=None, ssl_context=None,
+        write_linger=None, flow_control=None, max_frame_size=None,
+        lazy_decoding=False,
+    ):
+        # shared by every TLS connection to the Router. made on first use
+        # from ``certificate``, unless given.
+        self._ssl_context = ssl_context
+        # the largest message we'll accept from the Router when it arrives
+        # fragmented over several frames
+        self.max_message_size = max_message_size
+        # the largest single frame we'll accept, which defaults to
+        # ``max_message_size``. larger frames, or messages, are refused
+        # on the word of their headers, before any memory is set aside.
+        self.max_frame_size = max_frame_size
+        # if set, messages longer than this are sent to the Router in
+        # fragments of this size
+        self.fragment_size = fragment_size
+        # optionally a WebSocket extension to compress messages with, e.g.
+        # ``wampy.transports.websocket.compression.PerMessageDeflate``
+        self.compression = compression
+        # how WAMP messages may be encoded, most preferred first. the
+        # Router picks one of these during the WebSocket upgrade. with
+        # ``lazy_decoding``, messages received are only deserialized as
+        # far as they're looked at.
+        self.serializers = get_serializers(serializers, lazy=lazy_decoding)
+        # a ``wampy.transports.sockets.SocketOptions``, which by default
+        # just disables Nagle's algorithm
+        self.socket_options = socket_options or SocketOptions()
+        # if set, the Router is pinged this often, in seconds, and the
+        # connection given up on if no pong is heard for ``timeout``
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        # if set, the seconds to wait before each write for more to go
+        # out along with it, i.e. a little latency for fewer syscalls
+        self.write_linger = write_linger
+        # a ``wampy.transports.writer.FlowControl``, to bound what may be
+        # waiting to be sent. unbounded by default.
+        self.flow_control = flow_control
+
+    @property
+    def ssl_context(self):
+        if self._ssl_context is None:
+            self._ssl_context = create_ssl_context(self.certificate)
+        return self._ssl_context
+
+
+class Router(ParseUrlMixin, TransportOptionsMixin):
+    def __init__(self, url, cert_path=None, ipv=None, **transport_options):
         self.url = url
         self.certificate = cert_path
+        # 4 or 6 to connect over that IP version only, else whichever
+        # of the Router's addresses connects first
         self.ipv = ipv
+        self.set_transport_options(**transport_options)
         self.parse_url()
 
 
-class Crossbar(ParseUrlMixin):
+class Crossbar(ParseUrlMixin, TransportOptionsMixin):
 
     def __init__(
         self,
         url="ws://localhost:8080",
         config_path="./crossbar/config.json",
         crossbar_directory=None,
+        **transport_options
     ):
         """ A wrapper around a Crossbar Server. Wampy uses this when
         executing its test suite.
@@ -39,6 +99,9 @@ class Crossbar(ParseUrlMixin):
         with production applications. For Production, just deploy and
         connect to as you would any other server.
 
+        ``transport_options`` configure how it's connected to, as they
+        do for a ``Router``.
+
         """
         with open(config_path) as data_file:
             config_data = json.load(data_file)
@@ -76,6 +139,7 @@ class Crossbar(ParseUrlMixin):
             self.certificate = self.transport['endpoint']['tls']['certificate']
         except KeyError:
             self.certificate = None
+        self.set_transport_options(**transport_options)
 
         self.proc = None
         self.started = False
@@ -2,22 +2,538 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import simplejson as json
-from wampy.errors import WampProtocolError
+import json
+import logging
+import os
+import re
 
+import six
 
-def json_serialize(message):
-    # WAMP serialization insists on UTF-8 encoded Unicode
-    try:
+from wampy.errors import WampProtocolError, WampyError
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+logger = logging.getLogger('wampy.serializers')
+
+# how many leading integers of a message are peeked at, which is enough
+# for its type and, e.g., the subscription and publication ids of an EVENT
+PEEK_COUNT = 3
+
+# the start of a JSON array, then each integer at the start of one
+JSON_ARRAY_START = re.compile(br'\s*\[')
+JSON_INTEGER = re.compile(br'\s*(-?\d+)\s*([,\]])')
+
+# a number too long, maybe, for a 64 bit integer, which the fast JSON
+# backends can't be trusted with: a signed one is bounded by +/- 2 ** 63
+# and an unsigned one by 2 ** 64, 19 and 20 digits long. any run of 19
+# digits matches though, including one in a string, such as a
+# nanosecond timestamp or an id, and so sends that payload to the slower
+# but exact fallback too.
+LONG_NUMBER = re.compile(br'\d{19}')
+
+
+class StdlibJsonBackend(object):
+    """ JSON from the standard library: always there, and exact, though
+    not the fastest.
+    """
+    name = 'json'
+
+    def dumps(self, message):
+        # WAMP serialization insists on UTF-8 encoded Unicode
+        kwargs = {'encoding': 'utf8'} if six.PY2 else {}
         data = json.dumps(
+            message, separators=(',', ':'), ensure_ascii=False, **kwargs)
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+
+        return data
+
+    def loads(self, payload):
+        # decode required before loading JSON for python 2 only
+        return json.loads(payload.decode('utf-8'))
+
+
+class SimpleJsonBackend(StdlibJsonBackend):
+    """ JSON from the ``simplejson`` package.
+    """
+    name = 'simplejson'
+
+    def __init__(self):
+        if simplejson is None:
+            raise WampyError(
+                "The simplejson backend requires the simplejson package")
+
+    def dumps(self, message):
+        data = simplejson.dumps(
             message, separators=(',', ':'), ensure_ascii=False,
             encoding='utf8',
         )
-    except TypeError as exc:
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+
+        return data
+
+    def loads(self, payload):
+        return simplejson.loads(payload.decode('utf-8'))
+
+
+class FastJsonBackend(object):
+    """ A JSON library written for speed, which hands over to simplejson,
+    if installed, else the standard library, for what it can't do
+    exactly, i.e. integers beyond 64 bits, or at all, e.g. a ``Decimal``
+    or a namedtuple, which simplejson sends as a number and an object.
+    """
+    name = None
+
+    def __init__(self):
+        if simplejson is not None:
+            self.fallback = SimpleJsonBackend()
+        else:
+            self.fallback = StdlibJsonBackend()
+
+    def dumps(self, message):
+        try:
+            return self._dumps(message)
+        except (TypeError, ValueError, OverflowError):
+            # the fallback raises for what really can't be serialized,
+            # and handles the rest
+            return self.fallback.dumps(message)
+
+    def loads(self, payload):
+        if LONG_NUMBER.search(payload):
+            # would otherwise be rounded to a float, or refused
+            return self.fallback.loads(payload)
+
+        return self._loads(payload)
+
+
+class OrjsonBackend(FastJsonBackend):
+    """ JSON from the ``orjson`` package, the fastest there is.
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise WampyError(
+                "The orjson backend requires the orjson package: "
+                "pip install wampy[orjson]"
+            )
+        super(OrjsonBackend, self).__init__()
+
+    def _dumps(self, message):
+        return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS)
+
+    def _loads(self, payload):
+        return orjson.loads(payload)
+
+
+class UJsonBackend(FastJsonBackend):
+    """ JSON from the ``ujson`` package.
+    """
+    name = 'ujson'
+
+    def __init__(self):
+        if ujson is None:
+            raise WampyError(
+                "The ujson backend requires the ujson package: "
+                "pip install wampy[ujson]"
+            )
+        super(UJsonBackend, self).__init__()
+
+    def _dumps(self, message):
+        data = ujson.dumps(
+            message, ensure_ascii=False, escape_forward_slashes=False)
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+
+        return data
+
+    def _loads(self, payload):
+        return ujson.loads(payload)
+
+
+# the JSON backends wampy knows by name
+JSON_BACKENDS = {
+    'orjson': OrjsonBackend,
+    'ujson': UJsonBackend,
+    'simplejson': SimpleJsonBackend,
+    'json': StdlibJsonBackend,
+}
+
+# the first of these that's installed is used, unless another is named
+# by the ``WAMPY_JSON_BACKEND`` environment variable, or ``set_json_backend``
+JSON_BACKEND_PREFERENCES = ['orjson', 'ujson', 'simplejson', 'json']
+
+
+def get_json_backend(name=None):
+    """ Return a JSON backend by ``name``, or the fastest available.
+    """
+    if name is not None:
+        try:
+            backend_cls = JSON_BACKENDS[name]
+        except KeyError:
+            raise WampyError(
+                'Unknown JSON backend "{}", choose from: {}'.format(
+                    name, ', '.join(sorted(JSON_BACKENDS)))
+            )
+        return backend_cls()
+
+    for preference in JSON_BACKEND_PREFERENCES:
+        try:
+            return JSON_BACKENDS[preference]()
+        except WampyError:
+            continue
+
+    return StdlibJsonBackend()
+
+
+def set_json_backend(name):
+    """ Make the backend called ``name`` the one used by every
+    ``JsonSerializer`` made from now on.
+    """
+    global JSON_BACKEND
+    JSON_BACKEND = get_json_backend(name)
+    logger.info("JSON backend: %s", JSON_BACKEND.name)
+
+
+JSON_BACKEND = get_json_backend(os.environ.get('WAMPY_JSON_BACKEND'))
+
+
+def json_dumps(backend, message):
+    """ ``message`` as UTF-8 encoded JSON, by ``backend``.
+    """
+    try:
+        return backend.dumps(message)
+    except (TypeError, ValueError) as exc:
         raise WampProtocolError(
             "Message not serialized: {} - {}".format(
                 message, str(exc)
             )
         )
 
-    return data
+
+def json_serialize(message):
+    """ ``message`` as JSON text, as a ``JsonSerializer`` would send it.
+    """
+    return json_dumps(JSON_BACKEND, message).decode('utf-8')
+
+
+class JsonSerializer(object):
+    """ WAMP messages as UTF-8 encoded JSON, sent in text frames.
+
+    The JSON itself is done by a backend, which is the fastest installed
+    unless one is named.
+
+    """
+    SUBPROTOCOL = 'wamp.2.json'
+    BINARY = False
+
+    def __init__(self, backend=None):
+        """ A JSON serializer.
+
+        :Parameters:
+            backend : str
+                Optional. The JSON backend, e.g. ``"orjson"``, ``"ujson"``
+                or ``"json"`` for the standard library. Defaults to that
+                of ``set_json_backend``, else the fastest installed.
+
+        """
+        if backend is None:
+            self.backend = JSON_BACKEND
+        else:
+            self.backend = get_json_backend(backend)
+
+    def serialize(self, message):
+        return json_dumps(self.backend, message)
+
+    def deserialize(self, payload):
+        return self.backend.loads(payload)
+
+    def peek(self, payload, count):
+        """ Return up to ``count`` of the integers that ``payload`` - a
+        serialized message - starts with, without deserializing it.
+        """
+        match = JSON_ARRAY_START.match(payload)
+        if match is None:
+            return []
+
+        head = []
+        position = match.end()
+        while len(head) < count:
+            match = JSON_INTEGER.match(payload, position)
+            if match is None:
+                break
+
+            head.append(int(match.group(1)))
+            if match.group(2) == b']':
+                break
+            position = match.end()
+
+        return head
+
+
+class MsgPackSerializer(object):
+    """ WAMP messages as MessagePack, sent in binary frames.
+
+    Requires the optional ``msgpack`` package.
+
+    """
+    SUBPROTOCOL = 'wamp.2.msgpack'
+    BINARY = True
+
+    def __init__(self):
+        if msgpack is None:
+            raise WampyError(
+                "The msgpack serializer requires the msgpack package: "
+                "pip install wampy[msgpack]"
+            )
+
+    def serialize(self, message):
+        try:
+            # strings are packed as "str" and bytes as "bin", as WAMP wants
+            return msgpack.packb(message, use_bin_type=True)
+        except (TypeError, ValueError) as exc:
+            raise WampProtocolError(
+                "Message not serialized: {} - {}".format(
+                    message, str(exc)
+                )
+            )
+
+    def deserialize(self, payload):
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+    def peek(self, payload, count):
+        """ Return up to ``count`` of the integers that ``payload`` - a
+        serialized message - starts with, without deserializing it.
+        """
+        unpacker = msgpack.Unpacker(raw=False, strict_map_key=False)
+        unpacker.feed(payload)
+
+        head = []
+        length = unpacker.read_array_header()
+        while len(head) < min(count, length):
+            # look at the type of what's next before unpacking it, so
+            # that nothing but an integer is ever unpacked
+            if not is_msgpack_integer(
+                six.indexbytes(payload, unpacker.tell())
+            ):
+                break
+            head.append(unpacker.unpack())
+
+        return head
+
+
+def is_msgpack_integer(first_byte):
+    return (
+        first_byte <= 0x7f or  # positive fixint
+        0xcc <= first_byte <= 0xd3 or  # uint 8 to int 64
+        first_byte >= 0xe0  # negative fixint
+    )
+
+
+class CborSerializer(object):
+    """ WAMP messages as CBOR, sent in binary frames.
+
+    Native ``bytes`` are encoded as CBOR byte strings, so binary
+    arguments need no base64 step.
+
+    Requires the optional ``cbor2`` package.
+
+    """
+    SUBPROTOCOL = 'wamp.2.cbor'
+    BINARY = True
+
+    def __init__(self):
+        if cbor2 is None:
+            raise WampyError(
+                "The CBOR serializer requires the cbor2 package: "
+                "pip install wampy[cbor]"
+            )
+
+    def serialize(self, message):
+        try:
+            return cbor2.dumps(message)
+        except (TypeError, ValueError, cbor2.CBOREncodeError) as exc:
+            raise WampProtocolError(
+                "Message not serialized: {} - {}".format(
+                    message, str(exc)
+                )
+            )
+
+    def deserialize(self, payload):
+        return cbor2.loads(payload)
+
+
+class LazyPayload(object):
+    """ A deserialized message, as far as anyone looks at it.
+
+    Only the integers the message starts with - its type, and usually
+    the ids that say what it's about - are read on arrival, and only if
+    the serializer can ``peek``. The rest is deserialized when first
+    asked for, so a message can be routed, or dropped, without paying
+    for its arguments.
+
+    """
+
+    def __init__(self, body, serializer, peek=PEEK_COUNT):
+        self.body = body
+        self.serializer = serializer
+        self._decoded = None
+
+        try:
+            self.head = serializer.peek(body, peek)
+        except Exception:
+            # e.g. the serializer can't peek, so the message must be
+            # deserialized to find out anything about it
+            self.head = []
+
+    @property
+    def is_decoded(self):
+        return self._decoded is not None
+
+    @property
+    def decoded(self):
+        if self._decoded is None:
+            try:
+                self._decoded = self.serializer.deserialize(self.body)
+            except Exception as exc:
+                raise WampProtocolError(
+                    "Failed to load {} message: {}".format(
+                        self.serializer.SUBPROTOCOL, exc)
+                )
+
+        return self._decoded
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and 0 <= index < len(self.head):
+            return self.head[index]
+
+        return self.decoded[index]
+
+    def __len__(self):
+        return len(self.decoded)
+
+    def __iter__(self):
+        return iter(self.decoded)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyPayload):
+            other = other.decoded
+        return self.decoded == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "<LazyPayload {}... ({} bytes)>".format(
+            self.head, len(self.body))
+
+
+class LazySerializer(object):
+    """ Wraps a serializer so that each message it deserializes is a
+    ``LazyPayload``.
+    """
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+        self.SUBPROTOCOL = serializer.SUBPROTOCOL
+        self.BINARY = serializer.BINARY
+
+    def serialize(self, message):
+        return self.serializer.serialize(message)
+
+    def deserialize(self, payload):
+        return LazyPayload(payload, self.serializer)
+
+
+# the serializers wampy knows by name, which can be extended with
+# ``register_serializer``
+SERIALIZERS = {
+    'json': JsonSerializer,
+    'msgpack': MsgPackSerializer,
+    'cbor': CborSerializer,
+}
+
+DEFAULT_SERIALIZERS = ['json']
+
+
+def register_serializer(name, serializer_cls):
+    """ Make a serializer available by ``name``, e.g. to ``Client``.
+
+    ``serializer_cls`` must have a ``SUBPROTOCOL``, a ``BINARY`` flag and
+    ``serialize`` and ``deserialize`` methods, as ``JsonSerializer`` has.
+
+    """
+    SERIALIZERS[name] = serializer_cls
+
+
+def get_serializers(preferences=None, lazy=False):
+    """ Return serializer instances for an ordered list of preferences.
+
+    :Parameters:
+        preferences : list
+            Serializer names, e.g. ``["msgpack", "cbor", "json"]``, or
+            instances, most preferred first. Defaults to JSON only.
+        lazy : bool
+            Wrap each in a ``LazySerializer``, so that messages are only
+            deserialized as far as they're looked at.
+
+    Named serializers whose optional package is not installed are
+    skipped, so a preference list can be deployed ahead of its
+    dependencies.
+
+    """
+    serializers = []
+
+    for preference in preferences or DEFAULT_SERIALIZERS:
+        if not isinstance(preference, six.string_types):
+            serializers.append(preference)
+            continue
+
+        try:
+            serializer_cls = SERIALIZERS[preference]
+        except KeyError:
+            raise WampyError(
+                'Unknown serializer "{}", choose from: {}'.format(
+                    preference, ', '.join(sorted(SERIALIZERS)))
+            )
+
+        try:
+            serializers.append(serializer_cls())
+        except WampyError as exc:
+            logger.warning('skipping serializer "%s": %s', preference, exc)
+
+    if not serializers:
+        raise WampyError(
+            "None of the serializers {} are available".format(preferences)
+        )
+
+    if lazy:
+        serializers = [LazySerializer(s) for s in serializers]
+
+    return serializers
@@ -6,13 +6,18 @@ import logging
 from functools import partial
 
 import eventlet
+from eventlet.event import Event
 
-from wampy.errors import ConnectionError, WampProtocolError
+from wampy.errors import (
+    ConnectionClosedError, ConnectionError, WampProtocolError,
+    WebsocktProtocolError,
+)
 from wampy.messages import MESSAGE_TYPE_MAP
 from wampy.messages.hello import Hello
 from wampy.messages.goodbye import Goodbye
 from wampy.messages.register import Register
 from wampy.messages.subscribe import Subscribe
+from wampy.transports.websocket.frames import CLOSE_GOING_AWAY, CLOSE_NORMAL
 
 logger = logging.getLogger('wampy.session')
 
@@ -58,10 +63,16 @@ class Session(object):
         self.message_handler = message_handler
 
         self.request_ids = {}
+        # the requests awaiting a response from the Router, by request id,
+        # each with an ``Event`` that will be sent the response
+        self._pending_requests = {}
         self.subscription_map = {}
         self.registration_map = {}
 
         self.session_id = None
+        # why the connection was closed, should the Router close it
+        self.close_code = None
+        self.close_reason = None
         # spawn a green thread to listen for incoming messages over
         # a connection and put them on a queue to be processed
         self._managed_thread = None
@@ -88,6 +99,23 @@ class Session(object):
     def id(self):
         return self.session_id
 
+    @property
+    def rtt_stats(self):
+        """ Round trip times to the Router, if the transport has a
+        heartbeat, else ``None``.
+        """
+        heartbeat = getattr(self.connection, 'heartbeat', None)
+        if heartbeat is not None:
+            return heartbeat.stats
+
+    @property
+    def writable(self):
+        """ Whether more may be sent without waiting on (or, as
+        configured, raising or dropping for) a full send buffer.
+        """
+        writer = getattr(self.connection, 'writer', None)
+        return writer is None or writer.writable
+
     def begin(self):
         return self._say_hello()
 
@@ -98,6 +126,7 @@ class Session(object):
         self.session_id = None
         self._managed_thread.kill()
         self._managed_thread = None
+        self._fail_pending_requests(ConnectionError("the session has ended"))
 
     def send_message(self, message_obj):
         message_type = MESSAGE_TYPE_MAP[message_obj.WAMP_CODE]
@@ -128,6 +157,68 @@ class Session(object):
 
         return message
 
+    def request(self, message_obj, timeout=5):
+        """ Send ``message_obj`` - a ``Call``, say - and return the
+        Router's response to it, which is told apart from any other by
+        its request id. So any number of green threads may be waiting
+        on requests at once.
+        """
+        request_id = message_obj.request_id
+        self.expect_response(request_id)
+
+        try:
+            self.send_message(message_obj)
+        except Exception:
+            self._pending_requests.pop(request_id, None)
+            raise
+
+        return self.wait_for_response(request_id, timeout)
+
+    def expect_response(self, request_id):
+        """ Make ready for the Router's response to request
+        ``request_id``, which ``wait_for_response`` must then be called
+        for.
+
+        Call this before the request is sent, so that the response can't
+        be missed.
+
+        """
+        self._pending_requests[request_id] = Event()
+
+    def wait_for_response(self, request_id, timeout=5):
+        """ Return the Router's response to request ``request_id``, or
+        raise ``ConnectionError`` should the connection be lost first.
+        """
+        waiter = self._pending_requests[request_id]
+
+        try:
+            with eventlet.Timeout(timeout, False):
+                return waiter.wait()
+        finally:
+            self._pending_requests.pop(request_id, None)
+
+        raise WampProtocolError(
+            "no response to request {} (timed-out in {})".format(
+                request_id, timeout)
+        )
+
+    def deliver_response(self, message_obj):
+        """ Send ``message_obj`` to whoever is waiting on the request it
+        answers, returning ``False`` if no-one is.
+        """
+        waiter = self._pending_requests.get(message_obj.request_id)
+        if waiter is None or waiter.ready():
+            return False
+
+        waiter.send(message_obj)
+        return True
+
+    def _fail_pending_requests(self, exc):
+        # each is taken off the table by whoever waits on it
+        for waiter in self._pending_requests.values():
+            if not waiter.ready():
+                waiter.send_exception(exc)
+
     def _say_hello(self):
         message = Hello(self.realm, self.roles)
         self.send_message(message)
@@ -158,6 +249,10 @@ class Session(object):
     def _listen(self, connection, message_queue):
 
         def connection_handler():
+            # whether the Router meant to close the connection, e.g. on
+            # shutting down, in which case it isn't replaced
+            closed_normally = False
+
             while True:
                 try:
                     frame = connection.receive()
@@ -169,11 +264,40 @@ class Session(object):
                             self.client
                         )
                         eventlet.spawn(handler)
+                except ConnectionClosedError as exc:
+                    logger.warning(
+                        'connection closed for client "%s": %s %s',
+                        self.client.name, exc.code, exc.reason,
+                    )
+                    self.close_code = exc.code
+                    self.close_reason = exc.reason
+                    closed_normally = exc.code in (
+                        CLOSE_NORMAL, CLOSE_GOING_AWAY)
+                    break
                 except (
-                        SystemExit, KeyboardInterrupt, ConnectionError,
-                        WampProtocolError,
-                ):
+                    ConnectionError, WampProtocolError, WebsocktProtocolError,
+                ) as exc:
+                    # the transport has already failed the connection
+                    logger.warning(
+                        'connection lost for client "%s": %s',
+                        self.client.name, exc,
+                    )
                     break
+                except (SystemExit, KeyboardInterrupt):
+                    return
+
+            # no response is coming to anything still waiting on one
+            self._fail_pending_requests(
+                ConnectionError("connection lost awaiting a response")
+            )
+            # and the Client may want another connection, should it have
+            # been in a session on this one, unless it's the one that
+            # closed it
+            if (
+                self.client.reconnect and not closed_normally and
+                self.session_id is not None
+            ):
+                eventlet.spawn(self.client._reconnect, self)
 
         gthread = eventlet.spawn(connection_handler)
         self._managed_thread = gthread
@@ -194,15 +318,19 @@ class Session(object):
         message = Subscribe(topic=topic)
         request_id = message.request_id
 
+        self.request_ids[request_id] = message, handler
+        self.expect_response(request_id)
+
         try:
             self.send_message(message)
         except Exception as exc:
+            self._pending_requests.pop(request_id, None)
             raise WampProtocolError(
                 "failed to subscribe to {}: \"{}\"".format(
                     topic, exc)
             )
 
-        self.request_ids[request_id] = message, handler
+        return request_id
 
     def _register_procedure(self, procedure_name, invocation_policy="single"):
         """ Register a "procedure" on a Client as callable over the Router.
@@ -211,11 +339,15 @@ class Session(object):
         message = Register(procedure=procedure_name, options=options)
         request_id = message.request_id
 
+        self.request_ids[request_id] = procedure_name
+        self.expect_response(request_id)
+
         try:
             self.send_message(message)
         except ValueError:
+            self._pending_requests.pop(request_id, None)
             raise WampProtocolError(
                 "failed to register callee: %s", procedure_name
             )
 
-        self.request_ids[request_id] = procedure_name
+        return request_id
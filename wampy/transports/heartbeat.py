@@ -0,0 +1,172 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import time
+from collections import deque
+from struct import Struct
+
+import eventlet
+
+logger = logging.getLogger(__name__)
+
+# every ping carries a sequence number, which the pong echoes back
+PING_PAYLOAD = Struct('!Q')
+
+# how many round trip times the statistics are drawn from
+RTT_SAMPLES = 100
+
+now = getattr(time, 'monotonic', time.time)
+
+
+class Heartbeat(object):
+    """ Pings the Router every ``interval`` seconds from a green thread
+    of its own, and times the pongs that come back.
+
+    Should no pong arrive for ``timeout`` seconds, the connection is
+    presumed dead and ``on_timeout`` is called, in a new green thread.
+
+    The transport must have a ``ping(payload)`` method, and pass the
+    payload of each pong it receives to ``pong``.
+
+    """
+
+    def __init__(self, transport, interval, timeout=None, on_timeout=None):
+        self.transport = transport
+        self.interval = interval
+        self.timeout = timeout or 3 * interval
+        self.on_timeout = on_timeout
+
+        self.pings_sent = 0
+        self.pongs_received = 0
+        self.last_pong = None
+
+        # when each unanswered ping was sent, by sequence number
+        self._pending = {}
+        self._rtts = deque(maxlen=RTT_SAMPLES)
+        self._thread = None
+
+    @property
+    def rtt(self):
+        """ The most recent round trip time, in seconds, if there is one.
+        """
+        if self._rtts:
+            return self._rtts[-1]
+
+    @property
+    def stats(self):
+        """ Round trip times, in seconds, over the last ``RTT_SAMPLES``
+        pongs, along with ping and pong counts.
+        """
+        rtts = self._rtts
+        return {
+            'rtt': self.rtt,
+            'min': min(rtts) if rtts else None,
+            'max': max(rtts) if rtts else None,
+            'avg': sum(rtts) / len(rtts) if rtts else None,
+            'samples': len(rtts),
+            'pings_sent': self.pings_sent,
+            'pongs_received': self.pongs_received,
+        }
+
+    def start(self):
+        self.last_pong = now()
+        self._thread = eventlet.spawn(self._run)
+
+    def stop(self):
+        thread, self._thread = self._thread, None
+        # the heartbeat may be stopped from its own thread, as it tears
+        # down a dead connection, and it can't kill itself
+        if thread is not None and thread is not eventlet.getcurrent():
+            thread.kill()
+
+        self._pending.clear()
+
+    def pong(self, payload):
+        try:
+            sequence, = PING_PAYLOAD.unpack(payload)
+            sent = self._pending.pop(sequence)
+        except Exception:
+            # not an answer to one of our pings - Routers may send
+            # unsolicited pongs as a heartbeat of their own
+            logger.debug("unexpected pong: %r", payload)
+            return
+
+        received = now()
+        self.last_pong = received
+        self.pongs_received += 1
+        self._rtts.append(received - sent)
+
+        # anything sent before this ping has been overtaken, so is lost
+        for pending in [s for s in self._pending if s < sequence]:
+            del self._pending[pending]
+
+    def _run(self):
+        while self._thread is not None:
+            eventlet.sleep(self.interval)
+
+            silence = now() - self.last_pong
+            if silence > self.timeout:
+                logger.error(
+                    "no pong from the Router in %.1f seconds", silence)
+                self._timed_out()
+                return
+
+            sequence = self.pings_sent
+            self._pending[sequence] = now()
+            self.pings_sent += 1
+
+            try:
+                self.transport.ping(PING_PAYLOAD.pack(sequence))
+            except Exception as exc:
+                logger.error("failed to ping the Router: %s", exc)
+                self._timed_out()
+                return
+
+    def _timed_out(self):
+        self._thread = None
+        if self.on_timeout is not None:
+            eventlet.spawn(self.on_timeout)
+
+
+class HeartbeatMixin(object):
+    """ Heartbeats for a transport that can ``ping``, as configured by
+    the Router's ``heartbeat_interval`` and ``heartbeat_timeout``.
+    """
+
+    def register_heartbeat(self, router):
+        self.heartbeat_interval = router.heartbeat_interval
+        self.heartbeat_timeout = router.heartbeat_timeout
+        # kept after the connection is closed, for its statistics
+        self.heartbeat = None
+        # called with no arguments, should the heartbeat find the
+        # connection dead
+        self.connection_lost_callback = None
+
+    def start_heartbeat(self):
+        if not self.heartbeat_interval:
+            return
+
+        self.heartbeat = Heartbeat(
+            self, self.heartbeat_interval, self.heartbeat_timeout,
+            on_timeout=self._heartbeat_timed_out,
+        )
+        self.heartbeat.start()
+
+    def stop_heartbeat(self):
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+
+    def pong_received(self, payload):
+        if self.heartbeat is not None:
+            self.heartbeat.pong(payload)
+
+    def _heartbeat_timed_out(self):
+        # don't leave a half-open socket behind, and wake up whatever is
+        # blocked reading from it. the Router isn't answering, so there's
+        # no point attempting a closing handshake.
+        self.abort()
+
+        if self.connection_lost_callback is not None:
+            self.connection_lost_callback()
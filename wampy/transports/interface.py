@@ -18,6 +18,11 @@ class Transport(object):
     def disconnect(self):
         pass
 
+    def abort(self):
+        """ Drop the connection at once, without any closing handshake.
+        """
+        self.disconnect()
+
     @abc.abstractmethod
     def send(self, message):
         pass
@@ -0,0 +1,379 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import socket
+from struct import Struct
+
+import eventlet
+
+from wampy.errors import ConnectionError, WampProtocolError, WampyError
+from wampy.mixins import ParseUrlMixin
+from wampy.transports.heartbeat import HeartbeatMixin
+from wampy.transports.interface import Transport
+from wampy.transports.sockets import (
+    CLOSE_TIMEOUT, DEFAULT_BUFFER_SIZE, SocketWriterMixin, connect,
+    recv_into,
+)
+
+logger = logging.getLogger(__name__)
+
+# https://wamp-proto.org/wamp_latest_ietf.html#name-rawsocket
+MAGIC = 0x7F
+
+# the transport level message types, from the first byte of a header
+MESSAGE_TYPE_REGULAR = 0
+MESSAGE_TYPE_PING = 1
+MESSAGE_TYPE_PONG = 2
+
+# what the client asks for, and what the Router answers with
+HANDSHAKE = Struct('!BBH')
+# the message type in the first byte, the length in the other three
+HEADER = Struct('!I')
+
+# RawSocket can't name a serializer, so has a number for each
+SERIALIZER_IDS = {
+    'wamp.2.json': 1,
+    'wamp.2.msgpack': 2,
+    'wamp.2.cbor': 3,
+}
+
+# the Router answers with one of these when it won't take the connection
+HANDSHAKE_ERRORS = {
+    0: "illegal (must not be used)",
+    1: "serializer unsupported",
+    2: "maximum message length unacceptable",
+    3: "use of reserved bits (unsupported feature)",
+    4: "maximum connection count reached",
+}
+SERIALIZER_UNSUPPORTED = 1
+
+# the maximum lengths that may be agreed are 2 ** 9 to 2 ** 24, though
+# the longest a 24 bit length can describe is a byte short of that
+MIN_LENGTH_EXPONENT = 9
+MAX_LENGTH_EXPONENT = 24
+MAX_LENGTH = 2 ** 24 - 1
+
+
+def length_exponent(max_length):
+    """ The 4 bit handshake field for the largest power of two that is
+    no greater than ``max_length``, within what RawSocket allows.
+    """
+    if max_length >= MAX_LENGTH:
+        # the largest field stands for 2 ** 24, which a 24 bit length
+        # can't quite reach, so means "as long as can be"
+        return MAX_LENGTH_EXPONENT - MIN_LENGTH_EXPONENT
+
+    exponent = max_length.bit_length() - 1
+    exponent = max(MIN_LENGTH_EXPONENT, min(exponent, MAX_LENGTH_EXPONENT))
+    return exponent - MIN_LENGTH_EXPONENT
+
+
+class RawSocketMessage(object):
+    """ A message received over a RawSocket, which has the same
+    ``payload`` and ``body`` as a WebSocket ``ServerFrame`` so that a
+    ``Session`` can't tell the two apart.
+    """
+
+    def __init__(self, message_type, body, serializer):
+        self.message_type = message_type
+        self.body = body
+
+        if message_type == MESSAGE_TYPE_REGULAR:
+            try:
+                self.payload = serializer.deserialize(body)
+            except Exception as exc:
+                raise WampProtocolError(
+                    "Failed to load {} message: {}".format(
+                        serializer.SUBPROTOCOL, exc)
+                )
+        else:
+            self.payload = body
+
+
+class RawSocket(
+    Transport, ParseUrlMixin, HeartbeatMixin, SocketWriterMixin,
+):
+    """ WAMP over RawSocket, i.e. straight over TCP.
+
+    Each message is prefixed by a 4 byte header - a message type and a
+    24 bit length - and no more, so there's no HTTP upgrade, nor
+    masking or frame parsing, which makes RawSocket the cheaper choice
+    where the WebSocket protocol isn't needed, e.g. between services in
+    the one datacenter.
+
+    Select it with an ``rs://`` or ``tcp://`` URL.
+
+    """
+
+    def register_router(self, router):
+        self.url = router.url
+
+        self.host = None
+        self.port = None
+        self.ipv = router.ipv
+        self.resource = None
+        self.socket_options = router.socket_options
+        self.register_heartbeat(router)
+        # RawSocket can't have a message longer than 16M
+        self.max_message_size = min(router.max_message_size, MAX_LENGTH)
+        # the serializers we'll try, in order, until the Router accepts one
+        self.serializers = [
+            serializer for serializer in router.serializers
+            if serializer.SUBPROTOCOL in SERIALIZER_IDS
+        ]
+        if not self.serializers:
+            raise WampyError(
+                "None of the serializers can be used over RawSocket: "
+                "choose from {}".format(', '.join(sorted(SERIALIZER_IDS)))
+            )
+        self.serializer = self.serializers[0]
+        # the longest message the Router will accept from us, once agreed
+        self.max_send_size = None
+
+        self.parse_url()
+        self.socket = None
+        # everything is written to the socket by the writer's green thread
+        self.write_linger = router.write_linger
+        self.flow_control = router.flow_control
+        self.writer = self._make_writer()
+
+        self._buffer = bytearray(DEFAULT_BUFFER_SIZE)
+        # the unconsumed bytes are ``self._buffer[self._start:self._end]``
+        self._start = 0
+        self._end = 0
+
+    def connect(self):
+        for serializer in self.serializers:
+            self.max_send_size = None
+            self._connect()
+
+            try:
+                with eventlet.Timeout(5):
+                    error = self._handshake(serializer)
+            except eventlet.Timeout:
+                self.disconnect()
+                raise WampyError("No response to the RawSocket handshake")
+            except Exception:
+                # don't leave the socket open
+                self.abort()
+                raise
+
+            if error is None:
+                self.serializer = serializer
+                self.start_heartbeat()
+                return self
+
+            self.disconnect()
+            if error != SERIALIZER_UNSUPPORTED:
+                break
+
+            # the Router will have closed the connection, so try again
+            # with our next preference, if we have one
+            logger.warning(
+                "Router does not support %s", serializer.SUBPROTOCOL)
+
+        raise WampProtocolError(
+            "Router refused the RawSocket connection: {}".format(
+                HANDSHAKE_ERRORS.get(error, error))
+        )
+
+    def disconnect(self):
+        self.stop_heartbeat()
+        if self.socket is None:
+            return
+
+        # RawSocket has no closing handshake, but what's been sent should
+        # at least get to the Router before the socket is closed
+        with eventlet.Timeout(CLOSE_TIMEOUT, False):
+            try:
+                self.writer.flush()
+            except ConnectionError:
+                pass
+
+        self._close_socket()
+
+    def abort(self):
+        self.stop_heartbeat()
+        if self.socket is not None:
+            self._close_socket()
+
+    def _close_socket(self):
+        self.writer.stop()
+
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+        self.socket.close()
+
+    def send(self, message):
+        serialized_message = self.serializer.serialize(message)
+        self.writer.put_message(
+            [self._frame(MESSAGE_TYPE_REGULAR, serialized_message)])
+
+    def ping(self, payload):
+        self._send_control(MESSAGE_TYPE_PING, payload)
+
+    def _send_control(self, message_type, body):
+        # pings and pongs may jump the queue
+        self.writer.put(self._frame(message_type, body), control=True)
+
+    def _frame(self, message_type, body):
+        if self.max_send_size is None:
+            # nothing may be sent until the handshake is done
+            raise ConnectionError("not connected to the Router")
+
+        if len(body) > self.max_send_size:
+            raise WampProtocolError(
+                "message of {} bytes is longer than the Router accepts: "
+                "{}".format(len(body), self.max_send_size)
+            )
+
+        return [HEADER.pack((message_type << 24) | len(body)), body]
+
+    def receive(self):
+        while True:
+            message = self._read_message()
+            if message is None:
+                raise WampProtocolError("No message returned")
+
+            if message.message_type == MESSAGE_TYPE_PING:
+                # it's only an "are you there?" so doesn't go to the Session,
+                # but must be answered with the same payload
+                self._send_control(MESSAGE_TYPE_PONG, message.body)
+                continue
+
+            if message.message_type == MESSAGE_TYPE_PONG:
+                self.pong_received(message.body)
+                continue
+
+            return message
+
+    def _connect(self):
+        # a writer that failed on the last socket is no use on this one
+        self.writer = self._make_writer()
+        self.socket = connect(
+            self.host, self.port, self.ipv,
+            unix_socket_path=self.unix_socket_path,
+            socket_options=self.socket_options,
+        )
+        self._start = self._end = 0
+
+    def _handshake(self, serializer):
+        """ Agree ``serializer`` and maximum message lengths with the
+        Router, returning ``None`` on success, else the Router's error
+        code.
+        """
+        self.socket.sendall(HANDSHAKE.pack(
+            MAGIC,
+            (length_exponent(self.max_message_size) << 4) |
+            SERIALIZER_IDS[serializer.SUBPROTOCOL],
+            0,
+        ))
+
+        response = self._read(HANDSHAKE.size)
+        if response is None:
+            raise WampProtocolError(
+                "Router closed the connection during the RawSocket handshake"
+            )
+
+        magic, second_byte, reserved = HANDSHAKE.unpack(response)
+        if magic != MAGIC:
+            raise WampProtocolError(
+                "not a RawSocket Router: {!r}".format(response)
+            )
+
+        serializer_id = second_byte & 0x0f
+        if serializer_id == 0:
+            error = second_byte >> 4
+            logger.error(
+                "RawSocket handshake refused: %s",
+                HANDSHAKE_ERRORS.get(error, error),
+            )
+            return error
+
+        if serializer_id != SERIALIZER_IDS[serializer.SUBPROTOCOL]:
+            raise WampProtocolError(
+                "Router answered with a serializer that was never asked "
+                "for: {}".format(serializer_id)
+            )
+
+        self.max_send_size = min(
+            2 ** ((second_byte >> 4) + MIN_LENGTH_EXPONENT), MAX_LENGTH)
+
+        logger.debug(
+            "RawSocket handshake complete: %s, %s byte messages",
+            serializer.SUBPROTOCOL, self.max_send_size,
+        )
+
+    def _read_message(self):
+        header = self._read(HEADER.size)
+        if header is None:
+            return None
+
+        header, = HEADER.unpack(header)
+        message_type = header >> 24
+        length = header & 0xffffff
+
+        if message_type > MESSAGE_TYPE_PONG:
+            raise WampProtocolError(
+                "unknown RawSocket message type: {}".format(message_type)
+            )
+
+        if length > self.max_message_size:
+            raise WampProtocolError(
+                "message of {} bytes is longer than the maximum agreed: "
+                "{}".format(length, self.max_message_size)
+            )
+
+        body = self._read(length)
+        if body is None:
+            return None
+
+        return RawSocketMessage(message_type, body, self.serializer)
+
+    def _read(self, length):
+        """ Return the next ``length`` bytes, or ``None`` if the Router
+        closed the connection first.
+        """
+        while self._end - self._start < length:
+            if not self._fill(length):
+                return None
+
+        start = self._start
+        self._start += length
+        if self._start == self._end:
+            # everything has been consumed, so re-use the buffer from the top
+            self._start = self._end = 0
+
+        data = memoryview(self._buffer)[start:start + length].tobytes()
+        if self._end == 0 and len(self._buffer) > DEFAULT_BUFFER_SIZE:
+            # don't hang on to the memory used by one unusually large message
+            self._buffer = bytearray(DEFAULT_BUFFER_SIZE)
+
+        return data
+
+    def _fill(self, length):
+        buffered = self._end - self._start
+
+        if len(self._buffer) - self._start < length:
+            if len(self._buffer) < length:
+                buffer = bytearray(length)
+            else:
+                buffer = self._buffer
+            buffer[:buffered] = self._buffer[self._start:self._end]
+            self._buffer = buffer
+            self._start = 0
+            self._end = buffered
+
+        view = memoryview(self._buffer)
+
+        received = recv_into(self.socket, view[self._end:])
+        if not received:
+            return False
+
+        self._end += received
+        return True
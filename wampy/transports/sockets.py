@@ -0,0 +1,450 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+""" Socket plumbing shared by every transport.
+"""
+import errno
+import logging
+import os
+import socket
+import ssl
+import time
+from collections import OrderedDict
+from socket import error as socket_error
+
+import eventlet
+from eventlet.hubs import trampoline
+
+from wampy.errors import ConnectionError, WampyError
+from wampy.transports.writer import Writer
+
+logger = logging.getLogger(__name__)
+
+# how many bytes we ask the kernel for on each read
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+# seconds to wait on what's still to be sent, or the Router's close
+# frame, before the socket is closed
+CLOSE_TIMEOUT = 2
+
+# the most buffers that may be passed to one ``sendmsg``
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+# what ``getaddrinfo`` is asked for, by IP version, where ``None`` is both
+ADDRESS_FAMILIES = {
+    4: socket.AF_INET,
+    6: socket.AF_INET6,
+    None: socket.AF_UNSPEC,
+}
+
+# seconds to remember what a host name resolved to
+RESOLVE_TTL = 30
+# seconds to give one address before racing the next, as RFC 8305
+# recommends
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+# (host, port, family) -> (expiry, addresses)
+_resolve_cache = {}
+
+now = getattr(time, 'monotonic', time.time)
+
+
+def sendmsg_all(sock, buffers):
+    """ Write all of ``buffers`` to ``sock`` with as few ``sendmsg``
+    calls as the kernel allows, and without joining them together first.
+
+    Raises ``AttributeError`` or ``NotImplementedError`` when the socket
+    can't ``sendmsg``, e.g. on Python 2, or over TLS.
+
+    """
+    buffers = [memoryview(buffer) for buffer in buffers if len(buffer)]
+
+    while buffers:
+        try:
+            sent = sock.sendmsg(buffers[:IOV_MAX])
+        except socket_error as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            # a green socket is non-blocking underneath, so give way
+            # until the kernel has room for more
+            trampoline(sock.fileno(), write=True)
+            continue
+
+        # drop whatever was written, which may be part way into a buffer
+        while sent:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+
+
+def recv_into(sock, buffer):
+    """ Read whatever has arrived on ``sock`` into ``buffer``, returning
+    the number of bytes read, which is 0 once the peer has closed the
+    connection.
+
+    Any failure to read is raised as a ``ConnectionError``.
+
+    """
+    try:
+        return sock.recv_into(buffer)
+    except eventlet.greenlet.GreenletExit as exc:
+        raise ConnectionError('Connection closed: "{}"'.format(exc))
+    except socket.timeout as exc:
+        raise ConnectionError('timeout: "{}"'.format(exc))
+    except Exception as exc:
+        raise ConnectionError(
+            'unexpected error reading from socket: "{}"'.format(exc)
+        )
+
+
+class SocketWriterMixin(object):
+    """ Writes everything a transport sends to its ``socket`` from a
+    ``Writer``'s green thread, configured by the transport's
+    ``write_linger`` and ``flow_control``.
+    """
+
+    _use_sendmsg = True
+
+    def _make_writer(self):
+        return Writer(
+            self._write, linger=self.write_linger,
+            flow_control=self.flow_control,
+        )
+
+    def _write(self, buffers):
+        # the buffers, e.g. headers and bodies, are written out together
+        # with a single ``sendmsg``, so no body is ever copied into a new
+        # buffer just to put a header in front of it.
+        if self._use_sendmsg:
+            try:
+                sendmsg_all(self.socket, buffers)
+                return
+            except (AttributeError, NotImplementedError):
+                # e.g. Python 2, or a TLS socket
+                logger.debug("sendmsg not supported by %s", self.socket)
+                self._use_sendmsg = False
+
+        self._send_raw(b''.join(buffers))
+
+    def _send_raw(self, data):
+        self.socket.sendall(data)
+
+
+class SocketOptions(object):
+    """ How the socket to a Router is configured, before it's connected.
+
+    Pass an instance to the ``Router`` (or ``Client``) to change them.
+
+    """
+
+    def __init__(
+        self, tcp_nodelay=True, keepalive=False, keepalive_idle=None,
+        keepalive_interval=None, keepalive_count=None,
+        send_buffer_size=None, receive_buffer_size=None,
+    ):
+        """ Configure the socket.
+
+        :Parameters:
+            tcp_nodelay : bool
+                Disable Nagle's algorithm, so that small messages, such
+                as most WAMP messages, go out at once rather than wait
+                on the ACK for the last. On by default.
+            keepalive : bool
+                Have the kernel probe an idle connection, so that a Router
+                which has silently gone away is noticed.
+            keepalive_idle : int
+                Optional. Seconds of idleness before the first probe.
+            keepalive_interval : int
+                Optional. Seconds between probes.
+            keepalive_count : int
+                Optional. Unanswered probes before the connection is
+                dropped.
+            send_buffer_size : int
+                Optional. The kernel send buffer size (SO_SNDBUF).
+            receive_buffer_size : int
+                Optional. The kernel receive buffer size (SO_RCVBUF).
+
+        The keepalive timings are only applied where the platform has
+        them. None of the TCP options apply to a Unix domain socket.
+
+        """
+        self.tcp_nodelay = tcp_nodelay
+        self.keepalive = keepalive
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self.send_buffer_size = send_buffer_size
+        self.receive_buffer_size = receive_buffer_size
+
+    def apply(self, sock):
+        # buffer sizes are best set before connecting, as the TCP window
+        # scale is agreed then
+        if self.send_buffer_size:
+            self._set(sock, socket.SOL_SOCKET, 'SO_SNDBUF',
+                      self.send_buffer_size)
+        if self.receive_buffer_size:
+            self._set(sock, socket.SOL_SOCKET, 'SO_RCVBUF',
+                      self.receive_buffer_size)
+
+        if sock.family not in (socket.AF_INET, socket.AF_INET6):
+            return
+
+        if self.tcp_nodelay:
+            self._set(sock, socket.IPPROTO_TCP, 'TCP_NODELAY', 1)
+
+        if self.keepalive:
+            self._set(sock, socket.SOL_SOCKET, 'SO_KEEPALIVE', 1)
+
+            # macOS calls the idle time TCP_KEEPALIVE
+            idle_option = (
+                'TCP_KEEPIDLE' if hasattr(socket, 'TCP_KEEPIDLE')
+                else 'TCP_KEEPALIVE'
+            )
+            for name, value in (
+                (idle_option, self.keepalive_idle),
+                ('TCP_KEEPINTVL', self.keepalive_interval),
+                ('TCP_KEEPCNT', self.keepalive_count),
+            ):
+                if value is not None:
+                    self._set(sock, socket.IPPROTO_TCP, name, value)
+
+    @staticmethod
+    def _set(sock, level, name, value):
+        option = getattr(socket, name, None)
+        if option is None:
+            logger.warning("%s is not supported on this platform", name)
+            return
+
+        try:
+            sock.setsockopt(level, option, value)
+        except socket_error as exc:
+            logger.warning("failed to set %s to %s: %s", name, value, exc)
+
+
+def resolve(host, port, ipv=None):
+    """ Return the addresses ``host`` resolves to, as ``(family,
+    sockaddr)`` pairs, in the order they should be tried.
+
+    ``ipv`` may be 4 or 6 for only those addresses, or ``None`` for
+    either, in which case the two are interleaved, whichever the system
+    prefers first, as RFC 8305 has it.
+
+    Answers are cached for ``RESOLVE_TTL`` seconds.
+
+    """
+    try:
+        family = ADDRESS_FAMILIES[ipv]
+    except KeyError:
+        raise WampyError(
+            "unknown IPV: {}".format(ipv)
+        )
+
+    key = (host, port, family)
+    cached = _resolve_cache.get(key)
+    if cached is not None and cached[0] > now():
+        return cached[1]
+
+    try:
+        infos = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+    except socket.gaierror as exc:
+        logger.error('unable to resolve %s: %s', host, exc)
+        raise
+
+    addresses = []
+    for info in infos:
+        address = (info[0], info[4])
+        if address not in addresses:
+            addresses.append(address)
+
+    addresses = interleave(addresses)
+
+    # forget whatever has expired, so the cache can't grow without bound
+    for stale in [k for k, v in _resolve_cache.items() if v[0] <= now()]:
+        del _resolve_cache[stale]
+    _resolve_cache[key] = (now() + RESOLVE_TTL, addresses)
+
+    return addresses
+
+
+def interleave(addresses):
+    """ Alternate between the address families of ``addresses``,
+    starting with that of the first, but otherwise keeping their order.
+    """
+    by_family = OrderedDict()
+    for address in addresses:
+        by_family.setdefault(address[0], []).append(address)
+
+    interleaved = []
+    queues = list(by_family.values())
+    while queues:
+        for queue in queues:
+            interleaved.append(queue.pop(0))
+        queues = [queue for queue in queues if queue]
+
+    return interleaved
+
+
+def connect(
+    host, port, ipv=None, unix_socket_path=None, socket_options=None,
+):
+    """ Return a socket connected to ``host`` and ``port`` over IP
+    version ``ipv`` - 4, 6, or ``None`` for whichever connects first -
+    or else to ``unix_socket_path``, when given, for a Router on the
+    same host.
+
+    Should ``host`` have more than one address, connections to them are
+    raced: the next is started as soon as the last fails, or after
+    ``CONNECTION_ATTEMPT_DELAY`` seconds, and the first to connect wins.
+    So a slow or broken IPv6 route costs no more than that delay.
+
+    ``socket_options`` - a ``SocketOptions`` - are applied before the
+    socket is connected.
+
+    """
+    socket_options = socket_options or SocketOptions()
+
+    if unix_socket_path:
+        return connect_unix(unix_socket_path, socket_options)
+
+    addresses = resolve(host, port, ipv)
+
+    try:
+        if len(addresses) == 1:
+            _socket = connect_address(addresses[0], socket_options)
+        else:
+            _socket = race(addresses, socket_options)
+    except socket_error:
+        logger.error(
+            'unable to connect to %s:%s (IPV%s)', host, port, ipv or '4/6'
+        )
+        raise
+
+    logger.debug("socket connected to %s", _socket.getpeername())
+    return _socket
+
+
+def connect_address(address, socket_options):
+    family, sockaddr = address
+    _socket = socket.socket(family, socket.SOCK_STREAM)
+    socket_options.apply(_socket)
+
+    try:
+        _socket.connect(sockaddr)
+    except BaseException:
+        # including when the race is won by another address
+        _socket.close()
+        raise
+
+    return _socket
+
+
+def race(addresses, socket_options):
+    """ Return a socket connected to whichever of ``addresses`` is the
+    first to accept a connection, "Happy Eyeballs" style.
+    """
+    results = eventlet.Queue()
+    remaining = list(addresses)
+    attempts = []
+    pending = 0
+    error = None
+
+    def attempt(address):
+        try:
+            results.put((connect_address(address, socket_options), None))
+        except socket_error as exc:
+            logger.debug("failed to connect to %s: %s", address[1], exc)
+            results.put((None, exc))
+
+    try:
+        while remaining or pending:
+            if remaining:
+                attempts.append(eventlet.spawn(attempt, remaining.pop(0)))
+                pending += 1
+
+            try:
+                # only wait to start the next attempt, if there is one
+                timeout = CONNECTION_ATTEMPT_DELAY if remaining else None
+                _socket, exc = results.get(timeout=timeout)
+            except eventlet.queue.Empty:
+                continue
+
+            pending -= 1
+            if _socket is not None:
+                return _socket
+
+            # so start the next attempt at once
+            error = exc
+    finally:
+        for thread in attempts:
+            thread.kill()
+        # any that connected too late
+        while not results.empty():
+            _socket, _ = results.get()
+            if _socket is not None:
+                _socket.close()
+
+    raise error
+
+
+def connect_unix(path, socket_options=None):
+    """ Return a socket connected to the Unix domain socket at ``path``,
+    which skips the TCP/IP stack altogether.
+    """
+    try:
+        family = socket.AF_UNIX
+    except AttributeError:
+        raise WampyError(
+            "Unix domain sockets are not supported on this platform"
+        )
+
+    _socket = socket.socket(family, socket.SOCK_STREAM)
+    if socket_options is not None:
+        socket_options.apply(_socket)
+
+    try:
+        _socket.connect(path)
+    except socket_error:
+        logger.error('unable to connect to %s', path)
+        _socket.close()
+        raise
+
+    logger.debug("socket connected to %s", path)
+    return _socket
+
+
+def create_ssl_context(cafile=None):
+    """ Return an ``ssl.SSLContext`` for connecting to a Router over TLS.
+
+    The Router's certificate must verify against ``cafile``, if given,
+    or else the system's CA certificates, and match its hostname. TLS
+    1.2 is the least that's accepted.
+
+    A context is expensive to make, so make one and re-use it, as the
+    ``Router`` does, which also lets TLS sessions be resumed.
+
+    """
+    protocol = getattr(ssl, 'PROTOCOL_TLS_CLIENT', ssl.PROTOCOL_SSLv23)
+    context = ssl.SSLContext(protocol)
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.check_hostname = True
+
+    if hasattr(ssl, 'TLSVersion'):
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+    else:
+        context.options |= (
+            ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3 | ssl.OP_NO_TLSv1 |
+            ssl.OP_NO_TLSv1_1
+        )
+
+    if cafile:
+        context.load_verify_locations(cafile)
+    else:
+        context.load_default_certs()
+
+    return context
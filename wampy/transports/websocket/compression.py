@@ -0,0 +1,220 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import zlib
+
+from wampy.errors import MessageTooBigError, WebsocktProtocolError
+
+logger = logging.getLogger('wampy.networking.compression')
+
+# the empty, uncompressed deflate block that ends every compressed
+# message. it's stripped before sending and added back on receipt.
+_TAIL = b'\x00\x00\xff\xff'
+
+MIN_WINDOW_BITS = 8
+MAX_WINDOW_BITS = 15
+# zlib won't compress with an 8 bit window, so neither will we
+MIN_CLIENT_WINDOW_BITS = 9
+
+
+class PerMessageDeflate(object):
+    """ The "permessage-deflate" WebSocket extension, RFC 7692.
+
+    Pass an instance to the ``Router`` to have it offered to the Router
+    when the connection is upgraded. If the Router accepts, data
+    messages of at least ``threshold`` bytes are compressed before they
+    are framed, flagged by the RSV1 bit of the first frame, and messages
+    from the Router are decompressed likewise.
+
+    """
+    EXTENSION_NAME = 'permessage-deflate'
+
+    def __init__(
+        self, client_no_context_takeover=False,
+        server_no_context_takeover=False, client_max_window_bits=None,
+        server_max_window_bits=None, threshold=256,
+        compression_level=zlib.Z_DEFAULT_COMPRESSION,
+    ):
+        """ Configure permessage-deflate.
+
+        :Parameters:
+            client_no_context_takeover : bool
+                Start every outgoing message with a fresh compression
+                context. Costs compression ratio, saves memory.
+            server_no_context_takeover : bool
+                Ask the Router to do the same for the messages it sends.
+            client_max_window_bits : int
+                Optional. The LZ77 window size (9 to 15) to compress with.
+            server_max_window_bits : int
+                Optional. Ask the Router to compress with this window size.
+            threshold : int
+                Messages shorter than this many bytes are sent uncompressed.
+            compression_level : int
+                The zlib compression level, 0 to 9.
+
+        """
+        for window_bits, min_window_bits in (
+            (client_max_window_bits, MIN_CLIENT_WINDOW_BITS),
+            (server_max_window_bits, MIN_WINDOW_BITS),
+        ):
+            if window_bits is not None and not (
+                min_window_bits <= window_bits <= MAX_WINDOW_BITS
+            ):
+                raise ValueError(
+                    "window bits must be between {} and {}: {}".format(
+                        min_window_bits, MAX_WINDOW_BITS, window_bits)
+                )
+
+        self.client_no_context_takeover = client_no_context_takeover
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_max_window_bits = client_max_window_bits
+        self.server_max_window_bits = server_max_window_bits
+        self.threshold = threshold
+        self.compression_level = compression_level
+
+        self._compressor = None
+        self._decompressor = None
+
+    def offer(self):
+        """ The value of the ``Sec-WebSocket-Extensions`` upgrade header.
+        """
+        params = [self.EXTENSION_NAME]
+
+        if self.client_no_context_takeover:
+            params.append('client_no_context_takeover')
+        if self.server_no_context_takeover:
+            params.append('server_no_context_takeover')
+
+        if self.client_max_window_bits is None:
+            # tell the Router we'd honour a window size, should it want one
+            params.append('client_max_window_bits')
+        else:
+            params.append(
+                'client_max_window_bits={}'.format(
+                    self.client_max_window_bits)
+            )
+
+        if self.server_max_window_bits is not None:
+            params.append(
+                'server_max_window_bits={}'.format(
+                    self.server_max_window_bits)
+            )
+
+        return '; '.join(params)
+
+    def accept(self, response):
+        """ Return a new ``PerMessageDeflate`` configured as agreed by the
+        Router's ``Sec-WebSocket-Extensions`` response header, which must
+        not contain anything we didn't offer.
+        """
+        extensions = [
+            extension.strip() for extension in response.split(',')
+            if extension.strip()
+        ]
+        if len(extensions) != 1:
+            raise WebsocktProtocolError(
+                "unexpected WebSocket extensions: {}".format(response)
+            )
+
+        params = [param.strip() for param in extensions[0].split(';')]
+        if params[0].lower() != self.EXTENSION_NAME:
+            raise WebsocktProtocolError(
+                "unsupported WebSocket extension: {}".format(params[0])
+            )
+
+        agreed = {
+            'client_no_context_takeover': self.client_no_context_takeover,
+            'server_no_context_takeover': False,
+            'client_max_window_bits': self.client_max_window_bits,
+            'server_max_window_bits': None,
+            'threshold': self.threshold,
+            'compression_level': self.compression_level,
+        }
+
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            name = name.strip().lower()
+            value = value.strip().strip('"')
+
+            if name in (
+                'client_no_context_takeover', 'server_no_context_takeover',
+            ):
+                if value:
+                    raise WebsocktProtocolError(
+                        "{} takes no value: {}".format(name, param)
+                    )
+                agreed[name] = True
+
+            elif name in ('client_max_window_bits', 'server_max_window_bits'):
+                try:
+                    window_bits = int(value)
+                except ValueError:
+                    raise WebsocktProtocolError(
+                        "invalid {}: {}".format(name, param)
+                    )
+                if not MIN_WINDOW_BITS <= window_bits <= MAX_WINDOW_BITS:
+                    raise WebsocktProtocolError(
+                        "invalid {}: {}".format(name, param)
+                    )
+                if (
+                    name == 'client_max_window_bits' and
+                    window_bits < MIN_CLIENT_WINDOW_BITS
+                ):
+                    # compressing with a larger window would break the
+                    # agreement, and the Router may not inflate it
+                    raise WebsocktProtocolError(
+                        "unable to compress with a window of {} bits".format(
+                            window_bits)
+                    )
+                offered = getattr(self, name)
+                if offered is not None and window_bits > offered:
+                    # the Router may only agree to a window as small as
+                    # we asked for, or smaller (RFC 7692, 7.1.2)
+                    raise WebsocktProtocolError(
+                        "{} larger than offered: {}".format(name, param)
+                    )
+                agreed[name] = window_bits
+
+            else:
+                raise WebsocktProtocolError(
+                    "unknown permessage-deflate parameter: {}".format(param)
+                )
+
+        logger.debug("permessage-deflate agreed: %s", agreed)
+
+        return PerMessageDeflate(**agreed)
+
+    def compress(self, data):
+        if self._compressor is None or self.client_no_context_takeover:
+            window_bits = self.client_max_window_bits or MAX_WINDOW_BITS
+            self._compressor = zlib.compressobj(
+                self.compression_level, zlib.DEFLATED, -window_bits,
+            )
+
+        compressed = (
+            self._compressor.compress(data) +
+            self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        )
+        if compressed.endswith(_TAIL):
+            compressed = compressed[:-len(_TAIL)]
+
+        return compressed
+
+    def decompress(self, data, max_length=0):
+        """ Decompress a message, raising ``MessageTooBigError`` if it
+        would inflate to more than ``max_length`` bytes (unless that's 0).
+        """
+        if self._decompressor is None or self.server_no_context_takeover:
+            # a window at least as large as the Router's can always be used
+            self._decompressor = zlib.decompressobj(-MAX_WINDOW_BITS)
+
+        payload = self._decompressor.decompress(data + _TAIL, max_length)
+        if self._decompressor.unconsumed_tail:
+            raise MessageTooBigError(
+                "compressed message inflates beyond {} bytes".format(
+                    max_length)
+            )
+
+        return payload
@@ -6,24 +6,49 @@ import logging
 import socket
 import ssl
 import uuid
-from base64 import encodestring
+from base64 import b64encode
+from hashlib import sha1
 from socket import error as socket_error
 
 import eventlet
+from eventlet.event import Event
+from eventlet.semaphore import Semaphore
 
-from wampy.constants import WEBSOCKET_SUBPROTOCOLS, WEBSOCKET_VERSION
+from wampy.constants import (
+    WEBSOCKET_GUID, WEBSOCKET_SUCCESS_STATUS, WEBSOCKET_VERSION,
+)
 from wampy.errors import (
-    IncompleteFrameError, ConnectionError, WampProtocolError, WampyError)
+    ConnectionClosedError, ConnectionError, MessageTooBigError,
+    WampProtocolError, WampyError, WebsocktProtocolError,
+)
 from wampy.mixins import ParseUrlMixin
+from wampy.transports.heartbeat import HeartbeatMixin
 from wampy.transports.interface import Transport
-from wampy.serializers import json_serialize
+from wampy.transports.sockets import (
+    CLOSE_TIMEOUT, SocketWriterMixin, connect,
+)
 
-from . frames import ClientFrame, ServerFrame, PongFrame
+from . frames import (
+    CLOSE_MESSAGE_TOO_BIG, CLOSE_NO_STATUS, CLOSE_NORMAL,
+    CLOSE_PROTOCOL_ERROR, ClientFrame, CloseFrame, Frame, PingFrame,
+    PongFrame,
+)
+from . reader import FrameReader
 
 logger = logging.getLogger(__name__)
 
+# the upgrade response is read in chunks of this size, and may be no
+# longer than the maximum
+HANDSHAKE_BUFFER_SIZE = 4096
+MAX_HANDSHAKE_RESPONSE_SIZE = 64 * 1024
 
-class WebSocket(Transport, ParseUrlMixin):
+# header values are lowercased for comparison, bar these
+CASE_SENSITIVE_HEADERS = ('sec-websocket-accept',)
+
+
+class WebSocket(
+    Transport, ParseUrlMixin, HeartbeatMixin, SocketWriterMixin,
+):
 
     def register_router(self, router):
         self.url = router.url
@@ -32,118 +57,295 @@ class WebSocket(Transport, ParseUrlMixin):
         self.port = None
         self.ipv = router.ipv
         self.resource = None
+        self.socket_options = router.socket_options
+        self.register_heartbeat(router)
+        self.max_message_size = router.max_message_size
+        self.max_frame_size = router.max_frame_size
+        self.fragment_size = router.fragment_size
+        # the extension we'll offer, and what's agreed, if anything
+        self.compression_offer = router.compression
+        self.compression = None
+        # the serializers we offer the Router as subprotocols, and the one
+        # it chooses - until it has, our first preference
+        self.serializers = router.serializers
+        self.serializer = self.serializers[0]
 
         self.parse_url()
         self.websocket_location = self.resource
-        self.key = encodestring(uuid.uuid4().bytes).decode('utf-8').strip()
+        # the Sec-WebSocket-Key of the latest opening handshake
+        self.key = None
         self.socket = None
+        # any frames read along with the handshake response
+        self._handshake_remainder = b''
+        self.reader = None
+
+        # everything is written to the socket by the writer's green thread
+        self.write_linger = router.write_linger
+        self.flow_control = router.flow_control
+        self.writer = self._make_writer()
+        # the frames of one data message must all be queued before those
+        # of the next, though control frames (e.g. a pong) may be queued
+        # in between.
+        self._message_lock = Semaphore()
+
+        self._reset_close_state()
 
     def connect(self):
+        self._reset_close_state()
+        self.writer = self._make_writer()
         self._connect()
         self._upgrade()
+        self.reader = FrameReader(
+            self.socket, max_message_size=self.max_message_size,
+            max_frame_size=self.max_frame_size,
+            compression=self.compression, serializer=self.serializer,
+            initial_bytes=self._handshake_remainder,
+        )
+        self.start_heartbeat()
         return self
 
-    def disconnect(self):
-        try:
-            self.socket.shutdown(socket.SHUT_RDWR)
-        except socket.error:
-            pass
+    def disconnect(self, code=CLOSE_NORMAL, reason=u''):
+        """ Close the connection cleanly, with the closing handshake.
 
-        self.socket.close()
+        A close frame with ``code`` and ``reason`` is sent, and the
+        Router's close frame waited on - for up to ``CLOSE_TIMEOUT``
+        seconds - before the socket is closed.
 
-    def send(self, message):
-        serialized_message = json_serialize(message)
-        frame = ClientFrame(serialized_message)
-        websocket_message = frame.payload
-        self._send_raw(websocket_message)
+        """
+        self.stop_heartbeat()
+        if self.socket is None:
+            return
 
-    def _send_raw(self, websocket_message):
-        self.socket.sendall(websocket_message)
+        if self.reader is not None and not self._close_sent:
+            with eventlet.Timeout(CLOSE_TIMEOUT, False):
+                self._send_close(code, reason)
+                self._wait_for_close()
 
-    def receive(self, bufsize=1):
-        frame = None
-        received_bytes = bytearray()
+        self._close_socket()
 
-        while True:
-            logger.debug("waiting for %s bytes", bufsize)
+    def abort(self):
+        """ Close the socket at once, without the closing handshake, e.g.
+        when the Router is no longer answering.
+        """
+        self.stop_heartbeat()
+        self.writer.stop()
+        if self.socket is not None:
+            self._close_socket()
 
-            try:
-                bytes = self.socket.recv(bufsize)
-            except eventlet.greenlet.GreenletExit as exc:
-                raise ConnectionError('Connection closed: "{}"'.format(exc))
-            except socket.timeout as e:
-                message = str(e)
-                raise ConnectionError('timeout: "{}"'.format(message))
-            except Exception as exc:
-                raise ConnectionError(
-                    'unexpected error reading from socket: "{}"'.format(exc)
-                )
+    def send(self, message):
+        if self._close_sent:
+            raise ConnectionError("the connection is closing")
 
-            if not bytes:
-                break
+        serialized_message = self.serializer.serialize(message)
+        if self.serializer.BINARY:
+            opcode = Frame.OPCODE_BINARY
+        else:
+            opcode = Frame.OPCODE_TEXT
+
+        with self._message_lock:
+            # compression contexts carry over from one message to the next,
+            # so messages must go out in the order they're compressed in
+            compressed = (
+                self.compression is not None and
+                len(serialized_message) >= self.compression.threshold
+            )
+            if compressed:
+                serialized_message = self.compression.compress(
+                    serialized_message)
+
+            if (
+                self.fragment_size and
+                len(serialized_message) > self.fragment_size
+            ):
+                frames = self._fragment(serialized_message, opcode, compressed)
+            else:
+                frames = [ClientFrame(
+                    serialized_message, opcode=opcode, rsv1=compressed)]
+
+            # a compressed message can't be dropped to make room, as those
+            # after it were compressed with it as context
+            self.writer.put_message(
+                [[frame.header, frame.masked_body] for frame in frames],
+                droppable=not compressed,
+            )
 
-            logger.debug("received %s bytes", bufsize)
-            received_bytes.extend(bytes)
+    def ping(self, payload):
+        self._send_frame(PingFrame(payload))
+
+    def _fragment(self, serialized_message, opcode, compressed=False):
+        # the writer never takes more than ``MAX_BATCH_SIZE`` bytes of
+        # these at a time, so control frames can go out in between
+        message = memoryview(serialized_message)
+        # only the first frame of a message says it's compressed
+        rsv1 = compressed
+        frames = []
+
+        for start in range(0, len(message), self.fragment_size):
+            end = start + self.fragment_size
+            frames.append(ClientFrame(
+                message[start:end], opcode=opcode, fin=end >= len(message),
+                rsv1=rsv1,
+            ))
+            opcode = Frame.OPCODE_CONT
+            rsv1 = False
+
+        return frames
+
+    def _send_frame(self, frame):
+        # pings and pongs may jump the queue, but a close frame must
+        # follow everything sent before it
+        control = frame.opcode in (Frame.OPCODE_PING, Frame.OPCODE_PONG)
+        self.writer.put([frame.header, frame.masked_body], control=control)
+
+    def receive(self):
+        self._receiving = True
 
-            try:
-                frame = ServerFrame(received_bytes)
-            except IncompleteFrameError as exc:
-                bufsize = exc.required_bytes
-                logger.debug('now requesting the missing %s bytes', bufsize)
-            else:
-                if frame.opcode == 9:
-                    # Opcode 0x9 marks a ping frame. It does not contain wamp
-                    # data, so the frame is not returned.
+        try:
+            while True:
+                try:
+                    frame = self.reader.read_message()
+                except MessageTooBigError as exc:
+                    self._fail(CLOSE_MESSAGE_TOO_BIG, str(exc))
+                    raise
+                except WebsocktProtocolError as exc:
+                    # there's no recovering from this, so say why we're done
+                    self._fail(CLOSE_PROTOCOL_ERROR, str(exc))
+                    raise
+
+                if frame is None:
+                    break
+
+                if frame.opcode == Frame.OPCODE_PING:
+                    # A ping frame does not contain wamp data, so the frame
+                    # is not returned.
                     # Still it must be handled or the server will close the
                     # connection.
-                    self._send_raw(PongFrame(frame.payload).payload)
-                    received_bytes = bytearray()
+                    self._send_frame(PongFrame(frame.payload))
                     continue
+
+                if frame.opcode == Frame.OPCODE_PONG:
+                    self.pong_received(frame.payload)
+                    continue
+
+                if frame.opcode == Frame.OPCODE_CLOSE:
+                    self._close_received(frame)
+                    raise ConnectionClosedError(
+                        self.close_code, self.close_reason)
+
                 break
+        finally:
+            self._receiving = False
 
         if frame is None:
             raise WampProtocolError("No frame returned")
 
         return frame
 
-    def _connect(self):
-        if self.ipv == 4:
-            _socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def _reset_close_state(self):
+        # the status code and reason the Router gave for closing, if it did
+        self.close_code = None
+        self.close_reason = None
+
+        self._close_sent = False
+        # sent once the Router's close frame has been received
+        self._closed = Event()
+        # whether a green thread is in ``receive``, i.e. reading frames
+        self._receiving = False
 
+    def _send_close(self, code, reason=u''):
+        self._close_sent = True
+
+        try:
+            self._send_frame(CloseFrame(code, reason))
+        except (socket_error, ConnectionError) as exc:
+            logger.warning("failed to send close frame: %s", exc)
+
+    def _wait_for_close(self):
+        if self._receiving:
+            # leave the reading to ``receive``, which will let us know
+            self._closed.wait()
+            return
+
+        # nobody else is reading, so read and discard whatever the Router
+        # sent before it saw our close frame, until we get its own
+        while not self._closed.ready():
             try:
-                _socket.connect((self.host.encode(), self.port))
-            except socket_error as exc:
-                if exc.errno == 61:
-                    logger.error(
-                        'unable to connect to %s:%s (IPV%s)',
-                        self.host, self.port, self.ipv
-                    )
+                frame = self.reader.read_message()
+            except (ConnectionError, WebsocktProtocolError):
+                return
 
-                raise
+            if frame is None:
+                return
 
-        elif self.ipv == 6:
-            _socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+            if frame.opcode == Frame.OPCODE_CLOSE:
+                self._close_received(frame)
+
+    def _close_received(self, frame):
+        try:
+            self.close_code = frame.close_code
+            self.close_reason = frame.close_reason
+        except WebsocktProtocolError as exc:
+            self._fail(CLOSE_PROTOCOL_ERROR, str(exc))
+            raise
 
+        logger.info(
+            "Router closed the connection: %s %s",
+            self.close_code, self.close_reason,
+        )
+
+        if not self._close_sent:
+            # echo the status code back, which completes the handshake
+            if self.close_code == CLOSE_NO_STATUS:
+                self._send_close(None)
+            else:
+                self._send_close(self.close_code)
+            self._flush()
+
+        self._closed.send(True)
+        # nothing more will come, so don't leave the socket half open
+        self._close_socket()
+
+    def _fail(self, code, reason=u''):
+        """ Fail the connection, as RFC 6455 puts it, letting the Router
+        know why if we can.
+        """
+        logger.error("failing the connection: %s %s", code, reason)
+
+        if not self._close_sent:
+            self._send_close(code, reason)
+            self._flush()
+
+        self.abort()
+
+    def _flush(self):
+        # give the writer a chance to finish up before the socket closes
+        with eventlet.Timeout(CLOSE_TIMEOUT, False):
             try:
-                _socket.connect(("::", self.port))
-            except socket_error as exc:
-                if exc.errno == 61:
-                    logger.error(
-                        'unable to connect to %s:%s (IPV%s)',
-                        self.host, self.port, self.ipv
-                    )
+                self.writer.flush()
+            except ConnectionError:
+                pass
 
-                raise
+    def _close_socket(self):
+        self.writer.stop()
 
-        else:
-            raise WampyError(
-                "unknown IPV: {}".format(self.ipv)
-            )
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
 
-        self.socket = _socket
-        logger.debug("socket connected")
+        self.socket.close()
+
+    def _connect(self):
+        self.socket = connect(
+            self.host, self.port, self.ipv,
+            unix_socket_path=self.unix_socket_path,
+            socket_options=self.socket_options,
+        )
 
     def _upgrade(self):
+        # a fresh nonce for every opening handshake (RFC 6455, 4.1), so
+        # none is ever reused on reconnecting
+        self.key = b64encode(uuid.uuid4().bytes).decode('utf-8')
         handshake_headers = self._get_handshake_headers()
         handshake = '\r\n'.join(handshake_headers) + "\r\n\r\n"
 
@@ -157,8 +359,53 @@ class WebSocket(Transport, ParseUrlMixin):
                 'No response after handshake "{}"'.format(handshake)
             )
 
+        self._validate_handshake(self.status, self.headers)
+
+        self.serializer = self._negotiate_subprotocol(self.headers)
+        self.compression = self._negotiate_extensions(self.headers)
+
         logger.debug("connection upgraded")
 
+    def _negotiate_subprotocol(self, headers):
+        subprotocol = headers.get('sec-websocket-protocol')
+        if not subprotocol:
+            if len(self.serializers) == 1:
+                # nothing to choose between, so assume the Router agrees
+                return self.serializers[0]
+
+            raise WebsocktProtocolError(
+                'Router did not select one of the subprotocols offered: '
+                '"{}"'.format(self._subprotocols)
+            )
+
+        for serializer in self.serializers:
+            if serializer.SUBPROTOCOL == subprotocol:
+                logger.debug("using subprotocol %s", subprotocol)
+                return serializer
+
+        raise WebsocktProtocolError(
+            'Router selected a subprotocol that was never offered: '
+            '"{}"'.format(subprotocol)
+        )
+
+    @property
+    def _subprotocols(self):
+        return ', '.join(
+            serializer.SUBPROTOCOL for serializer in self.serializers)
+
+    def _negotiate_extensions(self, headers):
+        extensions = headers.get('sec-websocket-extensions')
+        if not extensions:
+            return None
+
+        if self.compression_offer is None:
+            raise WebsocktProtocolError(
+                'Router accepted extensions that were never offered: "{}"'
+                .format(extensions)
+            )
+
+        return self.compression_offer.accept(extensions)
+
     def _get_handshake_headers(self):
         """ Do an HTTP upgrade handshake with the server.
 
@@ -167,13 +414,14 @@ class WebSocket(Transport, ParseUrlMixin):
         a browser. Maybe a reasonable assumption once upon a time...
 
         The headers here will go a little further and also agree the
-        WAMP websocket JSON subprotocols.
+        WAMP websocket subprotocol, i.e. the serializer, which the Router
+        chooses from those we offer.
 
         """
         headers = []
         # https://tools.ietf.org/html/rfc6455
         headers.append("GET /{} HTTP/1.1".format(self.websocket_location))
-        headers.append("Host: {}:{}".format(self.host, self.port))
+        headers.append("Host: {}".format(self._authority))
         headers.append("Upgrade: websocket")
         headers.append("Connection: Upgrade")
         # Sec-WebSocket-Key header containing base64-encoded random bytes,
@@ -182,103 +430,169 @@ class WebSocket(Transport, ParseUrlMixin):
         # proxy from re-sending a previous WebSocket conversation and does not
         # provide any authentication, privacy or integrity
         headers.append("Sec-WebSocket-Key: {}".format(self.key))
-        headers.append("Origin: ws://{}:{}".format(self.host, self.port))
+        headers.append("Origin: ws://{}".format(self._authority))
         headers.append("Sec-WebSocket-Version: {}".format(WEBSOCKET_VERSION))
+        # offered in order of preference, for the Router to choose one
         headers.append("Sec-WebSocket-Protocol: {}".format(
-            WEBSOCKET_SUBPROTOCOLS))
+            self._subprotocols))
+        if self.compression_offer is not None:
+            headers.append("Sec-WebSocket-Extensions: {}".format(
+                self.compression_offer.offer()))
 
         logger.debug("connection headers: %s", headers)
 
         return headers
 
+    @property
+    def _authority(self):
+        host = self.host
+        if ':' in host:
+            # an IPv6 literal
+            host = "[{}]".format(host)
+
+        # there's no port when the Router is behind a Unix domain socket
+        if self.port is None:
+            return host
+        return "{}:{}".format(host, self.port)
+
     def _read_handshake_response(self):
-        # each header ends with \r\n and there's an extra \r\n after the last
-        # one
-        status = None
-        headers = {}
-
-        def read_line():
-            bytes_cache = []
-            received_bytes = None
-            while received_bytes != b'\r\n':
-                received_bytes = self.socket.recv(2)
-                bytes_cache.append(received_bytes)
-            return b''.join(bytes_cache)
+        """ Read and parse the Router's response to the upgrade request.
 
-        while True:
-            # we need this to guarantee we can context switch back to the
-            # Timeout.
-            eventlet.sleep()
+        The response is read in as few ``recv`` calls as it arrives in,
+        so frames the Router sends straight after it may be read too.
+        Those are kept as ``self._handshake_remainder`` for the
+        ``FrameReader``.
+
+        """
+        response = bytearray()
+        searched = 0
 
-            received_bytes = read_line()
-            if received_bytes == b'\r\n':
-                # end of the response
+        while True:
+            end = response.find(b'\r\n\r\n', searched)
+            if end != -1:
                 break
 
-            bytes_as_str = received_bytes.decode()
-            line = bytes_as_str.strip()
+            if len(response) > MAX_HANDSHAKE_RESPONSE_SIZE:
+                raise WebsocktProtocolError(
+                    "handshake response longer than {} bytes".format(
+                        MAX_HANDSHAKE_RESPONSE_SIZE)
+                )
 
-            if not status:
-                status_info = line.split(" ", 2)
-                try:
-                    status = int(status_info[1])
-                except IndexError:
-                    logger.warning('unexpected handshake resposne')
-                    logger.error('%s', status_info)
-                    raise
+            # the terminator may straddle what we have and what's to come
+            searched = max(len(response) - 3, 0)
+            received_bytes = self.socket.recv(HANDSHAKE_BUFFER_SIZE)
+            if not received_bytes:
+                raise WebsocktProtocolError(
+                    "Router closed the connection during the handshake"
+                )
+            response += received_bytes
+
+        self._handshake_remainder = bytes(response[end + 4:])
 
-                headers['status_info'] = status_info
-                headers['status'] = status
-                continue
+        # each header ends with \r\n and there's an extra \r\n after the
+        # last one
+        lines = bytes(response[:end]).decode('utf-8').split('\r\n')
+
+        status_info = lines[0].split(" ", 2)
+        try:
+            status = int(status_info[1])
+        except (IndexError, ValueError):
+            logger.warning('unexpected handshake resposne')
+            logger.error('%s', status_info)
+            raise WebsocktProtocolError(
+                'Invalid status line: "{}"'.format(lines[0])
+            )
 
+        headers = {
+            'status_info': status_info,
+            'status': status,
+        }
+
+        for line in lines[1:]:
             kv = line.split(":", 1)
             if len(kv) != 2:
-                raise Exception(
+                raise WebsocktProtocolError(
                     'Invalid header: "{}"'.format(line)
                 )
 
             key, value = kv
-            headers[key.lower()] = value.strip().lower()
+            key = key.strip().lower()
+            value = value.strip()
+            if key not in CASE_SENSITIVE_HEADERS:
+                value = value.lower()
+            headers[key] = value
 
         logger.info("handshake complete: %s : %s", status, headers)
 
         return status, headers
 
+    def _validate_handshake(self, status, headers):
+        if status != WEBSOCKET_SUCCESS_STATUS:
+            raise WebsocktProtocolError(
+                'Router did not upgrade the connection: "{}"'.format(
+                    ' '.join(headers['status_info']))
+            )
+
+        # the Router proves that it understood the upgrade request by
+        # hashing our key, as only a WebSocket server would
+        expected = b64encode(
+            sha1((self.key + WEBSOCKET_GUID).encode('utf-8')).digest()
+        ).decode('utf-8')
+        if headers.get('sec-websocket-accept') != expected:
+            raise WebsocktProtocolError(
+                'Invalid Sec-WebSocket-Accept: "{}"'.format(
+                    headers.get('sec-websocket-accept'))
+            )
+
 
 class SecureWebSocket(WebSocket):
-    def register_router(self, router):
-        super(SecureWebSocket, self).register_router(router)
+    """ WebSocket over TLS.
 
-        self.ipv = router.ipv
+    Every connection to the one Router shares the ``ssl.SSLContext`` of
+    that Router, and a reconnect resumes the TLS session of the last
+    connection, where possible, to save on a full handshake.
 
-        # PROTOCOL_TLSv1_1 and PROTOCOL_TLSv1_2 are only available if Python is
-        # linked with OpenSSL 1.0.1 or later.
-        try:
-            self.ssl_version = ssl.PROTOCOL_TLSv1_2
-        except AttributeError:
-            raise WampyError("Your Python Environment does not support TLS")
+    """
+
+    def register_router(self, router):
+        super(SecureWebSocket, self).register_router(router)
 
         self.certificate = router.certificate
+        self.ssl_context = router.ssl_context
+        # from the last connection, to resume on the next
+        self.tls_session = None
 
     def _connect(self):
-        _socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        wrapped_socket = ssl.wrap_socket(
-            _socket,
-            ssl_version=self.ssl_version,
-            ciphers="ECDH+AESGCM:DH+AESGCM:ECDH+AES256:DH+AES256:ECDH+AES128:\
-            DH+AES:ECDH+3DES:DH+3DES:RSA+AES:RSA+3DES:!ADH:!AECDH:!MD5:!DSS",
-            cert_reqs=ssl.CERT_REQUIRED,
-            ca_certs=self.certificate,
+        _socket = connect(
+            self.host, self.port, self.ipv,
+            socket_options=self.socket_options,
         )
 
-        try:
-            wrapped_socket.connect((self.host, self.port))
-        except socket_error as exc:
-            if exc.errno == 61:
-                logger.error(
-                    'unable to connect to %s:%s', self.host, self.port
-                )
+        kwargs = {'server_hostname': self.host}
+        if self.tls_session is not None:
+            kwargs['session'] = self.tls_session
 
+        try:
+            self.socket = self.ssl_context.wrap_socket(_socket, **kwargs)
+        except (ssl.SSLError, socket_error) as exc:
+            logger.error(
+                'TLS handshake with %s:%s failed: %s',
+                self.host, self.port, exc,
+            )
+            _socket.close()
             raise
 
-        self.socket = wrapped_socket
+        logger.debug(
+            "TLS session %s",
+            "resumed" if getattr(self.socket, 'session_reused', False)
+            else "established",
+        )
+
+    def _close_socket(self):
+        # TLS 1.3 tickets arrive after the handshake, so the session is
+        # only worth keeping now that the connection is done with
+        session = getattr(self.socket, 'session', None)
+        if session is not None:
+            self.tls_session = session
+
+        super(SecureWebSocket, self)._close_socket()
@@ -4,17 +4,105 @@
 
 import array
 import logging
-import json
 import os
-from struct import pack, unpack_from
+from struct import Struct
 
-from wampy.errors import (
-    WampyError, WebsocktProtocolError, IncompleteFrameError
-)
+import six
+
+from wampy.errors import WebsocktProtocolError, IncompleteFrameError
+from wampy.serializers import JsonSerializer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 logger = logging.getLogger('wampy.networking.frames')
 
+# precompiled, because every frame received passes through one of these
+EXTENDED_LENGTH_16 = Struct('!H')
+EXTENDED_LENGTH_64 = Struct('!Q')
+
+# the client frame header - bar the mask key - for each length bracket
+HEADER_7 = Struct('!BB')
+HEADER_16 = Struct('!BBH')
+HEADER_64 = Struct('!BBQ')
+
+# used for incoming messages when no other serializer has been agreed
+DEFAULT_SERIALIZER = JsonSerializer()
+
+# the status code at the start of the body of a close frame
+CLOSE_CODE = Struct('!H')
+
+# https://tools.ietf.org/html/rfc6455#section-7.4.1
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_UNSUPPORTED_DATA = 1003
+# never sent, but reported when a close frame has no status code
+CLOSE_NO_STATUS = 1005
+CLOSE_INVALID_DATA = 1007
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_MESSAGE_TOO_BIG = 1009
+CLOSE_INTERNAL_ERROR = 1011
+
+# a control frame body may be no more than 125 bytes
+MAX_CLOSE_REASON_LENGTH = 123
+
+# payloads at least this long are masked with NumPy, when it's installed
+NUMPY_MASK_THRESHOLD = 256 * 1024
+
+
+def mask(mask_key, data):
+    """ XOR ``data`` with the 4 byte ``mask_key`` repeated along its length.
+
+    Rather than loop over every byte in Python, the payload and the
+    repeated key are each read as one (very) big integer and XORed in a
+    single operation. Very large payloads are masked a word at a time
+    with NumPy instead, if it's available.
+
+    """
+    length = len(data)
+    if not length:
+        return b''
+
+    if numpy is not None and length >= NUMPY_MASK_THRESHOLD:
+        return _numpy_mask(mask_key, data)
+
+    key = (mask_key * ((length + 3) // 4))[:length]
+    masked = int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')
+    return masked.to_bytes(length, 'big')
+
+
+def _numpy_mask(mask_key, data):
+    length = len(data)
+    word_boundary = length - length % 4
+
+    masked = numpy.frombuffer(data, dtype=numpy.uint8).copy()
+    # both key and payload are viewed with the same (native) byte order,
+    # so a word XOR is exactly a byte by byte XOR
+    words = masked[:word_boundary].view(numpy.uint32)
+    words ^= numpy.frombuffer(mask_key, dtype=numpy.uint32)[0]
+
+    key_bytes = bytearray(mask_key)
+    for i in range(word_boundary, length):
+        masked[i] ^= key_bytes[i % 4]
+
+    return masked.tobytes()
+
+
+if not hasattr(int, 'from_bytes'):  # pragma: no cover
+    # Python 2 has no int.from_bytes, so mask byte by byte
+    def mask(mask_key, data):  # noqa: F811
+        _m = array.array("B", mask_key)
+        _d = array.array("B", data)
+
+        for i in range(len(_d)):
+            _d[i] ^= _m[i % 4]
+
+        return _d.tostring()
+
 
 class Frame(object):
     """ The framing is what distinguishes the connection from a raw TCP
@@ -86,16 +174,11 @@ class Frame(object):
 
     def __len__(self):
         # UTF-8 is an unicode encoding which uses more than one byte for
-        # special characters. calculating the length needs consideration.
-        try:
-            unicode_body = self.body.decode("utf-8")
-        except UnicodeError:
-            unicode_body = self.body
-        except AttributeError:
-            # already decoded, hence no "decode" attribute
-            unicode_body = self.body
+        # special characters, so only the encoded length will do.
+        if isinstance(self.body, six.text_type):
+            return len(self.body.encode('utf-8'))
 
-        return len(unicode_body.encode('utf-8'))
+        return len(self.body)
 
     def __str__(self):
         return self.body
@@ -103,53 +186,62 @@ class Frame(object):
 
 class ClientFrame(Frame):
     """ Represent outgoing Client -> Server messages
-    """
 
-    def __init__(self, bytes):
-        super(ClientFrame, self).__init__(bytes)
-
-        self.fin_bit = 1
-        self.rsv1_bit = 0
-        self.rsv2_bit = 0
-        self.rsv3_bit = 0
-        self.opcode = self.OPCODE_TEXT
-        self.payload = self.generate_payload()
+    The message is encoded to UTF-8 exactly once, here on instantiation.
+    The frame is then held as two parts: the ``header`` (which includes
+    the mask key) and the ``masked_body``, so that a transport can write
+    them out together without first concatenating them.
 
-    def data_to_bytes(self, data):
-        return bytearray(data, 'utf-8')
+    """
+    OPCODE = Frame.OPCODE_TEXT
 
-    def generate_mask(self, mask_key, data):
-        """ Mask data.
+    def __init__(self, bytes, opcode=None, fin=True, rsv1=False):
+        """ A frame to send to the Router.
 
         :Parameters:
-            mask_key: byte string
-                4 byte string(byte), e.g. '\x10\xc6\xc4\x16'
-            data: str
-                data to mask
+            bytes : bytes or str
+                The frame body. Text is encoded to UTF-8.
+            opcode : int
+                Optional. Defaults to the ``OPCODE`` of the class, e.g.
+                text for a ``ClientFrame``.
+            fin : bool
+                ``False`` for every fragment of a message but the last.
+            rsv1 : bool
+                Set on the first frame of a compressed message.
 
         """
-        # Masking of WebSocket traffic from client to server is required
-        # because of the unlikely chance that malicious code could cause
-        # some broken proxies to do the wrong thing and use this as an
-        # attack of some kind. Nobody has proved that this could actually
-        # happen, but since the fact that it could happen was reason enough
-        # for browser vendors to get twitchy, masking was added to remove
-        # the possibility of it being used as an attack.
-        if data is None:
-            data = ""
+        super(ClientFrame, self).__init__(self.data_to_bytes(bytes))
 
-        data_bytes = self.data_to_bytes(data)
+        self.fin_bit = int(fin)
+        self.rsv1_bit = int(rsv1)
+        self.rsv2_bit = 0
+        self.rsv3_bit = 0
+        self.opcode = self.OPCODE if opcode is None else opcode
 
-        _m = array.array("B", mask_key)
-        _d = array.array("B", data_bytes)
+        # we always mask frames from the client to server, lest broken
+        # proxies be tricked into caching what looks like another request.
+        # use a string of n random bytes for the mask
+        self.mask_key = os.urandom(4)
+        self.header = self.generate_header()
+        self.masked_body = mask(self.mask_key, self.body)
 
-        for i in range(len(_d)):
-            _d[i] ^= _m[i % 4]
+    @property
+    def payload(self):
+        """ The complete frame as a single bytes string.
+        """
+        return self.header + self.masked_body
 
-        return _d.tostring()
+    def data_to_bytes(self, data):
+        if data is None:
+            return b''
 
-    def generate_payload(self):
-        """ Format data to string (bytes) to send to server.
+        if isinstance(data, six.text_type):
+            return data.encode('utf-8')
+
+        return data
+
+    def generate_header(self):
+        """ Format the frame header, mask key included, as bytes.
         """
         # the first byte contains the FIN bit, the 3 RSV bits and the
         # 4 opcode bits and for a client will *always* be 1000 0001 (or 129).
@@ -163,17 +255,15 @@ class ClientFrame(Frame):
         # | |1|2|3|       |
         # +-+-+-+-+-------+
 
-        # this shifts each bit into position and bitwise ORs them together,
-        # using the struct module to pack them as incoming network bytes
-        payload = pack(
-            '!B', (
-                (self.fin_bit << 7) |
-                self.opcode
-            )
+        # this shifts each bit into position and bitwise ORs them together
+        first_byte = (
+            (self.fin_bit << 7) |
+            (self.rsv1_bit << 6) |
+            (self.rsv2_bit << 5) |
+            (self.rsv3_bit << 4) |
+            self.opcode
         )  # which is '\x81' as a raw byte repr
 
-        # note that because all RSV bits are zero, we can ignore them
-
         # the second byte - and maybe the 7 after this, we'll use to tell
         # the server how long our payload is.
 
@@ -191,136 +281,247 @@ class ClientFrame(Frame):
         # i.e. encoded
         mask_bit = 1 << 7
         # next we have to | this bit with the payload length, if not too long!
-        length = len(self)
+        length = len(self.body)
         if length >= self.MAX_LENGTH:
             raise WebsocktProtocolError("data is too long")
 
-        # the second byte contains the payload length and mask
+        # the second byte contains the payload length and mask, and the
+        # header is packed in one go using the struct module as network bytes
         if length < self.LENGTH_7:
             # we can simply represent payload length with first 7 bits
-            payload += pack('!B', (mask_bit | length))
+            header = HEADER_7.pack(first_byte, mask_bit | length)
         elif length < self.LENGTH_16:
-            payload += pack('!B', (mask_bit | 126)) + pack('!H', length)
+            header = HEADER_16.pack(first_byte, mask_bit | 126, length)
         else:
-            payload += pack('!B', (mask_bit | 127)) + pack('!Q', length)
+            header = HEADER_64.pack(first_byte, mask_bit | 127, length)
 
-        # we always mask frames from the client to server
-        # use a string of n random bytes for the mask
-        mask_key = os.urandom(4)
+        # this is a bytes string being returned here
+        return header + self.mask_key
 
-        mask_data = self.generate_mask(mask_key=mask_key, data=self.body)
-        mask = mask_key + mask_data
-        payload += mask
+    def generate_payload(self):
+        """ Format data to string (bytes) to send to server.
+        """
+        return self.payload
 
-        # this is a bytes string being returned here
-        return payload
 
+class PingFrame(ClientFrame):
+    OPCODE = Frame.OPCODE_PING
 
-class PongFrame(ClientFrame):
+    def data_to_bytes(self, data):
+        return data
 
-    def __init__(self, *args):
-        super(PongFrame, self).__init__(*args)
-        self.opcode = 0xa
-        self.payload = self.generate_payload()
+
+class PongFrame(ClientFrame):
+    OPCODE = Frame.OPCODE_PONG
 
     def data_to_bytes(self, data):
         return data
 
 
+class CloseFrame(ClientFrame):
+    """ Starts, or else answers, the closing handshake.
+    """
+    OPCODE = Frame.OPCODE_CLOSE
+
+    def __init__(self, code=CLOSE_NORMAL, reason=u''):
+        if code is None:
+            body = b''
+        else:
+            # the reason must fit in a control frame, but must also still
+            # be valid UTF-8 once cut short
+            reason = reason.encode('utf-8')[:MAX_CLOSE_REASON_LENGTH]
+            reason = reason.decode('utf-8', 'ignore').encode('utf-8')
+            body = CLOSE_CODE.pack(code) + reason
+
+        super(CloseFrame, self).__init__(body)
+
+
 class ServerFrame(Frame):
     """ Represent incoming Server -> Client messages
     """
 
-    def __init__(self, bytes):
+    def __init__(
+        self, bytes, header_length=None, payload_length=None,
+        serializer=DEFAULT_SERIALIZER, body=None,
+    ):
+        """ A complete frame read from the Router.
+
+        :Parameters:
+            bytes : bytes
+                The raw frame, header and all - or just the header, when
+                ``body`` is given.
+            header_length : int
+                Optional. The number of header bytes, when already known
+                to the caller, e.g. the ``FrameReader``.
+            payload_length : int
+                Optional. The length of the payload, as with
+                ``header_length``.
+            serializer : instance
+                Decodes the payload of data messages, e.g. a
+                ``wampy.serializers.JsonSerializer``.
+            body : bytes
+                Optional. The payload, when the caller has already cut
+                it from the frame, e.g. the ``FrameReader``, which then
+                needn't copy it twice.
+
+        """
         super(ServerFrame, self).__init__(bytes)
+        self.serializer = serializer
 
         if not bytes:
             return
 
-        try:
-            self.payload_length_indicator = bytes[1] & 0b1111111
-        except Exception:
-            raise IncompleteFrameError(required_bytes=1)
+        if body is None:
+            if header_length is None:
+                # if this doesn't raise, we have a complete frame
+                header_length, payload_length = self.ensure_complete_frame(
+                    bytes)
+            body = bytes[header_length:header_length + payload_length]
 
-        # if this doesn't raise, all the above will receive a value
-        self.ensure_complete_frame(bytes)
+        # indexed so as to get an int on Python 2 as well
+        first_byte = six.indexbytes(bytes, 0)
+        second_byte = six.indexbytes(bytes, 1)
+
+        self.payload_length_indicator = second_byte & 0b1111111
+        self.body = body
 
         # server must not mask the payload
-        mask = bytes[1] >> 7
+        mask = second_byte >> 7
         assert mask == 0
 
         self.buffered_bytes = bytes
 
         self.len = 0
         # Parse the first two bytes of header.
-        self.fin = bytes[0] >> 7
+        self.fin = first_byte >> 7
+        # set when the message is compressed, e.g. by permessage-deflate
+        self.rsv1 = (first_byte >> 6) & 1
+        self.opcode = first_byte & 0b1111
+
+        if self.is_control:
+            # e.g. a ping, which has a non-wamp payload
+            self.payload = self.body
+        elif self.fin and self.opcode != self.OPCODE_CONT and not self.rsv1:
+            # Wamp data frames contain a serialized (e.g. JSON) payload,
+            # in either a text or a binary frame.
+            self.payload = self.decode_payload(self.body)
+        else:
+            # this is just a fragment of a message, or it's compressed, and
+            # it's only once the whole message has been put back together
+            # and decompressed that the payload can be decoded.
+            self.payload = None
+
+    @classmethod
+    def from_message(cls, opcode, body, serializer=DEFAULT_SERIALIZER):
+        """ A complete message whose body has been put together from
+        elsewhere, i.e. reassembled from the bodies of a sequence of
+        fragments and/or decompressed. ``opcode`` is that of the first
+        frame of the message.
+        """
+        frame = cls(None, serializer=serializer)
+        frame.fin = 1
+        frame.rsv1 = 0
+        frame.opcode = opcode
+        frame.body = body
+        frame.payload = frame.decode_payload(body)
+        return frame
+
+    @property
+    def close_code(self):
+        """ The status code of a close frame, or ``CLOSE_NO_STATUS`` if it
+        doesn't have one.
+        """
+        if len(self.body) < 2:
+            if self.body:
+                raise WebsocktProtocolError("truncated close frame")
+            return CLOSE_NO_STATUS
+
+        return CLOSE_CODE.unpack_from(self.body)[0]
 
-        if self.fin == 0:
-            logger.exception("Multiple Frames Returned: %s", bytes)
-            raise WampyError(
-                'Multiple framed responses not yet supported: {}'.format(bytes)
+    @property
+    def close_reason(self):
+        try:
+            return self.body[2:].decode('utf-8')
+        except UnicodeDecodeError:
+            raise WebsocktProtocolError(
+                "close reason is not UTF-8: {!r}".format(self.body[2:])
             )
 
-        self.opcode = bytes[0] & 0b1111
-
-        if self.opcode != 9:
-            # Wamp data frames contain a json-encoded payload.
-            # The other kind of frame we handle (opcode 0x9) is a ping and it
-            # has a non-json payload
-            try:
-                # decode required before loading JSON for python 2 only
-                self.payload = json.loads(self.body.decode('utf-8'))
-            except Exception:
-                raise WebsocktProtocolError(
-                    'Failed to load JSON object from: "%s"', self.body
-                )
-        else:
-            self.payload = self.body
+    @property
+    def is_control(self):
+        # control frames (close, ping and pong) all have the most
+        # significant bit of the opcode set, and may arrive in between the
+        # fragments of a data message
+        return self.opcode & 0x8 == 0x8
 
-    def ensure_complete_frame(self, buffered_bytes):
+    def decode_payload(self, body):
+        try:
+            return self.serializer.deserialize(body)
+        except Exception:
+            raise WebsocktProtocolError(
+                'Failed to load {} object from: "{}"'.format(
+                    self.serializer.SUBPROTOCOL, body)
+            )
+
+    @staticmethod
+    def parse_header(buffered_bytes):
+        """ Return the header length and payload length of the frame at
+        the start of ``buffered_bytes``.
+
+        Raises ``IncompleteFrameError`` if not enough of the header has
+        been buffered yet to tell.
+
+        """
         # we need a minimum of 2 bytes to determine the payload length and
         # hence whether this is a complete frame or not.
         if len(buffered_bytes) < 2:
-            # there are more bytes to receive.
-            raise IncompleteFrameError(required_bytes=1)
-
-        payload_length_indicator = buffered_bytes[1] & 0b1111111
-        available_bytes_for_body = buffered_bytes[2:]
-
-        try:
-            available_bytes_for_body[1]
-        except IndexError:
-            raise IncompleteFrameError(required_bytes=payload_length_indicator)
+            raise IncompleteFrameError(required_bytes=2 - len(buffered_bytes))
 
-        # unpack the buffered bytes into an integer
-        body_length = unpack_from(">h", available_bytes_for_body)[0]
+        payload_length_indicator = (
+            six.indexbytes(buffered_bytes, 1) & 0b1111111)
 
         if payload_length_indicator < 126:
             # then we have enough knowlege about the payload length as it's
             # contained within the 2nd byte of the header - because the
             # trailing 7 bits of the 2 bytes tells us exactly how long the
             # payload is
-            body_candidate = available_bytes_for_body
-            # in this case body length is represented by the indicator
-            body_length = payload_length_indicator
+            return 2, payload_length_indicator
 
-        elif payload_length_indicator == 126:
+        if payload_length_indicator == 126:
             # then we don't have enough knowledge yet.
             # and actually the following two bytes indicate the payload length.
-            # get all buffered bytes beyond the header and the excluded 2 bytes
-            body_candidate = available_bytes_for_body[2:]  # require >= 2 bytes
-
+            header_length = 4
+            length_struct = EXTENDED_LENGTH_16
         else:
             # actually, the following eight bytes indicate the payload length.
-            # so check we have at least as much as we need, else exit.
-            body_candidate = available_bytes_for_body[6:]  # require >= 8 bytes
+            header_length = 10
+            length_struct = EXTENDED_LENGTH_64
+
+        if len(buffered_bytes) < header_length:
+            raise IncompleteFrameError(
+                required_bytes=header_length - len(buffered_bytes)
+            )
+
+        # unpack the extended length straight out of the buffer - there's
+        # no need to copy any of it first. both are unsigned, network order.
+        body_length = length_struct.unpack_from(buffered_bytes, 2)[0]
+        if body_length >= Frame.MAX_LENGTH:
+            # the most significant bit must be 0
+            raise WebsocktProtocolError(
+                "invalid payload length: {}".format(body_length)
+            )
+
+        return header_length, body_length
+
+    def ensure_complete_frame(self, buffered_bytes):
+        header_length, body_length = self.parse_header(buffered_bytes)
 
-        if len(body_candidate) < body_length:
-            required_bytes = body_length - len(body_candidate)
+        available_bytes_for_body = len(buffered_bytes) - header_length
+        if available_bytes_for_body < body_length:
+            required_bytes = body_length - available_bytes_for_body
             logger.debug("missing %s bytes", required_bytes)
             raise IncompleteFrameError(
                 required_bytes=required_bytes
             )
 
-        self.body = body_candidate
-        self.payload_length_indicator = payload_length_indicator
+        return header_length, body_length
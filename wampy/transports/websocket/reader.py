@@ -0,0 +1,313 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+from collections import deque
+
+from wampy.constants import MAX_MESSAGE_SIZE
+from wampy.errors import (
+    IncompleteFrameError, MessageTooBigError, WebsocktProtocolError,
+)
+from wampy.transports.sockets import DEFAULT_BUFFER_SIZE, recv_into
+
+from . frames import DEFAULT_SERIALIZER, Frame, ServerFrame
+
+logger = logging.getLogger('wampy.networking.reader')
+
+
+class FrameReader(object):
+    """ Buffered, incremental reader of Server -> Client frames.
+
+    Bytes are read from the socket in large chunks straight into a
+    single, reusable ``bytearray``. A frame header is parsed just the
+    once, after which the reader only waits for the remaining body
+    bytes to arrive. Every complete frame in the buffer is sliced out
+    on each pass, and any leftover bytes stay buffered for the next
+    call.
+
+    Fragmented messages are put back together by ``read_message`` in
+    a second buffer that is likewise allocated once and then re-used,
+    and which may never grow beyond ``max_message_size``.
+
+    Neither buffer is grown for a frame longer than ``max_frame_size``,
+    or one that would take its message beyond ``max_message_size``:
+    ``MessageTooBigError`` is raised as soon as its header is read.
+
+    """
+
+    def __init__(
+            self, socket, bufsize=DEFAULT_BUFFER_SIZE,
+            max_message_size=MAX_MESSAGE_SIZE, compression=None,
+            serializer=DEFAULT_SERIALIZER, initial_bytes=b'',
+            max_frame_size=None,
+    ):
+        self.socket = socket
+        # decodes the payload of every data message
+        self.serializer = serializer
+        self.bufsize = bufsize
+        self.max_message_size = max_message_size
+        self.max_frame_size = max_frame_size or max_message_size
+        # the negotiated ``PerMessageDeflate``, if any
+        self.compression = compression
+
+        # ``initial_bytes`` were read from the socket before we had it,
+        # e.g. along with the upgrade response
+        self._buffer = bytearray(max(bufsize, len(initial_bytes)))
+        self._buffer[:len(initial_bytes)] = initial_bytes
+        # the unconsumed bytes are ``self._buffer[self._start:self._end]``
+        self._start = 0
+        self._end = len(initial_bytes)
+        # header length and payload length of the frame at ``_start``,
+        # once we have seen enough of it to know
+        self._header = None
+        self._frames = deque()
+        # the length of the data message being parsed, going by the
+        # headers of its fragments so far
+        self._incoming_length = 0
+
+        # the message being reassembled is ``self._message[:_message_length]``
+        self._message = bytearray(bufsize)
+        self._message_length = 0
+        # the opcode of the first fragment, and so of the whole message
+        self._message_opcode = None
+        self._message_compressed = False
+
+    @property
+    def buffered_bytes(self):
+        return self._end - self._start
+
+    def read_frame(self):
+        """ Return the next complete ``ServerFrame``, or ``None`` if the
+        peer closed the connection.
+        """
+        while not self._frames:
+            self._parse_frames()
+            if self._frames:
+                break
+
+            if not self._fill():
+                return None
+
+        return self._frames.popleft()
+
+    def read_message(self):
+        """ Return the next control frame or complete data message, or
+        ``None`` if the peer closed the connection.
+
+        Control frames (e.g. a ping) are returned as soon as they are
+        read, even when they arrive in between the fragments of a data
+        message.
+
+        """
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return frame
+
+            if frame.rsv1 and (
+                self.compression is None or frame.is_control or
+                frame.opcode == Frame.OPCODE_CONT
+            ):
+                raise WebsocktProtocolError(
+                    "unexpected RSV1 bit on frame with opcode {}".format(
+                        frame.opcode)
+                )
+
+            if frame.is_control:
+                if not frame.fin:
+                    raise WebsocktProtocolError(
+                        "control frames must not be fragmented"
+                    )
+                return frame
+
+            if frame.opcode != Frame.OPCODE_CONT:
+                if self._message_opcode is not None:
+                    raise WebsocktProtocolError(
+                        "expected a continuation frame, got opcode {}".format(
+                            frame.opcode)
+                    )
+
+                if frame.fin:
+                    # the common case: a message all in the one frame
+                    if frame.rsv1:
+                        return ServerFrame.from_message(
+                            frame.opcode, self._decompress(frame.body),
+                            serializer=self.serializer,
+                        )
+                    return frame
+
+                self._message_opcode = frame.opcode
+                self._message_compressed = bool(frame.rsv1)
+
+            elif self._message_opcode is None:
+                raise WebsocktProtocolError(
+                    "continuation frame without a message to continue"
+                )
+
+            self._add_fragment(frame.body)
+
+            if frame.fin:
+                return self._complete_message()
+
+    def _add_fragment(self, body):
+        message_length = self._message_length + len(body)
+        if message_length > self.max_message_size:
+            raise MessageTooBigError(
+                "fragmented message exceeds the maximum size of {} "
+                "bytes".format(self.max_message_size)
+            )
+
+        if message_length > len(self._message):
+            # grow geometrically so that a message in many fragments is
+            # not copied over and over again
+            capacity = min(
+                max(message_length, 2 * len(self._message)),
+                self.max_message_size,
+            )
+            message = bytearray(capacity)
+            message[:self._message_length] = (
+                memoryview(self._message)[:self._message_length])
+            self._message = message
+
+        self._message[self._message_length:message_length] = body
+        self._message_length = message_length
+
+    def _decompress(self, body):
+        return self.compression.decompress(
+            body, max_length=self.max_message_size)
+
+    def _complete_message(self):
+        body = memoryview(self._message)[:self._message_length].tobytes()
+        if self._message_compressed:
+            body = self._decompress(body)
+        message = ServerFrame.from_message(
+            self._message_opcode, body, serializer=self.serializer)
+
+        self._message_opcode = None
+        self._message_compressed = False
+        self._message_length = 0
+        if len(self._message) > self.bufsize:
+            # don't hang on to the memory used by one unusually large message
+            self._message = bytearray(self.bufsize)
+
+        return message
+
+    def _parse_frames(self):
+        view = memoryview(self._buffer)
+
+        while True:
+            if self._header is None:
+                try:
+                    self._header = ServerFrame.parse_header(
+                        view[self._start:self._end]
+                    )
+                except IncompleteFrameError:
+                    break
+
+                try:
+                    self._check_frame_size(self._header[1])
+                except MessageTooBigError:
+                    if not self._frames:
+                        raise
+                    # but not before the frames ahead of it are read
+                    self._header = None
+                    break
+
+            header_length, payload_length = self._header
+            frame_length = header_length + payload_length
+            if self.buffered_bytes < frame_length:
+                break
+
+            # the body is copied out of the buffer just the once
+            body_start = self._start + header_length
+            end = body_start + payload_length
+            frame = ServerFrame(
+                view[self._start:body_start].tobytes(),
+                body=view[body_start:end].tobytes(),
+                serializer=self.serializer,
+            )
+            self._frames.append(frame)
+
+            self._start = end
+            self._header = None
+
+        if self._start == self._end:
+            # everything has been consumed, so rewind to re-use the buffer
+            # from the beginning
+            self._start = self._end = 0
+
+        if len(self._buffer) > self.bufsize:
+            # don't hang on to the memory used by one unusually large frame
+            # once it's read, unless the next needs it too
+            required = sum(self._header) if self._header else 0
+            buffered = self.buffered_bytes
+            if max(required, buffered) <= self.bufsize:
+                buffer = bytearray(self.bufsize)
+                buffer[:buffered] = view[self._start:self._end]
+                self._buffer = buffer
+                self._start = 0
+                self._end = buffered
+
+    def _check_frame_size(self, payload_length):
+        # before anything is allocated for the frame, on the word of its
+        # header alone
+        if payload_length > self.max_frame_size:
+            raise MessageTooBigError(
+                "frame of {} bytes exceeds the maximum size of {} "
+                "bytes".format(payload_length, self.max_frame_size)
+            )
+
+        first_byte = self._buffer[self._start]
+        if first_byte & 0x08:
+            # a control frame, which has no part in a data message
+            return
+
+        message_length = self._incoming_length + payload_length
+        if message_length > self.max_message_size:
+            raise MessageTooBigError(
+                "message exceeds the maximum size of {} bytes".format(
+                    self.max_message_size)
+            )
+
+        # the final fragment completes the message
+        self._incoming_length = 0 if first_byte & 0x80 else message_length
+
+    def _make_room(self):
+        if self._header is not None:
+            required = sum(self._header)
+        else:
+            # not even the header is complete yet, but it can never be
+            # more than 14 bytes long
+            required = 14
+
+        required = max(required, self.buffered_bytes + 1)
+        if len(self._buffer) - self._start >= required:
+            return
+
+        if len(self._buffer) >= required:
+            # there's space enough if we shift what we have to the front
+            buffered = self.buffered_bytes
+            self._buffer[:buffered] = self._buffer[self._start:self._end]
+        else:
+            # this frame is bigger than anything we've seen before
+            buffered = self.buffered_bytes
+            new_buffer = bytearray(required)
+            new_buffer[:buffered] = self._buffer[self._start:self._end]
+            self._buffer = new_buffer
+
+        self._start = 0
+        self._end = buffered
+
+    def _fill(self):
+        self._make_room()
+        view = memoryview(self._buffer)
+
+        received = recv_into(self.socket, view[self._end:])
+        logger.debug("received %s bytes", received)
+
+        if not received:
+            return False
+
+        self._end += received
+        return True
@@ -0,0 +1,379 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import itertools
+import logging
+from collections import deque
+
+import eventlet
+from eventlet.event import Event
+
+from wampy.errors import ConnectionError, SendBufferFullError, WampyError
+
+logger = logging.getLogger(__name__)
+
+# the most bytes gathered up for one write, so that a control frame
+# never waits long behind a large message
+MAX_BATCH_SIZE = 256 * 1024
+
+# what to do with a message sent while the send buffer is full
+BLOCK = 'block'
+RAISE = 'raise'
+DROP_OLDEST = 'drop-oldest'
+
+
+class FlowControl(object):
+    """ Bounds how much may wait to be sent to the Router.
+
+    Pass an instance to the ``Router`` (or ``Client``) to stop a slow
+    Router, or network, from letting unsent messages pile up without
+    limit.
+
+    """
+
+    def __init__(
+        self, high_watermark, low_watermark=None, when_full=BLOCK,
+        on_writable=None,
+    ):
+        """ Configure the send buffer.
+
+        :Parameters:
+            high_watermark : int
+                Once this many bytes are waiting to be sent, the
+                connection is no longer writable.
+            low_watermark : int
+                Optional. The connection is writable again once no more
+                than this many bytes are waiting. Defaults to half of
+                ``high_watermark``.
+            when_full : str
+                What a send does while the connection isn't writable:
+                ``"block"`` until it is (the default), ``"raise"``
+                ``SendBufferFullError``, or ``"drop-oldest"`` to make
+                room by dropping the oldest messages yet to be sent,
+                or, should that not make room, the one being sent.
+            on_writable : callable
+                Optional. Called with ``True`` or ``False`` whenever the
+                connection becomes writable, or stops being so.
+
+        Messages that are compressed are never dropped, as the Router
+        could no longer decompress those that came after them, and so
+        wait for room instead.
+
+        """
+        if low_watermark is None:
+            low_watermark = high_watermark // 2
+
+        if not 0 <= low_watermark < high_watermark:
+            raise WampyError(
+                "low watermark must be less than the high watermark: "
+                "{} >= {}".format(low_watermark, high_watermark)
+            )
+
+        if when_full not in (BLOCK, RAISE, DROP_OLDEST):
+            raise WampyError(
+                "unknown send buffer policy: {}".format(when_full)
+            )
+
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.when_full = when_full
+        self.on_writable = on_writable
+
+
+class Writer(object):
+    """ Writes everything a transport sends from a green thread of its
+    own, so that the rest never block on the socket.
+
+    Whatever has been queued by the time the writer gets to it - up to
+    ``MAX_BATCH_SIZE`` bytes - is written out together, with one call
+    to ``write``, rather than one call per frame. Should ``linger`` be
+    set, the writer first waits that many seconds for more to arrive,
+    unless a control frame or a full batch is already waiting.
+
+    Control frames, e.g. a pong, go out ahead of anything else queued.
+
+    Messages queued with ``put_message`` are subject to ``flow_control``,
+    if given.
+
+    """
+
+    def __init__(self, write, linger=None, flow_control=None):
+        """ A writer.
+
+        :Parameters:
+            write : callable
+                Writes a list of buffers, in full, to the socket.
+            linger : float
+                Optional. Seconds to wait, once there's something to
+                write, for more to write along with it.
+            flow_control : instance
+                Optional. A ``FlowControl``, to bound the bytes waiting
+                to be written.
+
+        """
+        self.write = write
+        self.linger = linger
+        self.flow_control = flow_control
+
+        # why the last write failed, after which there are no more
+        self.error = None
+        self.stopped = False
+        # bytes of data queued, or being written
+        self.buffered = 0
+        self.writable = True
+        # messages dropped to make room, by the "drop-oldest" policy
+        self.dropped = 0
+
+        # each entry is a list of buffers, e.g. a frame header and body
+        self._control = deque()
+        # as are these, along with their size and the message they're
+        # from, if it may be dropped
+        self._data = deque()
+        self._message_ids = itertools.count()
+        # the message the writer has started on, which can't be dropped
+        self._current_message = None
+        self._thread = None
+        self._writing = False
+        self._wakeup = None
+        self._drained = None
+        self._writable_event = None
+
+    @property
+    def pending(self):
+        """ Whether anything is waiting to be written.
+        """
+        return bool(self._control or self._data or self._writing)
+
+    def put(self, buffers, control=False):
+        """ Queue ``buffers`` to be written, regardless of flow control.
+        """
+        self._check()
+
+        if control:
+            self._control.append(buffers)
+        else:
+            self._enqueue([buffers], None)
+
+        self._wake()
+
+    def put_message(self, frames, droppable=True):
+        """ Queue the ``frames`` of one message, each a list of buffers,
+        once the send buffer has room for them.
+        """
+        self._check()
+
+        flow_control = self.flow_control
+        if flow_control is not None and not self.writable:
+            if flow_control.when_full == RAISE:
+                raise SendBufferFullError(
+                    "{} bytes are waiting to be sent".format(self.buffered)
+                )
+            elif flow_control.when_full == DROP_OLDEST:
+                self._drop_oldest()
+                if not self.writable and droppable:
+                    # too little queued could be dropped, so this goes
+                    # in its place
+                    self.dropped += 1
+                    logger.warning("dropped a message to make room to send")
+                    return
+
+                # else it waits for room, as nothing may be dropped
+                self._wait_until_writable()
+            else:
+                self._wait_until_writable()
+
+        message_id = next(self._message_ids) if droppable else None
+        self._enqueue(frames, message_id)
+        self._wake()
+
+    def flush(self):
+        """ Wait until everything queued so far has been written, or
+        dropped by ``stop``.
+        """
+        while self.pending and self.error is None:
+            if self._drained is None or self._drained.ready():
+                self._drained = Event()
+            self._drained.wait()
+
+        if self.error is not None:
+            raise self._write_error()
+
+    def stop(self):
+        """ Stop at once, dropping whatever has yet to be written.
+        """
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not eventlet.getcurrent():
+            thread.kill()
+
+        self.stopped = True
+        self._control.clear()
+        self._data.clear()
+        self._writing = False
+        self._current_message = None
+        self.buffered = 0
+        self._notify_drained()
+        # wake anyone blocked on a full buffer, to find the writer gone
+        self._notify_writable()
+
+    def _check(self):
+        if self.error is not None:
+            raise self._write_error()
+
+        if self.stopped:
+            # and its socket closed, so nothing more can be written
+            raise ConnectionError("the connection is closed")
+
+    def _write_error(self):
+        return ConnectionError(
+            'failed to write to socket: "{}"'.format(self.error)
+        )
+
+    def _wake(self):
+        if self.stopped:
+            return
+
+        if self._thread is None:
+            self._thread = eventlet.spawn(self._run)
+        elif self._wakeup is not None and not self._wakeup.ready():
+            self._wakeup.send(True)
+
+    def _enqueue(self, frames, message_id):
+        for buffers in frames:
+            size = sum(len(buffer) for buffer in buffers)
+            self._data.append((buffers, size, message_id))
+            self.buffered += size
+
+        flow_control = self.flow_control
+        if (
+            flow_control is not None and self.writable and
+            self.buffered >= flow_control.high_watermark
+        ):
+            self._set_writable(False)
+
+    def _written(self, size):
+        self.buffered -= size
+
+        flow_control = self.flow_control
+        if (
+            flow_control is not None and not self.writable and
+            self.buffered <= flow_control.low_watermark
+        ):
+            self._set_writable(True)
+
+    def _set_writable(self, writable):
+        self.writable = writable
+        if writable:
+            logger.debug("send buffer drained: %s bytes", self.buffered)
+            self._notify_writable()
+        else:
+            logger.warning("send buffer full: %s bytes", self.buffered)
+
+        if self.flow_control.on_writable is not None:
+            try:
+                self.flow_control.on_writable(writable)
+            except Exception:
+                logger.exception("on_writable callback failed")
+
+    def _wait_until_writable(self):
+        while not self.writable:
+            # a stopped writer's buffer will never drain
+            self._check()
+
+            if (
+                self._writable_event is None or
+                self._writable_event.ready()
+            ):
+                self._writable_event = Event()
+            self._writable_event.wait()
+
+    def _drop_oldest(self):
+        # whole messages only, and never one that's part written
+        target = self.flow_control.low_watermark
+        dropped = self.dropped
+        droppable = [
+            message_id for _, _, message_id in self._data
+            if message_id is not None and
+            message_id != self._current_message
+        ]
+
+        for message_id in sorted(set(droppable)):
+            if self.buffered <= target:
+                break
+
+            kept = deque()
+            for entry in self._data:
+                if entry[2] == message_id:
+                    self.buffered -= entry[1]
+                else:
+                    kept.append(entry)
+            self._data = kept
+            self.dropped += 1
+
+        if self.dropped > dropped:
+            logger.warning(
+                "dropped %s messages to make room to send",
+                self.dropped - dropped,
+            )
+        self._written(0)
+
+    def _run(self):
+        while True:
+            if not (self._control or self._data):
+                self._notify_drained()
+                self._wakeup = Event()
+                self._wakeup.wait()
+
+            if (
+                self.linger and not self._control and
+                self.buffered < MAX_BATCH_SIZE
+            ):
+                # a control frame shouldn't wait, and a full batch needn't
+                eventlet.sleep(self.linger)
+
+            self._writing = True
+            batch, size = self._next_batch()
+
+            try:
+                self.write(batch)
+            except Exception as exc:
+                logger.error("failed to write to socket: %s", exc)
+                self.error = exc
+                self._thread = None
+                self.stop()
+                return
+            finally:
+                self._writing = False
+
+            self._written(size)
+
+    def _next_batch(self):
+        batch = []
+        size = 0
+
+        while self._control and (not batch or size < MAX_BATCH_SIZE):
+            buffers = self._control.popleft()
+            batch.extend(buffers)
+            size += sum(len(buffer) for buffer in buffers)
+
+        # only data counts towards what's buffered
+        data_size = 0
+        while self._data and (not batch or size < MAX_BATCH_SIZE):
+            buffers, entry_size, message_id = self._data.popleft()
+            batch.extend(buffers)
+            size += entry_size
+            data_size += entry_size
+            self._current_message = message_id
+
+        return batch, data_size
+
+    def _notify_drained(self):
+        if self._drained is not None and not self._drained.ready():
+            self._drained.send(True)
+
+    def _notify_writable(self):
+        if (
+            self._writable_event is not None and
+            not self._writable_event.ready()
+        ):
+            self._writable_event.send(True)